@@ -29,8 +29,11 @@ setup(
     entry_points={
         'console_scripts': [
             'zodb-py3migrate-analyze = zodb.py3migrate.analyze:main',
+            'zodb-py3migrate-census = zodb.py3migrate.census:main',
             'zodb-py3migrate-convert = zodb.py3migrate.convert:main',
+            'zodb-py3migrate-index = zodb.py3migrate.index:main',
             'zodb-py3migrate-magic = zodb.py3migrate.magic:main',
+            'zodb-py3migrate-merge = zodb.py3migrate.merge:main',
         ],
     },
 
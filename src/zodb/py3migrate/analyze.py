@@ -1,41 +1,465 @@
 from .migrate import print_results, get_argparse_parser, get_format_string
 from .migrate import get_classname, find_obj_with_binary_content, run
+from .migrate import sorted_by_key
+from .blobs import BlobRecordingStorage, check_blobs, print_blob_report
+from .convert import write_mapping
+from .errors import ErrorSummary
+from .index import select_oids
+from .pacing import get_pacer
+from .profiling import MemoryProfile
+from .storage import ZlibStorage
+import ZODB.FileStorage
+import ZODB.interfaces
+import ZODB.utils
+import argparse
+import codecs
 import collections
+import glob
+import json
 import logging
+import multiprocessing
+import os.path
+import random
 import transaction
 
 
 log = logging.getLogger(__name__)
 
+# Candidate encodings in the order of preference:
+DEFAULT_ENCODINGS = ('utf-8', 'cp1252', 'latin-1')
 
-def analyze_storage(storage, verbose=False, start_at=None, limit=None):
+# Niceness increment for `--nice`:
+NICE_INCREMENT = 10
+
+# Pacer shared by the worker processes analyzing many storages:
+_worker_pacer = None
+
+# Format of the result files written using `--output`:
+RESULT_FORMAT = 'zodb.py3migrate.analyze 1'
+
+
+def add_sample(samples, name, value, count, size):
+    """Keep a random sample of at most `size` values of a field.
+
+    This is a reservoir sample: each of the `count` values seen so far
+    (including `value`) is in the sample with the same probability.
+    Only the first 30 characters of the `repr` of a value are stored.
+    """
+    reservoir = samples.setdefault(name, [])
+    if len(reservoir) < size:
+        reservoir.append('{!r:.30}'.format(value))
+    else:
+        i = random.randrange(count)
+        if i < size:
+            reservoir[i] = '{!r:.30}'.format(value)
+
+
+def analyze_storage(storage, start_at=None, limit=None, oids=None,
+                    samples=None, sample_size=5, pacer=None, profile=None,
+                    error_summary=None):
     """Analyze a ``FileStorage``.
 
+    `samples` ... dict which gets filled with a list of at most `sample_size`
+                  sample values for each dotted name in `result`.
+    `pacer` ... `.pacing.Pacer` limiting the rate objects are read at.
+    `profile` ... `.profiling.MemoryProfile` recording the memory use.
+    `error_summary` ... `.errors.ErrorSummary` counting the values which
+                        cannot be scanned.
+
     Returns a tuple `(result, errors)`
     Where
       `result` is a dict mapping a dotted name of an attribute to the
         number of occurrences in the storage and
       `errors` is a dict mapping a dotted name of a class those instances have
         no `__dict__` to the number of occurrences.
+
+    The memory needed depends on the number of dotted names but not on the
+    number of occurrences.
     """
     result = collections.defaultdict(int)
     errors = collections.defaultdict(int)
+    if profile is not None:
+        profile.watch(result=result, errors=errors)
     for obj, data, key, value, type_ in find_obj_with_binary_content(
-            storage, errors, start_at=start_at, limit=limit):
+            storage, errors, start_at=start_at, limit=limit, oids=oids,
+            pacer=pacer, profile=profile, error_summary=error_summary):
         klassname = get_classname(obj)
-        format_string = get_format_string(
-            obj, display_type=True, verbose=verbose)
-        result[format_string.format(**locals())] += 1
+        format_string = get_format_string(obj, display_type=True)
+        name = format_string.format(**locals())
+        result[name] += 1
+        if samples is not None:
+            add_sample(samples, name, value, result[name], sample_size)
 
     return result, errors
 
 
-def analyze(storage, verbose=False, start_at=None, limit=None):
-    """Analyse a whole file storage and print out the results."""
+def parse_shard(value):
+    """Parse a shard given as `i/N` into a tuple `(i, N)`."""
+    try:
+        number, shards = [int(x) for x in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            '{!r} is not of the form i/N.'.format(value))
+    if not 1 <= number <= shards:
+        raise argparse.ArgumentTypeError(
+            'The shard number of {!r} is not between 1 and N.'.format(value))
+    return number, shards
+
+
+def parse_encodings(value):
+    """Parse a comma separated list of encodings into a list of names."""
+    encodings = value.split(',')
+    for encoding in encodings:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise argparse.ArgumentTypeError(
+                '{!r} is not a known encoding.'.format(encoding))
+    return encodings
+
+
+def iter_oid_range(storage, start, stop):
+    """Iterate the OIDs of the current records in `storage` in a range.
+
+    `start`, `stop` ... integers, `stop` is not included.
+    """
+    next = ZODB.utils.p64(start)
+    while next is not None:
+        try:
+            oid, tid, data, next = storage.record_iternext(next)
+        except ValueError:
+            # There is no OID >= `start`.
+            return
+        if ZODB.utils.u64(oid) >= stop:
+            return
+        yield oid
+
+
+def select_shard(storage, oids, shard):
+    """Restrict `oids` to a shard of the OIDs of `storage`.
+
+    `oids` ... iterable of OIDs as returned by `select_oids`, `None` means
+               all OIDs of the storage.
+    `shard` ... tuple `(i, N)`, the range of OIDs of the storage gets split
+                into N ranges of equal size, the OIDs in the i-th one are
+                returned.
+
+    The shards only depend on the storage, so they can be analyzed on
+    different machines.
+    """
+    number, shards = shard
+    size = (ZODB.utils.u64(storage._oid) + shards) // shards
+    start, stop = (number - 1) * size, number * size
+    if oids is None:
+        return iter_oid_range(storage, start, stop)
+    return (x for x in oids if start <= ZODB.utils.u64(x) < stop)
+
+
+def write_result(path, storage, result, errors, samples, shard,
+                 error_summary):
+    """Write the result of an analysis to a JSON file at `path`.
+
+    `error_summary` ... `.errors.ErrorSummary` of the analysis.
+
+    The files of the shards of an analysis get merged using
+    `.merge.merge_results`. The last transaction and the largest OID of
+    `storage` tell whether the shards are of the same storage.
+    """
+    with open(path, 'w') as file:
+        json.dump({
+            'format': RESULT_FORMAT,
+            'storage': storage.getName(),
+            'last_transaction': ZODB.utils.tid_repr(
+                storage.lastTransaction()),
+            'max_oid': ZODB.utils.oid_repr(storage._oid),
+            'shard': shard,
+            'result': result,
+            'errors': errors,
+            'samples': samples,
+            'error_summary': error_summary.as_json(),
+        }, file, indent=1, sort_keys=True)
+
+
+def print_samples(samples):
+    """Print the sample values of each field."""
+    print
+    print "Sample values:"
+    for name, values in sorted_by_key(samples):
+        for value in values:
+            print "{}: {}".format(name, value)
+
+
+def decodes(value, encoding):
+    """Tell whether `value` can be decoded using `encoding`."""
+    try:
+        value.decode(encoding)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def count_clean_decodes(batch, encodings, counts):
+    """Count the values in `batch` each of the `encodings` decodes.
+
+    `batch` ... dict mapping values to their number of occurrences.
+    `counts` ... list with a counter for each encoding which gets updated.
+    """
+    for i, encoding in enumerate(encodings):
+        counts[i] += sum(number for value, number in batch.items()
+                         if decodes(value, encoding))
+
+
+def analyze_encodings(storage, encodings, start_at=None, limit=None,
+                      oids=None, batch_size=1000, pacer=None,
+                      error_summary=None):
+    """Test the binary strings of each field against candidate encodings.
+
+    The values of a field are collected into batches of distinct values,
+    each batch is tested against all encodings at once.
+
+    `error_summary` ... `.errors.ErrorSummary` counting the values which
+                        cannot be scanned.
+
+    Returns a tuple `(matrix, totals, errors)`
+    Where
+      `matrix` is a dict mapping the dotted name of a field to a list
+        containing the number of values each encoding decodes cleanly,
+      `totals` is a dict mapping the dotted name of a field to the number of
+        its values and
+      `errors` is the same as returned by `analyze_storage`.
+    """
+    matrix = collections.defaultdict(lambda: [0] * len(encodings))
+    totals = collections.defaultdict(int)
+    errors = collections.defaultdict(int)
+    batches = collections.defaultdict(collections.Counter)
+    for obj, data, key, value, type_ in find_obj_with_binary_content(
+            storage, errors, start_at=start_at, limit=limit, oids=oids,
+            pacer=pacer, error_summary=error_summary):
+        if type_ != 'string':
+            # Only strings can be decoded by the conversion.
+            continue
+        klassname = get_classname(obj)
+        dotted_name = get_format_string(obj).format(**locals())
+        totals[dotted_name] += 1
+        batches[dotted_name][value] += 1
+        if len(batches[dotted_name]) >= batch_size:
+            count_clean_decodes(
+                batches.pop(dotted_name), encodings, matrix[dotted_name])
+    for dotted_name, batch in batches.items():
+        count_clean_decodes(batch, encodings, matrix[dotted_name])
+    return matrix, totals, errors
+
+
+def choose_encodings(matrix, totals, encodings):
+    """Choose the first encoding which decodes all values of each field.
+
+    Fields no encoding decodes cleanly get marked as `zodbpickle.binary`.
+    Returns a mapping as returned by `read_mapping`.
+    """
+    mapping = {}
+    for dotted_name, counts in matrix.items():
+        mapping[dotted_name] = 'zodbpickle.binary'
+        for encoding, count in zip(encodings, counts):
+            if count == totals[dotted_name]:
+                mapping[dotted_name] = encoding
+                break
+    return mapping
+
+
+def print_encodings(matrix, totals, encodings):
+    """Print the rate of clean decodes for each field and encoding."""
+    print "Tested {} binary fields: (number of values, clean decodes)".format(
+        len(matrix))
+    for dotted_name, counts in sorted_by_key(matrix):
+        total = totals[dotted_name]
+        print "{} ({}): {}".format(dotted_name, total, ', '.join(
+            '{} {:.1f}%'.format(encoding, 100.0 * count / total)
+            for encoding, count in zip(encodings, counts)))
+
+
+def analyze(storage, verbose=False, start_at=None, limit=None,
+            use_index=False, reachable_only=False, encodings=None,
+            config_path=None, max_read_rate=None, max_objects_per_sec=None,
+            profile_path=None, shard=None, output_path=None, order='oid',
+            trace_errors=False):
+    """Analyse a whole file storage and print out the results.
+
+    If `encodings` or `config_path` is given, test the binary strings against
+    the encodings and optionally write a conversion config file.
+
+    `max_read_rate` ... MB of objects to read per second at most.
+    `max_objects_per_sec` ... number of objects to read per second at most.
+    `profile_path` ... write a report of the memory use to this path.
+    `shard` ... tuple `(i, N)`, analyze only the i-th of N shards of the
+                OIDs, see `select_shard`.
+    `output_path` ... write the result to this JSON file, too.
+    `order` ... `offset` to read the records in the order they are stored in
+                the file, see `select_oids`.
+    `trace_errors` ... log each value which cannot be scanned, they are
+                       summarized after the results anyway.
+
+    If the storage has a blob directory, the blob records are compared to
+    the blob files after the analysis, see `.blobs.check_blobs`.
+    """
     transaction.doom()
-    results = analyze_storage(
-        storage, verbose=verbose, start_at=start_at, limit=limit)
-    print_results(*results, verb='Found', verbose=verbose)
+    blobs = None
+    if ZODB.interfaces.IBlobStorage.providedBy(storage):
+        storage = blobs = BlobRecordingStorage(storage)
+    pacer = get_pacer(max_read_rate, max_objects_per_sec)
+    error_summary = ErrorSummary(trace=trace_errors)
+    oids = select_oids(storage, use_index, reachable_only, order)
+    if shard is not None:
+        oids = select_shard(storage, oids, shard)
+    if encodings is None and config_path is None:
+        samples = {} if verbose else None
+        profile = MemoryProfile() if profile_path else None
+        results = analyze_storage(
+            storage, start_at=start_at, limit=limit, oids=oids,
+            samples=samples, pacer=pacer, profile=profile,
+            error_summary=error_summary)
+        if profile is not None:
+            profile.write_report(profile_path)
+            log.warn('Wrote memory profile to %s.', profile_path)
+        if output_path is not None:
+            write_result(output_path, storage, *results,
+                         samples=samples or {}, shard=shard,
+                         error_summary=error_summary)
+        print_results(*results, verb='Found', verbose=verbose)
+        if verbose:
+            print_samples(samples)
+    else:
+        encodings = encodings or DEFAULT_ENCODINGS
+        matrix, totals, errors = analyze_encodings(
+            storage, encodings, start_at=start_at, limit=limit, oids=oids,
+            pacer=pacer, error_summary=error_summary)
+        print_encodings(matrix, totals, encodings)
+        if config_path is not None:
+            write_mapping(
+                config_path, choose_encodings(matrix, totals, encodings))
+    error_summary.print_summary()
+    if blobs is not None:
+        print_blob_report(blobs, *check_blobs(blobs), verbose=verbose)
+
+
+def expand_paths(paths):
+    """Expand glob patterns in `paths`.
+
+    Returns the paths of the existing files without duplicates, largest file
+    first.
+    """
+    expanded = set()
+    for path in paths:
+        if glob.has_magic(path):
+            expanded.update(glob.glob(path))
+        else:
+            expanded.add(path)
+    return sorted(expanded, key=lambda x: (-os.path.getsize(x), x))
+
+
+def set_worker_pacer(pacer):
+    """Set the pacer used by `analyze_file` in a worker process."""
+    global _worker_pacer
+    _worker_pacer = pacer
+
+
+def analyze_file(args):
+    """Analyze the FileStorage at a path in a worker process.
+
+    `args` ... tuple `(path, kw)` where `kw` are the keyword arguments for
+               `select_oids` and `analyze_storage`.
+
+    Returns a tuple `(path, result, errors, samples, error_summary, failure)`,
+    `samples` is only filled if `kw` contains a true `verbose`. `failure`
+    describes the exception which aborted the analysis, it is `None` if the
+    analysis succeeded.
+    """
+    path, kw = args
+    samples = {}
+    error_summary = ErrorSummary(trace=kw.pop('trace_errors', False))
+    storage = None
+    try:
+        storage = ZODB.FileStorage.FileStorage(path, read_only=True)
+        if kw.pop('zlib', False):
+            storage = ZlibStorage(storage)
+        transaction.doom()
+        oids = select_oids(storage, kw.pop('use_index', False),
+                           kw.pop('reachable_only', False),
+                           kw.pop('order', 'oid'))
+        result, errors = analyze_storage(
+            storage, oids=oids,
+            samples=samples if kw.pop('verbose', False) else None,
+            pacer=_worker_pacer, error_summary=error_summary, **kw)
+    except Exception as e:
+        # The other storages of the fleet are analyzed nevertheless.
+        log.exception('Could not analyze %s.', path)
+        return (path, {}, {}, {}, error_summary,
+                '{}: {}'.format(e.__class__.__name__, e))
+    else:
+        return path, dict(result), dict(errors), samples, error_summary, None
+    finally:
+        transaction.abort()
+        if storage is not None:
+            storage.close()
+
+
+def analyze_fleet(paths, verbose=False, use_index=False,
+                  reachable_only=False, jobs=None, max_read_rate=None,
+                  max_objects_per_sec=None, zlib=False, order='oid',
+                  trace_errors=False):
+    """Analyze many file storages using a pool of worker processes.
+
+    The largest files are analyzed first to balance the work between the
+    workers. Prints a report for each file and a merged one for all files.
+    A file which cannot be analyzed is reported and left out of the merged
+    report.
+
+    `jobs` ... number of worker processes, default: number of CPUs.
+    `max_read_rate`, `max_objects_per_sec` ... limits for all workers
+                                               together, see `analyze`.
+    `zlib` ... the storages are compressed using `zc.zlibstorage`.
+    `order` ... order to read the records in, see `select_oids`.
+    `trace_errors` ... log each value which cannot be scanned.
+    """
+    kw = dict(verbose=verbose, use_index=use_index,
+              reachable_only=reachable_only, zlib=zlib, order=order,
+              trace_errors=trace_errors)
+    pacer = get_pacer(max_read_rate, max_objects_per_sec)
+    pool = multiprocessing.Pool(
+        jobs, initializer=set_worker_pacer, initargs=(pacer,))
+    try:
+        reports = sorted(pool.imap_unordered(
+            analyze_file, [(path, kw.copy()) for path in paths]))
+    finally:
+        pool.close()
+        pool.join()
+    merged_result = collections.Counter()
+    merged_errors = collections.Counter()
+    # Sample OIDs of different storages cannot be told apart:
+    merged_error_summary = ErrorSummary(sample_size=0)
+    failed = []
+    for path, result, errors, samples, error_summary, failure in reports:
+        print "# {}".format(path)
+        if failure is not None:
+            print "Could not analyze the storage: {}".format(failure)
+            print
+            failed.append(path)
+            continue
+        print_results(result, errors, verb='Found', verbose=verbose)
+        if verbose:
+            print_samples(samples)
+        error_summary.print_summary()
+        print
+        merged_result.update(result)
+        merged_errors.update(errors)
+        merged_error_summary.update(error_summary)
+    print "# All {} storages".format(len(reports) - len(failed))
+    print_results(merged_result, merged_errors, verb='Found', verbose=verbose)
+    merged_error_summary.print_summary()
+    if failed:
+        print
+        print "Could not analyze {} storages:".format(len(failed))
+        for path in failed:
+            print path
 
 
 def main(args=None):
@@ -51,4 +475,85 @@ def main(args=None):
     group.add_argument(
         '--limit', default=None, type=int,
         help='Analyze at most that many objects. Default: no limit')
-    run(parser, analyze, 'verbose', 'start', 'limit', args=args)
+    group.add_argument(
+        '--use-index', action='store_true',
+        help='Analyze only the records the index built by '
+        'zodb-py3migrate-index flags as binary, in file order.')
+    group.add_argument(
+        '--reachable-only', action='store_true',
+        help='Analyze only the objects reachable from the root object, '
+        'skipping garbage a pack would remove.')
+    group.add_argument(
+        '--order', default='oid', choices=['oid', 'offset'],
+        help='Read the records in the order of their OIDs or in the order '
+        'they are stored in the file, which reads the file mostly '
+        'sequentially. Default: oid')
+    group.add_argument(
+        '--encodings', default=None, type=parse_encodings,
+        help='Comma separated list of encodings to test the binary strings '
+        'of each field against. Default: {}'.format(
+            ','.join(DEFAULT_ENCODINGS)))
+    group.add_argument(
+        '--write-config', default=None, metavar='PATH',
+        help='Write a conversion config file choosing the first of the '
+        'encodings which decodes all values of a field.')
+    group.add_argument(
+        '--output', default=None, metavar='PATH',
+        help='Write the result to this JSON file, too, so the results of '
+        'several shards can be merged using zodb-py3migrate-merge.')
+    group.add_argument(
+        '--memory-profile', default=None, metavar='PATH',
+        help='Record the memory use at the start, every 10000 objects and at '
+        'the end and write a report of its growth to this path.')
+    group = parser.add_argument_group('Sharding options')
+    group.add_argument(
+        '--shard', default=None, type=parse_shard, metavar='i/N',
+        help='Split the OIDs of the storage into N ranges of equal size and '
+        'analyze only the i-th one, counting from 1.')
+    group = parser.add_argument_group('Throttling options')
+    group.add_argument(
+        '--max-read-rate', default=None, type=float, metavar='MB/S',
+        help='Read at most that many MB of objects per second. Default: no '
+        'limit')
+    group.add_argument(
+        '--max-objects-per-sec', default=None, type=float,
+        help='Read at most that many objects per second. Default: no limit')
+    group.add_argument(
+        '--nice', action='store_true',
+        help='Run with a lower CPU scheduling priority.')
+    group = parser.add_argument_group('Fleet options')
+    group.add_argument(
+        'more_paths', nargs='*', metavar='Data.fs',
+        help='More storages to analyze, glob patterns are expanded.')
+    group.add_argument(
+        '--jobs', default=None, type=int,
+        help='Number of worker processes analyzing the storages. Default: '
+        'number of CPUs')
+    options = parser.parse_args(args)
+    if options.nice:
+        os.nice(NICE_INCREMENT)
+    paths = [options.zodb_path] + options.more_paths
+    if len(paths) > 1 or glob.has_magic(options.zodb_path):
+        if (options.start or options.limit or options.encodings or
+                options.write_config or options.memory_profile or
+                options.shard or options.output or options.blob_dir or
+                options.index_jobs):
+            parser.error('--start, --limit, --encodings, --write-config, '
+                         '--memory-profile, --shard, --output, --blob-dir '
+                         'and --index-jobs can only be used with a single '
+                         'storage.')
+        logging.basicConfig(level=logging.INFO)
+        analyze_fleet(expand_paths(paths), options.verbose, options.use_index,
+                      options.reachable_only, options.jobs,
+                      options.max_read_rate, options.max_objects_per_sec,
+                      options.zlib, options.order, options.trace_errors)
+        return
+    if options.start and options.order == 'offset':
+        parser.error('--start cannot be used together with --order offset.')
+    if options.output and (options.encodings or options.write_config):
+        parser.error('--output cannot be used together with --encodings or '
+                     '--write-config.')
+    run(parser, analyze, 'verbose', 'start', 'limit',
+        'use_index', 'reachable_only', 'encodings', 'write_config',
+        'max_read_rate', 'max_objects_per_sec', 'memory_profile', 'shard',
+        'output', 'order', 'trace_errors', args=args)
@@ -0,0 +1,97 @@
+from .storage import StorageWrapper
+from multiprocessing.pool import ThreadPool
+import ZODB.blob
+import ZODB.utils
+import os
+
+
+class BlobRecordingStorage(StorageWrapper):
+    """Storage wrapper recording the blob records instead of checking them.
+
+    `loadBlob` returns the name the blob file should have without looking at
+    the file system. `blobs` is the set of `oid + tid` of the loaded blob
+    records, see `check_blobs`.
+    """
+
+    def __init__(self, base):
+        super(BlobRecordingStorage, self).__init__(base)
+        self.blobs = set()
+
+    def loadBlob(self, oid, serial):
+        self.blobs.add(oid + serial)
+        return self.base.fshelper.getBlobFilename(oid, serial)
+
+
+def list_blob_dir(fshelper, path):
+    """List a directory of the blob directory of `fshelper`.
+
+    Returns a tuple `(dirs, blobs)` of the paths of the subdirectories and
+    the `oid + tid` of the blob files in it.
+    """
+    dirs = []
+    blobs = []
+    for name in os.listdir(path):
+        child = os.path.join(path, name)
+        if name.endswith(ZODB.blob.BLOB_SUFFIX):
+            try:
+                oid, tid = fshelper.splitBlobFilename(child)
+            except ValueError:
+                # Not below the directory of an OID.
+                continue
+            blobs.append(oid + tid)
+        elif child != fshelper.temp_dir and os.path.isdir(child):
+            dirs.append(child)
+    return dirs, blobs
+
+
+def list_blobs(fshelper, threads=None):
+    """Return the set of `oid + tid` of all blob files below `fshelper`.
+
+    The directory tree is listed level by level, the directories of a level
+    are listed by a pool of `threads` in parallel. No blob file is opened.
+    """
+    pool = ThreadPool(threads)
+    found = set()
+    try:
+        pending = [fshelper.base_dir]
+        while pending:
+            listings = pool.map(
+                lambda x: list_blob_dir(fshelper, x), pending)
+            pending = []
+            for dirs, blobs in listings:
+                pending.extend(dirs)
+                found.update(blobs)
+    finally:
+        pool.terminate()
+        pool.join()
+    return found
+
+
+def check_blobs(storage, threads=None):
+    """Compare the blob records loaded via `storage` to the blob files.
+
+    `storage` ... `BlobRecordingStorage` wrapping a FileStorage.
+
+    Returns a tuple `(missing, orphaned)` of sorted lists of `(oid, tid)`:
+    blob records without a file and blob files of objects which are not
+    in the storage.
+    """
+    found = list_blobs(storage.fshelper, threads)
+    missing = storage.blobs - found
+    index = storage._index
+    orphaned = [x for x in found if x[:8] not in index]
+    return ([(x[:8], x[8:]) for x in sorted(missing)],
+            [(x[:8], x[8:]) for x in sorted(orphaned)])
+
+
+def print_blob_report(storage, missing, orphaned, verbose):
+    """Print the missing and orphaned blobs, listing them if `verbose`."""
+    print "Checked {} blob records against the blob directory.".format(
+        len(storage.blobs))
+    for name, blobs in [('missing', missing), ('orphaned', orphaned)]:
+        print "Found {} {} blobs{}".format(
+            len(blobs), name, ': (OID, TID)' if verbose else '.')
+        if verbose:
+            for oid, tid in blobs:
+                print "{} {}".format(
+                    ZODB.utils.oid_repr(oid), ZODB.utils.tid_repr(tid))
@@ -0,0 +1,57 @@
+import functools
+
+
+def value_cache(maxsize=100000, max_length=256):
+    """Decorator caching the results of a function of a string.
+
+    `maxsize` ... number of cached results after which the cache is cleared.
+    `max_length` ... only results for a first argument up to this length are
+                     cached, so large values do not fill the memory.
+
+    The results are kept in a plain dict, a lookup costs less than calling
+    `str.decode`. The decorated function gets the attributes `hits` and
+    `misses` and a `clear` method. Exceptions raised by the function are not
+    cached.
+    """
+    def decorator(function):
+        results = {}
+
+        @functools.wraps(function)
+        def cached(value, *args):
+            key = (value,) + args
+            try:
+                result = results[key]
+            except KeyError:
+                pass
+            else:
+                cached.hits += 1
+                return result
+            result = function(value, *args)
+            if len(value) <= max_length:
+                cached.misses += 1
+                if len(results) >= maxsize:
+                    results.clear()
+                results[key] = result
+            return result
+
+        def clear():
+            """Drop all cached results and reset the statistics."""
+            results.clear()
+            cached.hits = cached.misses = 0
+
+        cached.clear = clear
+        cached._results = results
+        clear()
+        return cached
+    return decorator
+
+
+def print_cache_stats(*caches):
+    """Print the hit rates of functions decorated by `value_cache`."""
+    print
+    print "Cache hit rates: (hits, lookups)"
+    for cache in caches:
+        lookups = cache.hits + cache.misses
+        print "{} {:.1f}% ({}, {})".format(
+            cache.__name__, 100.0 * cache.hits / (lookups or 1), cache.hits,
+            lookups)
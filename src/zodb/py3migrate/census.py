@@ -0,0 +1,108 @@
+from .migrate import get_argparse_parser, run
+from .records import get_record_classname
+from .storage import ZLIB_PREFIX, ZlibStorage, decompress
+from ZODB.FileStorage.format import DATA_HDR, DATA_HDR_LEN
+import ZODB.utils
+import contextlib
+import logging
+import mmap
+import struct
+import zlib
+
+
+log = logging.getLogger(__name__)
+
+# Number of bytes at the beginning of a pickle which usually contain the
+# class reference:
+CLASS_PREFIX_LEN = 256
+
+
+def get_prefix_classname(prefix):
+    """Return the dotted class name of a record from the start of its data.
+
+    Returns `None` if `prefix` is too short to contain the class reference.
+    """
+    try:
+        module, name = ZODB.utils.get_pickle_metadata(prefix)
+    except ValueError:
+        # The class reference is not complete.
+        return None
+    if not module:
+        return None
+    return '{}.{}'.format(module, name)
+
+
+def read_classname(data, pos, length):
+    """Return the dotted class name of the record at `pos` in `data`.
+
+    `length` ... length of the record, only its start is read if possible.
+    """
+    end = pos + length
+    prefix = data[pos:min(pos + CLASS_PREFIX_LEN, end)]
+    if prefix.startswith(ZLIB_PREFIX):
+        prefix = zlib.decompressobj().decompress(
+            prefix[len(ZLIB_PREFIX):], CLASS_PREFIX_LEN)
+    classname = get_prefix_classname(prefix)
+    if classname is None:
+        classname = get_record_classname(decompress(data[pos:end]))
+    return classname
+
+
+def count_classes(storage, watermark=1000000):
+    """Count the current records and their bytes per class.
+
+    Only the data record headers and the start of the pickles of the current
+    records of the FileStorage `storage` are read in the order they are
+    stored in the file.
+
+    Returns a dict mapping the dotted name of a class to a tuple `(records,
+    bytes)`. The bytes are the stored ones, i. e. compressed if the records
+    are compressed.
+    """
+    if isinstance(storage, ZlibStorage):
+        storage = storage.base
+    positions = sorted(storage._index.values())
+    sizes = {}
+    with open(storage._file_name, 'rb') as file, contextlib.closing(
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+        for i, pos in enumerate(positions, 1):
+            oid, tid, previous, transaction_pos, version_length, \
+                length = struct.unpack_from(DATA_HDR, data, pos)
+            while not length:
+                # Undo wrote a back pointer to the record with the data.
+                pos = struct.unpack_from('>Q', data, pos + DATA_HDR_LEN)[0]
+                if not pos:
+                    # The creation of the object was undone.
+                    break
+                length = struct.unpack_from(DATA_HDR, data, pos)[-1]
+            if not length:
+                continue
+            classname = read_classname(data, pos + DATA_HDR_LEN, length)
+            records, size = sizes.get(classname, (0, 0))
+            sizes[classname] = records + 1, size + length
+            if i % watermark == 0:
+                log.warn('%s of %s records counted.', i, len(positions))
+    return sizes
+
+
+def print_census(sizes):
+    """Print the number of records and bytes per class, largest first."""
+    print "{} classes: (number of records, bytes)".format(len(sizes))
+    by_size = sorted(sizes.items(), key=lambda x: (-x[1][1], x[0]))
+    for classname, (records, size) in by_size:
+        print "{} ({}, {})".format(classname, records, size)
+    print "Total: {} records, {} bytes".format(
+        sum(x[0] for x in sizes.values()), sum(x[1] for x in sizes.values()))
+
+
+def census(storage):
+    """Print the number of records and bytes per class of `storage`."""
+    print_census(count_classes(storage))
+
+
+def main(args=None):
+    """Entry point for the census script."""
+    parser = get_argparse_parser(
+        "Count the records and bytes per class of a ZODB FileStorage reading "
+        "only the record headers and the class references.")
+    run(parser, census, args=args)
@@ -1,38 +1,392 @@
 from .migrate import print_results, get_argparse_parser, get_format_string
 from .migrate import get_classname, find_obj_with_binary_content, run
+from .migrate import is_container, is_treeset, iter_storage_oids
+from .migrate import is_bucket
+from .migrate import sorted_by_key
+from .cache import value_cache, print_cache_stats
+from .errors import ErrorSummary
+from .follow import copy_transactions, get_state_path, read_state
+from .follow import write_state
+from .index import select_oids
+from .records import get_record_classname, rename_classes
+from .scanners import iter_bucket_oids
+from .storage import NonClosingStorage, RepicklingStorage
+from ZODB.FileStorage.format import DATA_HDR_LEN, TRANS_HDR_LEN
 import ConfigParser
+from ZODB.Connection import TransactionMetaData
+from ZODB.DB import DB
+import ZODB.DemoStorage
+import ZODB.FileStorage
+import ZODB.POSException
+import ZODB.broken
+import ZODB.utils
 import collections
 import logging
+import operator
+import os.path
+import persistent.mapping
+import shutil
+import tempfile
+import time
 import zodbpickle
 import transaction
 
 
 log = logging.getLogger(__name__)
 
+# Number of conversions after which a dry run commits into the overlay:
+DRY_RUN_BATCH_SIZE = 1000
 
-def convert_storage(storage, mapping, verbose=False):
-    """Iterate ZODB objects with binary content and apply mapping."""
+# Number of objects after which repickling all objects commits:
+REPICKLE_BATCH_SIZE = 1000
+
+# Number of records after which renaming classes commits:
+RENAME_BATCH_SIZE = 1000
+
+# Section of the config file mapping old dotted class names to new ones:
+RENAME_SECTION = 'rename'
+
+
+class Quarantine(object):
+    """File recording the values which could not be decoded.
+
+    Each line contains the OID, the dotted name of the field and the encoding
+    separated by tabs.
+
+    `binary` ... wrap the values in `zodbpickle.binary` instead of leaving
+                 them unchanged.
+    """
+
+    def __init__(self, path, binary=False):
+        self.path = path
+        self.binary = binary
+        self.count = 0
+        self._file = open(path, 'w')
+
+    def add(self, obj, value, dotted_name, encoding):
+        """Record a `value` of `obj` which could not be decoded.
+
+        Returns the replacement of the value or `None` to leave it unchanged.
+        """
+        self._file.write('{}\t{}\t{}\n'.format(
+            ZODB.utils.oid_repr(obj._p_oid), dotted_name, encoding))
+        self.count += 1
+        if self.binary:
+            return zodbpickle.binary(value)
+        return None
+
+    def close(self):
+        self._file.close()
+
+
+def read_quarantine(path):
+    """Return the sorted OIDs recorded in a quarantine file."""
+    with open(path) as file:
+        oids = set(ZODB.utils.repr_to_oid(line.split('\t', 1)[0])
+                   for line in file if line.strip())
+    return sorted(oids)
+
+
+@value_cache()
+def decode(value, encoding):
+    """Decode `value`, equal values get decoded to the same object."""
+    return value.decode(encoding)
+
+
+def convert_value(value, encoding):
+    """Convert the binary string `value` according to `encoding`."""
+    if encoding == 'zodbpickle.binary':
+        return zodbpickle.binary(value)
+    return decode(value, encoding)
+
+
+def rebuild_container(obj, keys):
+    """Replace keys of the container `obj` in bulk.
+
+    `keys` ... dict mapping old keys to new ones.
+
+    All items are collected and sorted once, afterwards the container gets
+    emptied and refilled using a single `update` call, so a BTree does not
+    have to be rebalanced for each key.
+    """
+    if not keys:
+        return
+    if is_treeset(obj):
+        items = sorted(keys.get(k, k) for k in obj.keys())
+    elif isinstance(obj, persistent.mapping.PersistentMapping):
+        items = [(keys.get(k, k), v) for k, v in obj.items()]
+    else:
+        items = sorted(((keys.get(k, k), v) for k, v in obj.items()),
+                       key=operator.itemgetter(0))
+    obj.clear()
+    obj.update(items)
+
+
+def finish_container(obj, keys, complete, result, keep_oids=False):
+    """Replace the converted keys of the container `obj`.
+
+    `keys` ... dict mapping old keys to tuples `(new key, dotted name)`, the
+               dotted name is `None` for replacements by the quarantine.
+    `complete` ... tell whether all binary keys of `obj` got decoded.
+    `keep_oids` ... raise a `ValueError` instead of giving the buckets of a
+                    `BTree` new OIDs.
+
+    If not all keys got decoded, only the replacements by the quarantine are
+    applied: Python 2 cannot sort decoded keys together with the binary
+    ones left.
+    """
+    if not complete:
+        log.warn('Not converting the keys of %s, as some of its binary keys '
+                 'are not mapped or cannot be decoded.',
+                 ZODB.utils.oid_repr(obj._p_oid))
+        keys = {k: v for k, v in keys.items() if v[1] is None}
+    if keys and keep_oids and next(iter_bucket_oids(obj), None) is not None:
+        raise ValueError(
+            'Cannot convert the keys of {} while following: its buckets '
+            'would get new OIDs the source may use for other objects.'.format(
+                ZODB.utils.oid_repr(obj._p_oid)))
+    for new_key, dotted_name in keys.values():
+        if dotted_name is not None:
+            result[dotted_name] += 1
+    rebuild_container(obj, {k: v[0] for k, v in keys.items()})
+
+
+def count_sizes(storage, changes, sizes):
+    """Count the sizes of the changed records per class.
+
+    `changes` ... storage containing the changed records, i. e. the
+                  `TmpStore` of a savepoint.
+    `sizes` ... dict mapping the dotted name of a class to a tuple
+                `(records, old bytes, new bytes)` which gets updated.
+    """
+    for oid in changes.index:
+        data, serial = changes.load(oid)
+        try:
+            old_size = len(ZODB.utils.load_current(storage, oid)[0])
+        except ZODB.POSException.POSKeyError:
+            old_size = 0  # new object
+        classname = get_record_classname(data)
+        records, old_bytes, new_bytes = sizes.get(classname, (0, 0, 0))
+        sizes[classname] = (
+            records + 1, old_bytes + old_size, new_bytes + len(data))
+
+
+def convert_storage(storage, mapping, verbose=False, oids=None,
+                    quarantine=None, batch_size=None, sizes=None,
+                    error_summary=None, db=None, keep_oids=False):
+    """Iterate ZODB objects with binary content and apply mapping.
+
+    Binary keys of containers are converted if their dotted name or the
+    dotted name of their class followed by `[*]` is in the mapping.
+
+    `oids` ... iterable of the OIDs to convert, default: all OIDs.
+    `quarantine` ... `Quarantine` to record values in which cannot be
+                     decoded, default: abort the conversion.
+    `batch_size` ... commit after about that many conversions, default:
+                     commit once at the end.
+    `sizes` ... dict which gets filled by `count_sizes` with the sizes of the
+                converted records, the conversion is not committed then.
+    `error_summary` ... `.errors.ErrorSummary` counting the values which
+                        cannot be scanned.
+    `db` ... `DB` opened on `storage`, see `find_obj_with_binary_content`.
+    `keep_oids` ... see `finish_container`.
+    """
     result = collections.defaultdict(int)
     errors = collections.defaultdict(int)
+    container = None
+    keys = {}  # converted keys of `container`
+    complete = True  # all binary keys of `container` got decoded
+    uncommitted = 0
     for obj, data, key, value, type_ in find_obj_with_binary_content(
-            storage, errors):
+            storage, errors, oids=oids, error_summary=error_summary,
+            db=db):
+        if obj is not container:
+            if container is not None:
+                finish_container(
+                    container, keys, complete, result, keep_oids)
+            container, keys, complete = obj, {}, True
+            if batch_size is not None and uncommitted >= batch_size:
+                transaction.commit()
+                uncommitted = 0
         klassname = get_classname(obj)
         dotted_name = get_format_string(obj).format(**locals())
+        if type_ == 'key':
+            if not isinstance(value, str):
+                continue
+            if is_bucket(obj):
+                # Its keys have to stay in the range of its tree.
+                log.warn('Not converting the binary key %r of the bucket %s, '
+                         'its tree is not converted.', value,
+                         ZODB.utils.oid_repr(obj._p_oid))
+                continue
+            if not is_container(obj) and not is_treeset(obj):
+                # Attribute names are not converted.
+                continue
+            if dotted_name not in mapping:
+                dotted_name = '{}[*]'.format(klassname)
         encoding = mapping.get(dotted_name, None)
-        if encoding is None or type_ == 'key':
+        if encoding is None:
+            # An unmapped binary key cannot be sorted with decoded ones.
+            complete = complete and type_ != 'key'
             continue
 
-        if encoding == 'zodbpickle.binary':
-            data[key] = zodbpickle.binary(value)
+        try:
+            converted = convert_value(value, encoding)
+        except UnicodeDecodeError:
+            if quarantine is None:
+                raise
+            converted = quarantine.add(obj, value, dotted_name, encoding)
+            if type_ == 'key':
+                complete = False
+                dotted_name = None
+            if converted is None:
+                continue
         else:
-            data[key] = value.decode(encoding)
-        obj._p_changed = True
-        result[dotted_name] += 1
+            if type_ != 'key':
+                result[dotted_name] += 1
+        uncommitted += 1
+        if type_ == 'key':
+            keys[key] = converted, dotted_name
+        else:
+            data[key] = converted
+            obj._p_changed = True
+    if container is not None:
+        finish_container(container, keys, complete, result, keep_oids)
 
-    transaction.commit()
+    if sizes is None:
+        transaction.commit()
+        return result, errors
+    if container is not None:
+        # Let the connection pickle the changed objects:
+        transaction.savepoint()
+        changes = container._p_jar._savepoint_storage
+        if changes is not None:
+            count_sizes(storage, changes, sizes)
+    transaction.abort()
     return result, errors
 
 
+def print_estimate(sizes):
+    """Print the size changes of a conversion and the growth of Data.fs."""
+    print "Changed records of {} classes: (number of records, old bytes, " \
+        "new bytes)".format(len(sizes))
+    by_size = sorted(sizes.items(), key=lambda x: (-x[1][2], x[0]))
+    for classname, (records, old_bytes, new_bytes) in by_size:
+        print "{} ({}, {}, {})".format(
+            classname, records, old_bytes, new_bytes)
+    records = sum(x[0] for x in sizes.values())
+    old_bytes = sum(x[1] for x in sizes.values())
+    new_bytes = sum(x[2] for x in sizes.values())
+    # Each record gets a data header, the single transaction a transaction
+    # header and the redundant transaction length:
+    growth = new_bytes + records * DATA_HDR_LEN
+    if records:
+        growth += TRANS_HDR_LEN + 8
+    print "Data.fs grows by about {} bytes.".format(growth)
+    print "A packed copy changes by about {} bytes.".format(
+        new_bytes - old_bytes)
+
+
+def repickle_storage(storage, oids, after, batch_size=REPICKLE_BATCH_SIZE):
+    """Store the objects of `storage` again to rewrite their pickles.
+
+    `oids` ... iterable of the OIDs of the objects.
+    `after` ... TID, objects changed in later transactions are skipped as
+                they have already been rewritten.
+
+    Objects of classes which cannot be imported are skipped, too: storing
+    them again would not change their pickles.
+    """
+    db = DB(storage)
+    connection = db.open()
+    count = 0
+    for oid in oids:
+        obj = connection.get(oid)
+        if isinstance(obj, ZODB.broken.Broken):
+            continue
+        obj._p_activate()
+        if obj._p_serial > after:
+            continue
+        obj._p_changed = True
+        count += 1
+        if count % batch_size == 0:
+            transaction.commit()
+            connection.cacheMinimize()
+    transaction.commit()
+    log.warn('Repickled %s objects.', count)
+
+
+def print_repickle_stats(stats):
+    """Print the size and load time changes of the repickled records."""
+    print "Repickled records of {} classes: (number of records, old bytes, " \
+        "new bytes, old load ms, new load ms)".format(len(stats))
+    by_saving = sorted(stats.items(), key=lambda x: (x[1][2] - x[1][1], x[0]))
+    for classname, (records, old_bytes, new_bytes, old_time, new_time) in \
+            by_saving:
+        print "{} ({}, {}, {}, {:.1f}, {:.1f})".format(
+            classname, records, old_bytes, new_bytes, 1000 * old_time,
+            1000 * new_time)
+    old_bytes = sum(x[1] for x in stats.values())
+    new_bytes = sum(x[2] for x in stats.values())
+    old_time = sum(x[3] for x in stats.values())
+    new_time = sum(x[4] for x in stats.values())
+    print "Repickling saves {} bytes and {:.1f}% of the load time.".format(
+        old_bytes - new_bytes, 100 * (old_time - new_time) / (old_time or 1))
+
+
+def rename_storage(storage, renames, oids, batch_size=RENAME_BATCH_SIZE):
+    """Rewrite the class references of the records of `storage`.
+
+    `renames` ... dict mapping dotted class names to new ones.
+    `oids` ... iterable of the OIDs of the records.
+
+    The records are rewritten without unpickling them, see
+    `.records.rename_classes`. Returns a dict mapping tuples `(old name, new
+    name)` to the number of rewritten references.
+    """
+    counts = {}
+    # Records not containing a module and name cannot refer to the class:
+    needles = ['{}\n{}\n'.format(*x.rsplit('.', 1)) for x in renames]
+    meta_data = None
+    uncommitted = 0
+    for oid in oids:
+        data, tid = ZODB.utils.load_current(storage, oid)
+        if not any(x in data for x in needles):
+            continue
+        new_data = rename_classes(data, renames, counts)
+        if new_data == data:
+            continue
+        if meta_data is None:
+            meta_data = TransactionMetaData(
+                description=b'zodb.py3migrate: rename classes')
+            storage.tpc_begin(meta_data)
+        storage.store(oid, tid, new_data, '', meta_data)
+        uncommitted += 1
+        if uncommitted >= batch_size:
+            storage.tpc_vote(meta_data)
+            storage.tpc_finish(meta_data)
+            meta_data = None
+            uncommitted = 0
+    if meta_data is not None:
+        storage.tpc_vote(meta_data)
+        storage.tpc_finish(meta_data)
+    return counts
+
+
+def print_renames(counts):
+    """Print the number of rewritten references for each class rename."""
+    print "Renamed {} classes: (number of references)".format(len(counts))
+    for (old, new), count in sorted_by_key(counts):
+        print "{} -> {} ({})".format(old, new, count)
+
+
+def get_config_parser():
+    """Return a parser for the conversion config file."""
+    parser = ConfigParser.ConfigParser(allow_no_value=True)
+    parser.optionxform = str  # avoid lower casing of option names
+    return parser
+
+
 def read_mapping(config_path):
     """Create mapping from INI file.
 
@@ -42,22 +396,288 @@ def read_mapping(config_path):
     [utf-8]
     foo.Bar.baz
 
+    The section `[rename]` is read by `read_renames`.
     """
-    parser = ConfigParser.ConfigParser(allow_no_value=True)
-    parser.optionxform = str  # avoid lower casing of option names
+    parser = get_config_parser()
     parser.read(config_path)
     mapping = {}
     for section in parser.sections():
+        if section == RENAME_SECTION:
+            continue
         mapping.update(dict.fromkeys(parser.options(section), section))
     return mapping
 
 
-def convert(storage, config_path, verbose=False):
-    """Convert binary strings according to mapping read from config file."""
+def read_renames(config_path):
+    """Read the class renames from an INI file.
+
+    It maps the old dotted name of a class to the new one, thus a
+    configuration like below results in a mapping
+    {'copy_reg._reconstructor': 'copyreg._reconstructor'}.
+
+    [rename]
+    copy_reg._reconstructor = copyreg._reconstructor
+
+    Raises a `ValueError` if a name is not a dotted name.
+    """
+    parser = get_config_parser()
+    parser.read(config_path)
+    if not parser.has_section(RENAME_SECTION):
+        return {}
+    renames = dict(parser.items(RENAME_SECTION))
+    for old, new in sorted(renames.items()):
+        if '.' not in old or '.' not in (new or ''):
+            raise ValueError(
+                'Cannot rename {} to {}: a class must be given as '
+                'module.Class in the [{}] section of {}.'.format(
+                    old, new, RENAME_SECTION, config_path))
+    return renames
+
+
+def write_mapping(config_path, mapping):
+    """Write `mapping` to an INI file which can be read by `read_mapping`."""
+    parser = get_config_parser()
+    for dotted_name, encoding in sorted(
+            mapping.items(), key=lambda x: (x[1], x[0])):
+        if not parser.has_section(encoding):
+            parser.add_section(encoding)
+        parser.set(encoding, dotted_name)
+    with open(config_path, 'w') as file:
+        parser.write(file)
+
+
+def catch_up(storage, source_path, mapping, batch_size=100, retries=3,
+             renames=None, source_blob_dir=None):
+    """Copy and convert the transactions of `source_path` since last time.
+
+    The records of the source transactions committed after the one stored in
+    the state file of `storage` are copied and converted in small
+    transactions. The conversion is retried on conflicts. The classes of the
+    copied records are renamed according to `renames` afterwards.
+
+    Converting keys which would give the buckets of a `BTree` new OIDs
+    raises a `ValueError`, the state file is not updated then.
+
+    `source_blob_dir` ... blob directory of the source, see
+                          `.follow.copy_transactions`.
+
+    Returns the number of copied records.
+    """
+    state_path = get_state_path(storage.getName())
+    oids, last = copy_transactions(
+        source_path, storage, read_state(state_path), source_blob_dir)
+    attempt = 0
+    # The DB is closed after each pass while `storage` stays open:
+    db = DB(NonClosingStorage(storage))
+    try:
+        while oids:
+            try:
+                result, errors = convert_storage(
+                    storage, mapping, oids=oids, batch_size=batch_size,
+                    db=db, keep_oids=True)
+            except ZODB.POSException.ConflictError:
+                transaction.abort()
+                attempt += 1
+                if attempt >= retries:
+                    raise
+                log.warn('Conflict while catching up, retrying.')
+            else:
+                log.warn('Converted %s fields in %s copied objects.',
+                         sum(result.values()), len(oids))
+                break
+    finally:
+        db.close()
+    if renames and oids:
+        rename_storage(storage, renames, oids, batch_size)
+    if last is not None:
+        write_state(state_path, last)
+    return len(oids)
+
+
+def follow(storage, source_path, mapping, interval=10, once=False,
+           renames=None, source_blob_dir=None):
+    """Catch up with the changes of `source_path` until interrupted.
+
+    `interval` ... seconds to wait between two catch-up passes.
+    `once` ... stop after the first catch-up pass.
+    `renames`, `source_blob_dir` ... see `catch_up`.
+    """
+    try:
+        while True:
+            catch_up(storage, source_path, mapping, renames=renames,
+                     source_blob_dir=source_blob_dir)
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def open_overlay(storage, path):
+    """Stack a `DemoStorage` on `storage` writing changes to a FileStorage.
+
+    `path` ... path of the FileStorage the changes are written to.
+
+    Closing the overlay does not close `storage`. New objects get their OIDs
+    from `storage` as `DemoStorage` hands out random ones up to 2**62, which
+    would end up in `storage` when promoting the changes.
+    """
+    changes = ZODB.FileStorage.FileStorage(path)
+    # Do not reuse the OIDs of the objects added by a previous dry run:
+    storage.set_max_oid(changes._oid)
+    overlay = ZODB.DemoStorage.DemoStorage(
+        base=storage, changes=changes, close_base_on_close=False)
+    overlay.new_oid = storage.new_oid
+    return overlay
+
+
+def promote(storage, overlay_path):
+    """Copy the transactions of a dry run overlay into `storage`.
+
+    Raises a `ValueError` if `storage` was changed after the dry run.
+    """
+    overlay = ZODB.FileStorage.FileStorage(overlay_path, read_only=True)
+    try:
+        for info in overlay.iterator():
+            if info.tid <= storage.lastTransaction():
+                raise ValueError(
+                    '{} was changed after the dry run.'.format(
+                        storage.getName()))
+            break
+        storage.copyTransactionsFrom(overlay)
+    finally:
+        overlay.close()
+    log.warn('Promoted the changes of %s.', overlay_path)
+
+
+def convert(storage, config_path, verbose=False, use_index=False,
+            reachable_only=False, quarantine_path=None,
+            quarantine_binary=False, from_quarantine=None, follow_path=None,
+            interval=10, once=False, estimate=False, dry_run=False,
+            overlay_path=None, promote_path=None, repickle=None,
+            order='oid', trace_errors=False, follow_blob_dir=None):
+    """Convert binary strings according to mapping read from config file.
+
+    Afterwards classes are renamed according to its `[rename]` section.
+
+    `quarantine_path` ... file to record values in which cannot be decoded,
+                          default: abort the conversion on such values.
+    `quarantine_binary` ... wrap these values in `zodbpickle.binary`.
+    `from_quarantine` ... path of a quarantine file, convert only the objects
+                          recorded there.
+    `follow_path` ... path of the FileStorage `storage` is a copy of. After
+                      converting the copy, the transactions committed to the
+                      source later on are copied and converted, too.
+    `follow_blob_dir` ... blob directory of the FileStorage at `follow_path`.
+    `estimate` ... only print how the conversion would change the size of
+                   the storage without committing it.
+    `dry_run` ... commit the conversion into a `DemoStorage` overlay instead
+                  of `storage` and print how long it took.
+    `overlay_path` ... path of the FileStorage the overlay writes to, it is
+                       kept after the dry run, default: a temporary file.
+    `promote_path` ... path of the overlay of a previous dry run to copy into
+                       `storage` instead of converting.
+    `repickle` ... `changed` to optimize the pickles of the changed records,
+                   `all` to rewrite and optimize the pickles of all records.
+    `order` ... `offset` to read the records in the order they are stored in
+                the file, see `select_oids`.
+    `trace_errors` ... log each value which cannot be scanned, they are
+                       summarized after the results anyway.
+    """
+    if promote_path is not None:
+        promote(storage, promote_path)
+        return
     mapping = read_mapping(config_path)
-    print_results(
-        *convert_storage(storage, mapping, verbose=verbose),
-        verb='Converted', verbose=verbose)
+    renames = read_renames(config_path)
+    if estimate or dry_run:
+        follow_path = None
+    if estimate:
+        repickle = None
+        renames = {}
+    if follow_path is not None:
+        state_path = get_state_path(storage.getName())
+        if read_state(state_path) is not None:
+            # The snapshot has already been converted.
+            follow(storage, follow_path, mapping, interval, once, renames,
+                   follow_blob_dir)
+            return
+        write_state(state_path, storage.lastTransaction())
+    if from_quarantine is not None:
+        oids = read_quarantine(from_quarantine)
+    else:
+        oids = select_oids(storage, use_index, reachable_only, order)
+    quarantine = None
+    if quarantine_path is not None:
+        quarantine = Quarantine(quarantine_path, binary=quarantine_binary)
+    sizes = {} if estimate else None
+    error_summary = ErrorSummary(trace=trace_errors)
+    target, batch_size, tmpdir = storage, None, None
+    if dry_run:
+        if overlay_path is None:
+            tmpdir = tempfile.mkdtemp()
+            overlay_path = os.path.join(tmpdir, 'overlay.fs')
+        target = open_overlay(storage, overlay_path)
+        batch_size = DRY_RUN_BATCH_SIZE
+        if oids is None:
+            # The overlay cannot iterate the records of its base.
+            oids = iter_storage_oids(storage)
+    # Renaming classes does not change the pickles otherwise:
+    rename_target = target
+    if repickle is not None:
+        target = RepicklingStorage(target)
+        converted_after = target.lastTransaction()
+    started = time.time()
+    try:
+        try:
+            results = convert_storage(
+                target, mapping, verbose=verbose, oids=oids,
+                quarantine=quarantine, batch_size=batch_size, sizes=sizes,
+                error_summary=error_summary,
+                keep_oids=follow_path is not None)
+        except Exception:
+            if follow_path is not None:
+                # The snapshot is converted in a single transaction:
+                transaction.abort()
+                os.remove(state_path)
+            raise
+        if repickle == 'all':
+            repickle_storage(
+                target, iter_storage_oids(storage), converted_after)
+        if renames:
+            rename_counts = rename_storage(
+                rename_target, renames, iter_storage_oids(storage))
+    finally:
+        if quarantine is not None:
+            quarantine.close()
+        if dry_run:
+            target.close()
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir)
+    duration = time.time() - started
+    print_results(*results, verb='Would convert' if estimate else 'Converted',
+                  verbose=verbose)
+    error_summary.print_summary()
+    if quarantine is not None:
+        print "Quarantined {} values to {}.".format(
+            quarantine.count, quarantine.path)
+    if repickle is not None:
+        print_repickle_stats(target.stats)
+    if renames:
+        print_renames(rename_counts)
+    if estimate:
+        print_estimate(sizes)
+    if dry_run:
+        print "Dry run took {:.1f} seconds ({:.1f} converted values per " \
+            "second).".format(
+                duration, sum(results[0].values()) / (duration or 1))
+        if tmpdir is None:
+            print "Wrote the changes to {0}, copy them into the storage " \
+                "using --promote={0}.".format(overlay_path)
+    if verbose:
+        print_cache_stats(decode)
+    if follow_path is not None:
+        follow(storage, follow_path, mapping, interval, once, renames,
+               follow_blob_dir)
 
 
 def main(args=None):
@@ -68,5 +688,70 @@ def main(args=None):
     group = parser.add_argument_group('Convert options')
     group.add_argument(
         '-c', '--config', help='Path to conversion config file.')
+    group.add_argument(
+        '--use-index', action='store_true',
+        help='Convert only the records the index built by '
+        'zodb-py3migrate-index flags as binary, in file order.')
+    group.add_argument(
+        '--reachable-only', action='store_true',
+        help='Convert only the objects reachable from the root object, '
+        'skipping garbage a pack would remove.')
+    group.add_argument(
+        '--order', default='oid', choices=['oid', 'offset'],
+        help='Read the records in the order of their OIDs or in the order '
+        'they are stored in the file, which reads the file mostly '
+        'sequentially. Default: oid')
+    group.add_argument(
+        '--quarantine', default=None, metavar='PATH',
+        help='Do not abort on values which cannot be decoded but record them '
+        'in this file.')
+    group.add_argument(
+        '--quarantine-binary', action='store_true',
+        help='Wrap the quarantined values in zodbpickle.binary instead of '
+        'leaving them unchanged.')
+    group.add_argument(
+        '--from-quarantine', default=None, metavar='PATH',
+        help='Convert only the objects recorded in this quarantine file of a '
+        'previous run.')
+    group.add_argument(
+        '--follow', default=None, metavar='SOURCE',
+        help='Path of the Data.fs the converted storage is a copy of. After '
+        'converting, copy and convert the transactions committed to SOURCE '
+        'in the meantime until interrupted.')
+    group.add_argument(
+        '--interval', default=10, type=float,
+        help='Seconds to wait between two passes of --follow. Default: 10')
+    group.add_argument(
+        '--once', action='store_true',
+        help='Stop --follow after the first pass.')
+    group.add_argument(
+        '--follow-blob-dir', default=None, metavar='PATH',
+        help='Path to the blob directory of the --follow SOURCE if it uses '
+        'ZODB blobs.')
+    group.add_argument(
+        '--dry-run', action='store_true',
+        help='Commit the conversion into a temporary overlay instead of the '
+        'storage and print how long it took.')
+    group.add_argument(
+        '--overlay', default=None, metavar='PATH',
+        help='Keep the changes of --dry-run in a FileStorage at this path.')
+    group.add_argument(
+        '--promote', default=None, metavar='PATH',
+        help='Copy the changes kept by a previous --dry-run into the storage '
+        'instead of converting.')
+    group.add_argument(
+        '--estimate', action='store_true',
+        help='Do not change the storage but print the sizes of the records '
+        'the conversion would change and the expected growth of the storage '
+        'file.')
+    group.add_argument(
+        '--repickle', default=None, choices=['changed', 'all'],
+        help='Remove unused memo entries from the pickles of the records the '
+        'conversion changes or rewrite the pickles of all records this way '
+        'and print the savings.')
 
-    run(parser, convert, 'config', 'verbose', args=args)
+    run(parser, convert, 'config', 'verbose',
+        'use_index', 'reachable_only', 'quarantine', 'quarantine_binary',
+        'from_quarantine', 'follow', 'interval', 'once', 'estimate',
+        'dry_run', 'overlay', 'promote', 'repickle', 'order', 'trace_errors',
+        'follow_blob_dir', args=args)
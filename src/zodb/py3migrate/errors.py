@@ -0,0 +1,98 @@
+import collections
+import logging
+import sys
+import traceback
+import ZODB.utils
+
+
+log = logging.getLogger(__name__)
+
+
+class ErrorSummary(object):
+    """Count the exceptions raised while scanning the values of objects.
+
+    The exceptions are counted per field and exception type. For each of
+    them the traceback of the first occurrence and the OIDs of up to
+    `sample_size` objects are kept. If `trace` is true, each occurrence is
+    logged, too.
+    """
+
+    def __init__(self, sample_size=5, trace=False):
+        self.sample_size = sample_size
+        self.trace = trace
+        self.counts = collections.Counter()
+        self.tracebacks = {}
+        self.oids = collections.defaultdict(list)
+
+    def add(self, name, oid, value):
+        """Record the exception being handled while scanning `value`.
+
+        `name` ... dotted name of the field of the object `value` belongs to.
+        `oid` ... OID of the object.
+        """
+        key = (name, sys.exc_info()[0].__name__)
+        self.counts[key] += 1
+        if key not in self.tracebacks:
+            self.tracebacks[key] = traceback.format_exc()
+        self._add_sample(key, oid)
+        if self.trace:
+            log.error('Could not execute %r', value, exc_info=True)
+
+    def _add_sample(self, key, oid):
+        oids = self.oids[key]
+        if len(oids) < self.sample_size and oid not in oids:
+            oids.append(oid)
+
+    def update(self, other):
+        """Add the exceptions counted by the `ErrorSummary` `other`.
+
+        The first traceback is kept for each field and exception type.
+        """
+        for key, count in other.counts.items():
+            self.counts[key] += count
+            self.tracebacks.setdefault(key, other.tracebacks[key])
+            for oid in other.oids[key]:
+                self._add_sample(key, oid)
+
+    def as_json(self):
+        """Return the summary as a list of dicts which can be stored as JSON.
+
+        `from_json` creates an `ErrorSummary` from it.
+        """
+        return [{
+            'name': name,
+            'exception': exception,
+            'count': self.counts[(name, exception)],
+            'oids': [ZODB.utils.oid_repr(x)
+                     for x in self.oids[(name, exception)]],
+            'traceback': self.tracebacks[(name, exception)],
+        } for name, exception in sorted(self.counts)]
+
+    @classmethod
+    def from_json(cls, data, sample_size=5):
+        """Create an `ErrorSummary` from the data `as_json` returned."""
+        error_summary = cls(sample_size)
+        for entry in data:
+            key = (str(entry['name']), str(entry['exception']))
+            error_summary.counts[key] = entry['count']
+            error_summary.tracebacks[key] = entry['traceback']
+            for oid in entry['oids']:
+                error_summary._add_sample(
+                    key, ZODB.utils.repr_to_oid(str(oid)))
+        return error_summary
+
+    def print_summary(self):
+        """Print the counts, sample OIDs and tracebacks if there are any."""
+        if not self.counts:
+            return
+        print ("Could not scan the values of {} fields: (exception, number "
+               "of occurrences, sample OIDs)".format(len(self.counts)))
+        for key in sorted(self.counts):
+            details = [str(self.counts[key])]
+            if self.oids[key]:
+                # Samples are not kept when merging several storages.
+                details.append(
+                    ' '.join(ZODB.utils.oid_repr(x) for x in self.oids[key]))
+            print "{} {} ({})".format(key[0], key[1], ', '.join(details))
+            for line in self.tracebacks[key].splitlines():
+                print "  {}".format(line)
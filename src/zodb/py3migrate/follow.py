@@ -0,0 +1,124 @@
+from ZODB.Connection import TransactionMetaData
+import ZODB.FileStorage
+import ZODB.POSException
+import ZODB.blob
+import ZODB.interfaces
+import ZODB.utils
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+
+
+log = logging.getLogger(__name__)
+
+
+def get_state_path(zodb_path):
+    """Return the path of the file storing the last followed source TID."""
+    return zodb_path + '.py3follow'
+
+
+def read_state(path):
+    """Return the last source TID copied, `None` if not followed yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return ZODB.utils.repr_to_oid(file.read().strip())
+
+
+def write_state(path, tid):
+    """Store the last source TID copied."""
+    with open(path, 'w') as file:
+        file.write(ZODB.utils.tid_repr(tid) + '\n')
+
+
+def copy_blob(fshelper, storage, oid, tid):
+    """Copy a blob file of the source to a temporary file of `storage`.
+
+    Storing a blob moves the file into the blob directory of `storage`.
+    `fshelper` ... `ZODB.blob.FilesystemHelper` of the source blob directory.
+
+    Returns the path of the copy.
+    """
+    fd, path = tempfile.mkstemp(
+        suffix='.tmp', dir=storage.temporaryDirectory())
+    os.close(fd)
+    shutil.copyfile(fshelper.getBlobFilename(oid, tid), path)
+    return path
+
+
+def copy_transactions(source_path, storage, after, source_blob_dir=None):
+    """Copy the transactions of a FileStorage file into `storage`.
+
+    `source_path` ... path of the FileStorage file to read from, it can be in
+                      use by another process.
+    `after` ... TID, only later transactions are copied.
+    `source_blob_dir` ... blob directory of the source. The blob files of
+                          blob records are copied like `copyTransactionsFrom`
+                          does it. Without it, copying a blob record raises a
+                          `ValueError`, as does copying one into a storage
+                          without blob directory.
+
+    Each source transaction is committed as a transaction of `storage`.
+    Returns a tuple `(oids, tid)` of the sorted OIDs of the copied records
+    and the TID of the last copied source transaction (`None` if there was
+    none).
+    """
+    oids = set()
+    last = None
+    fshelper = None
+    if source_blob_dir is not None:
+        fshelper = ZODB.blob.FilesystemHelper(source_blob_dir)
+    start = ZODB.utils.p64(ZODB.utils.u64(after) + 1)
+    iterator = ZODB.FileStorage.FileIterator(source_path, start=start)
+    try:
+        for source_transaction in iterator:
+            meta_data = TransactionMetaData(
+                source_transaction.user, source_transaction.description,
+                source_transaction.extension)
+            storage.tpc_begin(meta_data)
+            try:
+                copy_records(source_transaction, storage, meta_data,
+                             fshelper, oids)
+            except Exception:
+                storage.tpc_abort(meta_data)
+                raise
+            storage.tpc_vote(meta_data)
+            storage.tpc_finish(meta_data)
+            last = source_transaction.tid
+    finally:
+        iterator.close()
+    return sorted(oids), last
+
+
+def copy_records(source_transaction, storage, meta_data, fshelper, oids):
+    """Store the records of a source transaction in `storage`.
+
+    `fshelper` ... `ZODB.blob.FilesystemHelper` of the source blob directory
+                   or `None`, see `copy_transactions`.
+    `oids` ... set the OIDs of the stored records are added to.
+    """
+    for record in source_transaction:
+        if record.data is None:
+            log.warn('Skipping undone creation of %s.',
+                     ZODB.utils.oid_repr(record.oid))
+            continue
+        try:
+            serial = storage.getTid(record.oid)
+        except ZODB.POSException.POSKeyError:
+            serial = ZODB.utils.z64
+        if ZODB.blob.is_blob_record(record.data):
+            if (fshelper is None or
+                    not ZODB.interfaces.IBlobStorage.providedBy(storage)):
+                raise ValueError(
+                    'Cannot copy the blob of {}, the blob directories of the '
+                    'source and of the storage are needed.'.format(
+                        ZODB.utils.oid_repr(record.oid)))
+            storage.storeBlob(
+                record.oid, serial, record.data,
+                copy_blob(fshelper, storage, record.oid, record.tid), '',
+                meta_data)
+        else:
+            storage.store(record.oid, serial, record.data, '', meta_data)
+        oids.add(record.oid)
@@ -0,0 +1,170 @@
+from ZODB._compat import Unpickler
+from ZODB.FileStorage.format import DATA_HDR, DATA_HDR_LEN
+from ZODB.FileStorage.format import TRANS_HDR, TRANS_HDR_LEN
+from ZODB.fsIndex import fsIndex
+import contextlib
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+
+
+log = logging.getLogger(__name__)
+
+# Position of the first transaction, it follows the magic bytes:
+FIRST_TRANSACTION_POS = 4
+
+
+@contextlib.contextmanager
+def mapped(path):
+    """Memory map the file at `path` read-only."""
+    with open(path, 'rb') as file, contextlib.closing(mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+        yield data
+
+
+def split_transactions(path, parts):
+    """Split the transactions of the FileStorage file at `path` into ranges.
+
+    Only the transaction headers are read. The ranges are about
+    `size / parts` bytes long and end at transaction boundaries. An
+    unfinished transaction at the end of the file is not part of any range.
+
+    Returns a list of `(start, stop)` file positions.
+    """
+    size = os.path.getsize(path)
+    part_size = max((size - FIRST_TRANSACTION_POS) // parts, 1)
+    ranges = []
+    start = pos = FIRST_TRANSACTION_POS
+    with mapped(path) as data:
+        while pos + TRANS_HDR_LEN <= size:
+            length, status = struct.unpack_from(TRANS_HDR, data, pos)[1:3]
+            if status == 'c' or pos + length + 8 > size:
+                # FileStorage truncates the file when opening it.
+                break
+            pos += length + 8
+            if pos - start >= part_size:
+                ranges.append((start, pos))
+                start = pos
+    if pos > start:
+        ranges.append((start, pos))
+    return ranges
+
+
+def index_range(args):
+    """Index the data records of a range of transactions.
+
+    `args` ... tuple `(path, start, stop)` of the path of the FileStorage
+               file and the range of file positions.
+
+    Returns an `fsIndex` mapping each OID to the position of its last
+    record in the range. Records of undone transactions are skipped like
+    FileStorage does it.
+    """
+    path, start, stop = args
+    index = fsIndex()
+    with mapped(path) as data:
+        pos = start
+        while pos < stop:
+            length, status, user_length, description_length, \
+                extension_length = struct.unpack_from(
+                    TRANS_HDR, data, pos)[1:]
+            end = pos + length
+            if status != 'u':
+                record_pos = (pos + TRANS_HDR_LEN + user_length +
+                              description_length + extension_length)
+                while record_pos < end:
+                    oid = data[record_pos:record_pos + 8]
+                    pickle_length = struct.unpack_from(
+                        DATA_HDR, data, record_pos)[-1]
+                    index[oid] = record_pos
+                    # A record without data contains a back pointer:
+                    record_pos += DATA_HDR_LEN + (pickle_length or 8)
+            pos = end + 8
+    return index
+
+
+def build_index(path, jobs=None):
+    """Build the index of the FileStorage at `path` in parallel.
+
+    The transactions are split into ranges which are indexed by a pool of
+    `jobs` worker processes, default: number of CPUs.
+
+    Returns a tuple `(index, pos)` of the `fsIndex` and the position after
+    the last transaction indexed.
+    """
+    ranges = split_transactions(path, jobs or multiprocessing.cpu_count())
+    pool = multiprocessing.Pool(jobs)
+    try:
+        parts = pool.map(index_range, [(path,) + x for x in ranges])
+    finally:
+        pool.close()
+        pool.join()
+    index = fsIndex()
+    for part in parts:
+        # Records of later ranges replace the ones of earlier ranges.
+        for prefix, bucket in part._data.items():
+            existing = index._data.get(prefix)
+            if existing is None:
+                index._data[prefix] = bucket
+            else:
+                existing.update(bucket)
+    return index, ranges[-1][1] if ranges else FIRST_TRANSACTION_POS
+
+
+def get_indexed_pos(path):
+    """Return the position up to which the saved index of `path` is valid.
+
+    The position is read from the start of the `.index` file FileStorage
+    saves. It is only trusted if a transaction of the file ends there.
+    Returns the position of the first transaction if there is no usable
+    index.
+    """
+    try:
+        with open(path + '.index', 'rb') as file:
+            pos = Unpickler(file).load()
+    except Exception:
+        # FileStorage ignores missing and broken index files, too.
+        return FIRST_TRANSACTION_POS
+    size = os.path.getsize(path)
+    if (not isinstance(pos, (int, long)) or
+            not FIRST_TRANSACTION_POS + TRANS_HDR_LEN < pos <= size):
+        # An index of the old format or of another file.
+        return FIRST_TRANSACTION_POS
+    with mapped(path) as data:
+        length = struct.unpack_from('>Q', data, pos - 8)[0]
+        start = pos - length - 8
+        if (length < TRANS_HDR_LEN or start < FIRST_TRANSACTION_POS or
+                struct.unpack_from(TRANS_HDR, data, start)[1] != length):
+            return FIRST_TRANSACTION_POS
+    return pos
+
+
+def prepare_index(path, jobs=None):
+    """Prepare the index of the FileStorage at `path` before opening it.
+
+    On opening, FileStorage reads the records after the position its saved
+    index covers, i. e. all of them if there is no index. If this is more
+    than each of `jobs` processes (default: number of CPUs) would have to
+    read to build the whole index, the index is built in parallel and saved
+    where FileStorage loads it from.
+    """
+    if not os.path.exists(path):
+        return
+    jobs = jobs or multiprocessing.cpu_count()
+    size = os.path.getsize(path)
+    if (size - get_indexed_pos(path)) * jobs <= size:
+        return
+    log.warn('Building the index of %s using %s processes.', path, jobs)
+    index, pos = build_index(path, jobs)
+    index_path = path + '.index'
+    # Not the temporary file FileStorage saves its index to:
+    tmp_path = index_path + '.py3migrate_tmp'
+    try:
+        index.save(pos, tmp_path)
+        os.rename(tmp_path, index_path)
+    except EnvironmentError as e:
+        log.warn('Could not save the index of %s: %s', path, e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,265 @@
+from .fsindex import mapped
+from .migrate import get_argparse_parser, run
+from .records import get_record_classname, has_binary_strings
+from .records import iter_reachable_oids
+import array
+import json
+import logging
+import os.path
+import ZODB.utils
+
+
+log = logging.getLogger(__name__)
+
+FORMAT = 'zodb.py3migrate.index 1'
+
+# Name and array typecode of the columns of the index. On 64 bit platforms
+# `L` is an unsigned 8 byte integer.
+COLUMNS = (
+    ('oids', 'L'),
+    ('tids', 'L'),
+    ('offsets', 'L'),
+    ('lengths', 'I'),
+    ('classes', 'I'),
+    ('binary', 'B'),
+)
+
+
+class RecordIndex(object):
+    """Columnar index of the current records of a FileStorage.
+
+    Each record is described by its OID, TID, the file offset of its data
+    record, the length of its pickle, the id of its class and a flag telling
+    whether the record contains non-ASCII `str` objects.
+
+    `last_transaction` and `size` are the last TID and the file size of the
+    storage when the index was built, see `is_current`.
+
+    """
+
+    def __init__(self):
+        self.last_transaction = None
+        self.size = None
+        self.classnames = []
+        self._class_ids = {}
+        for name, typecode in COLUMNS:
+            setattr(self, name, array.array(typecode))
+
+    def __len__(self):
+        return len(self.oids)
+
+    def append(self, oid, tid, offset, data):
+        """Add the record of `oid` with the pickle `data` to the index."""
+        classname = get_record_classname(data)
+        class_id = self._class_ids.get(classname)
+        if class_id is None:
+            class_id = self._class_ids[classname] = len(self.classnames)
+            self.classnames.append(classname)
+        self.oids.append(ZODB.utils.u64(oid))
+        self.tids.append(ZODB.utils.u64(tid))
+        self.offsets.append(offset)
+        self.lengths.append(len(data))
+        self.classes.append(class_id)
+        self.binary.append(has_binary_strings(data))
+
+    def select(self, classname=None, binary=None):
+        """Return the OIDs of the matching records in file order.
+
+        `classname` ... dotted name of the class the records must have.
+        `binary` ... `True` to select only records containing non-ASCII
+                     `str` objects, `False` for the opposite.
+        """
+        class_id = None
+        if classname is not None:
+            class_id = self._class_ids.get(classname)
+            if class_id is None:
+                return []
+        positions = sorted(xrange(len(self)), key=self.offsets.__getitem__)
+        return [ZODB.utils.p64(self.oids[i])
+                for i in positions
+                if (class_id is None or self.classes[i] == class_id) and
+                (binary is None or self.binary[i] == binary)]
+
+    def is_current(self, storage):
+        """Tell whether the index still describes the records of `storage`.
+
+        It does not after committing transactions or packing the storage.
+        """
+        return (self.last_transaction == storage.lastTransaction() and
+                self.size == os.path.getsize(storage.getName()))
+
+    def sizes(self):
+        """Return a dict mapping class names to (records, bytes)."""
+        records = [0] * len(self.classnames)
+        size = [0] * len(self.classnames)
+        for class_id, length in zip(self.classes, self.lengths):
+            records[class_id] += 1
+            size[class_id] += length
+        return {classname: (records[i], size[i])
+                for i, classname in enumerate(self.classnames)}
+
+    def save(self, path):
+        """Write the index to the file at `path`."""
+        header = {
+            'format': FORMAT,
+            'size': self.size,
+            'classnames': self.classnames,
+            'length': len(self),
+        }
+        if self.last_transaction is not None:
+            header['last_transaction'] = ZODB.utils.tid_repr(
+                self.last_transaction)
+        with open(path, 'wb') as file:
+            file.write(json.dumps(header) + '\n')
+            for name, typecode in COLUMNS:
+                getattr(self, name).tofile(file)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by `save` from the file at `path`."""
+        index = cls()
+        with open(path, 'rb') as file:
+            header = json.loads(file.readline())
+            if header.get('format') != FORMAT:
+                raise ValueError(
+                    '{} is not a record index of a known format.'.format(
+                        path))
+            if header.get('last_transaction') is not None:
+                # Indexes written by older versions do not know it.
+                index.last_transaction = ZODB.utils.repr_to_oid(
+                    str(header['last_transaction']))
+            index.size = header.get('size')
+            index.classnames = [str(x) for x in header['classnames']]
+            index._class_ids = {
+                x: i for i, x in enumerate(index.classnames)}
+            for name, typecode in COLUMNS:
+                getattr(index, name).fromfile(file, header['length'])
+        return index
+
+
+def get_index_path(zodb_path):
+    """Return the path of the record index belonging to a Data.fs."""
+    return zodb_path + '.py3index'
+
+
+def build_index(storage, watermark=100000):
+    """Build a `RecordIndex` of `storage` reading each record once."""
+    index = RecordIndex()
+    index.last_transaction = storage.lastTransaction()
+    index.size = os.path.getsize(storage.getName())
+    next = None
+    while True:
+        oid, tid, data, next = storage.record_iternext(next)
+        index.append(oid, tid, storage._lookup_pos(oid), data)
+        if len(index) % watermark == 0:
+            log.warn('%s of about %s records indexed.',
+                     len(index), len(storage))
+        if next is None:
+            break
+    return index
+
+
+def get_indexed_oids(storage):
+    """Return the OIDs of `storage` which contain binary strings.
+
+    The OIDs are read from the record index next to the storage file, they
+    are returned in file order. The index is rebuilt if it is not current.
+
+    """
+    path = get_index_path(storage.getName())
+    index = RecordIndex.load(path)
+    if not index.is_current(storage):
+        log.warn('The record index %s is outdated, rebuilding it.', path)
+        index = build_index(storage)
+        index.save(path)
+    return index.select(binary=True)
+
+
+def get_offset_ordered_oids(storage):
+    """Iterate the OIDs of the current records of `storage` in file order.
+
+    The positions of the records are taken from the index of the
+    FileStorage, so reading the records in this order is mostly sequential
+    instead of seeking for each one. Only the positions get sorted, the OID
+    of each record is read from its data record header while iterating, like
+    `.census.count_classes` does.
+    """
+    positions = sorted(storage._index.itervalues())
+    with mapped(storage._file_name) as data:
+        for pos in positions:
+            yield data[pos:pos + 8]
+
+
+def select_oids(storage, use_index=False, reachable_only=False, order='oid'):
+    """Return the OIDs of `storage` to be scanned.
+
+    `use_index` ... restrict to the OIDs `get_indexed_oids` returns.
+    `reachable_only` ... restrict to the OIDs reachable from the root object.
+    `order` ... `offset` to return the OIDs in the order of their records in
+                the file, the index returns them in this order anyway.
+
+    Returns `None` if all OIDs should be scanned in OID order.
+    """
+    oids = None
+    if use_index:
+        oids = get_indexed_oids(storage)
+    if reachable_only:
+        reachable = iter_reachable_oids(storage)
+        if oids is None:
+            oids = reachable
+        else:
+            indexed = frozenset(oids)
+            oids = (x for x in reachable if x in indexed)
+    if order == 'offset' and not use_index:
+        if oids is None:
+            oids = get_offset_ordered_oids(storage)
+        else:
+            selected = frozenset(oids)
+            oids = [x for x in get_offset_ordered_oids(storage)
+                    if x in selected]
+    return oids
+
+
+def write_index(storage):
+    """Build the record index of a storage and store it next to it."""
+    path = get_index_path(storage.getName())
+    build_index(storage).save(path)
+    log.warn('Wrote record index to %s.', path)
+
+
+def query(path, classname=None, sizes=False):
+    """Print the answer to a query from the record index at `path`."""
+    record_index = RecordIndex.load(path)
+    if classname is not None:
+        for oid in record_index.select(classname=classname):
+            print ZODB.utils.oid_repr(oid)
+    if sizes:
+        print "{} classes: (number of records, bytes)".format(
+            len(record_index.classnames))
+        by_size = sorted(record_index.sizes().items(),
+                         key=lambda x: (-x[1][1], x[0]))
+        for classname, (records, size) in by_size:
+            print "{} ({}, {})".format(classname, records, size)
+
+
+def main(args=None):
+    """Entry point for the index script."""
+    parser = get_argparse_parser(
+        "Build an index of the records in a ZODB FileStorage, queries are "
+        "answered from the index without reading the FileStorage.")
+    group = parser.add_argument_group('Index options')
+    group.add_argument(
+        '--rebuild', action='store_true',
+        help='Build the index even if there already is one.')
+    group.add_argument(
+        '--class', dest='classname', default=None,
+        help='Print the OIDs of all records of the class with this dotted '
+        'name.')
+    group.add_argument(
+        '--sizes', action='store_true',
+        help='Print the number of records and bytes for each class.')
+    options = parser.parse_args(args)
+    path = get_index_path(options.zodb_path)
+    if options.rebuild or not os.path.exists(path):
+        run(parser, write_index, args=args)
+    query(path, options.classname, options.sizes)
@@ -1,15 +1,114 @@
+from ZODB.FileStorage.format import TRANS_HDR, TRANS_HDR_LEN
+from ZODB.FileStorage.format import DATA_HDR, DATA_HDR_LEN
+import ZODB.utils
 import argparse
+import contextlib
+import mmap
+import os
+import struct
 
 VERSION_MAGIC_MAP = {
     'Python2': 'FS21',
     'Python3': 'FS30',
 }
 
+# Status bytes of complete transactions, `c` marks an unfinished one:
+TRANSACTION_STATUS = frozenset(' pu')
+
 
 def set_magic(path, version):
-    """Set the magic bytes to declare the Python version compatibility."""
-    with open(path, 'r+b') as file:
-        file.write(VERSION_MAGIC_MAP[version])
+    """Set the magic bytes to declare the Python version compatibility.
+
+    The bytes are written using a single write to the first block of the file
+    which is synced to disk before returning.
+    """
+    fd = os.open(path, os.O_RDWR)
+    try:
+        os.write(fd, VERSION_MAGIC_MAP[version])
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def verify(path):
+    """Check the headers of all records of the FileStorage file at `path`.
+
+    The transaction and data record headers are read sequentially from a
+    memory map of the file, the pickles are not read. Checks the lengths,
+    the transaction ids, the status bytes and that the back pointers point
+    to earlier records.
+
+    Returns a tuple `(transactions, records)` of the numbers of records
+    found. Raises a `ValueError` describing the first problem found.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        if size < 4 or file.read(4) not in VERSION_MAGIC_MAP.values():
+            raise ValueError('{} is not a FileStorage file.'.format(path))
+        if size == 4:
+            return 0, 0
+        with contextlib.closing(mmap.mmap(
+                file.fileno(), 0, access=mmap.ACCESS_READ)) as data:
+            return _verify(path, data, size)
+
+
+def _verify(path, data, size):
+    """Check the records in `data`, see `verify`."""
+    def fail(message, pos):
+        raise ValueError('{}: {} at {}.'.format(path, message, pos))
+
+    transactions = records = 0
+    last_tid = ZODB.utils.z64
+    pos = 4
+    while pos < size:
+        if pos + TRANS_HDR_LEN > size:
+            fail('Truncated transaction header', pos)
+        tid, length, status, user_length, description_length, \
+            extension_length = struct.unpack_from(TRANS_HDR, data, pos)
+        end = pos + length
+        if end + 8 > size or length < TRANS_HDR_LEN:
+            fail('Transaction length {} out of bounds'.format(length), pos)
+        if struct.unpack_from('>Q', data, end)[0] != length:
+            fail('Redundant transaction length does not match', pos)
+        if tid <= last_tid:
+            fail('Transaction id {} not increasing'.format(
+                ZODB.utils.tid_repr(tid)), pos)
+        if status not in TRANSACTION_STATUS:
+            fail('Transaction status {!r} of an unfinished or unknown '
+                 'transaction'.format(status), pos)
+        record_pos = (pos + TRANS_HDR_LEN + user_length +
+                      description_length + extension_length)
+        if record_pos > end:
+            fail('Transaction meta data longer than the transaction', pos)
+        while record_pos < end:
+            if record_pos + DATA_HDR_LEN > end:
+                fail('Truncated data record header', record_pos)
+            oid, record_tid, previous, transaction_pos, version_length, \
+                pickle_length = struct.unpack_from(
+                    DATA_HDR, data, record_pos)
+            if record_tid != tid or transaction_pos != pos:
+                fail('Data record of another transaction', record_pos)
+            if previous >= pos or 0 < previous < 4:
+                fail('Previous record pointer {} out of bounds'.format(
+                    previous), record_pos)
+            if version_length:
+                fail('Data record with a version', record_pos)
+            next_pos = record_pos + DATA_HDR_LEN + (pickle_length or 8)
+            if next_pos > end:
+                fail('Data length {} out of bounds'.format(pickle_length),
+                     record_pos)
+            if not pickle_length:
+                back_pointer = struct.unpack_from(
+                    '>Q', data, record_pos + DATA_HDR_LEN)[0]
+                if back_pointer >= pos or 0 < back_pointer < 4:
+                    fail('Back pointer {} out of bounds'.format(
+                        back_pointer), record_pos)
+            records += 1
+            record_pos = next_pos
+        transactions += 1
+        last_tid = tid
+        pos = end + 8
+    return transactions, records
 
 
 def main(args=None):
@@ -21,5 +120,16 @@ def main(args=None):
     parser.add_argument(
         'version', choices=['Python2', 'Python3'],
         help='Python version the database should be readable with.')
+    parser.add_argument(
+        '--verify', action='store_true',
+        help='Check the headers of all records of the file before setting '
+        'the magic bytes and do not set them if there is a problem.')
     args = parser.parse_args(args)
+    if args.verify:
+        try:
+            transactions, records = verify(args.zodb_path)
+        except ValueError as e:
+            parser.exit(1, '{}\n'.format(e))
+        print "Verified {} transactions with {} data records.".format(
+            transactions, records)
     set_magic(args.zodb_path, args.version)
@@ -0,0 +1,108 @@
+from .analyze import RESULT_FORMAT, print_samples
+from .errors import ErrorSummary
+from .migrate import print_results
+import argparse
+import collections
+import json
+import logging
+import random
+
+
+log = logging.getLogger(__name__)
+
+
+def read_result(path):
+    """Read a result file written by `.analyze.write_result`."""
+    with open(path) as file:
+        data = json.load(file)
+    if data.get('format') != RESULT_FORMAT:
+        raise ValueError(
+            '{} is not an analysis result of a known format.'.format(path))
+    return data
+
+
+def check_shards(shards, storages):
+    """Check that `shards` are all shards of one analysis.
+
+    `shards` ... list of the shards of the result files, `None` if a file
+                 contains the result of a whole storage.
+    `storages` ... list of tuples `(last transaction, max OID)` of the
+                   analyzed storages, the paths may differ between machines.
+
+    Raises a `ValueError` if the results are of different storages, if a
+    shard is given twice or if the shards are of analyses using different
+    numbers of shards. Logs missing shards.
+    """
+    if len(set(storages)) > 1:
+        raise ValueError(
+            'The results are of different storages: {} (last transaction, '
+            'max OID)'.format(', '.join(
+                '{} {}'.format(*x) for x in sorted(set(storages)))))
+    given = [tuple(x) for x in shards if x is not None]
+    if not given:
+        return
+    numbers = set(number for number, total in given)
+    totals = set(total for number, total in given)
+    if len(totals) > 1 or len(given) < len(shards):
+        raise ValueError('The results are of different shardings.')
+    if len(numbers) < len(given):
+        raise ValueError('A shard is given more than once.')
+    total = totals.pop()
+    missing = sorted(set(range(1, total + 1)) - numbers)
+    if missing:
+        log.warn('The results of the shards %s of %s are missing.',
+                 ', '.join(str(x) for x in missing), total)
+
+
+def merge_results(paths, sample_size=5):
+    """Merge the result files of an analysis at `paths`.
+
+    Returns a tuple `(result, errors, samples, error_summary)`. The first
+    ones are like the ones `.analyze.analyze_storage` returns, `samples`
+    contains at most `sample_size` random sample values of each field.
+    `error_summary` is an `.errors.ErrorSummary` keeping at most
+    `sample_size` sample OIDs of each field and exception type.
+    """
+    results = [read_result(x) for x in paths]
+    # Files written by older versions do not tell the state of the storage:
+    check_shards([x['shard'] for x in results],
+                 [(x.get('last_transaction'), x.get('max_oid'))
+                  for x in results])
+    result = collections.Counter()
+    errors = collections.Counter()
+    samples = collections.defaultdict(list)
+    error_summary = ErrorSummary(sample_size)
+    for data in results:
+        result.update(data['result'])
+        errors.update(data['errors'])
+        error_summary.update(ErrorSummary.from_json(
+            data.get('error_summary', []), sample_size))
+        for name, values in data['samples'].items():
+            samples[name].extend(values)
+    for name, values in samples.items():
+        if len(values) > sample_size:
+            samples[name] = random.sample(values, sample_size)
+    return result, errors, samples, error_summary
+
+
+def main(args=None):
+    """Entry point for the merge script."""
+    parser = argparse.ArgumentParser(
+        description="Merge the result files of the shards of an analysis "
+        "written by zodb-py3migrate-analyze --output and print the report "
+        "of the whole storage.")
+    parser.add_argument(
+        'paths', nargs='+', metavar='PATH', help='Path of a result file.')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='Be more verbose in output')
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+    try:
+        result, errors, samples, error_summary = merge_results(options.paths)
+    except ValueError as e:
+        parser.exit(1, '{}\n'.format(e))
+    print_results(result, errors, verb='Found', verbose=options.verbose)
+    if options.verbose:
+        print_samples(samples)
+    error_summary.print_summary()
@@ -1,13 +1,15 @@
+from .errors import ErrorSummary
+from .fsindex import prepare_index
+from .scanners import get_scanner, get_tree_classname, is_bucket
+from .scanners import is_container, is_treeset, iter_bucket_oids
+from .storage import StorageWrapper, ZlibStorage
 from ZODB.DB import DB
-import BTrees.IOBTree
-import BTrees.LOBTree
-import BTrees.OIBTree
-import BTrees.OLBTree
-import BTrees.OOBTree
 import ZODB.FileStorage
 import ZODB.POSException
+import ZODB.utils
 import argparse
 import collections
+import itertools
 import logging
 import pdb  # noqa
 import transaction
@@ -27,44 +29,25 @@ def wake_object(obj):
         log.error('POSKeyError: %s', e)
 
 
-def is_container(obj):
-    return isinstance(obj, (
-        BTrees.IOBTree.IOBTree,
-        BTrees.LOBTree.LOBTree,
-        BTrees.OIBTree.OIBTree,
-        BTrees.OLBTree.OLBTree,
-        BTrees.OOBTree.OOBTree,
-        persistent.mapping.PersistentMapping,
-        persistent.list.PersistentList))
-
-
-def is_treeset(obj):
-    return isinstance(obj, (
-        BTrees.IOBTree.IOTreeSet,
-        BTrees.LOBTree.LOTreeSet,
-        BTrees.OIBTree.OITreeSet,
-        BTrees.OLBTree.OLTreeSet,
-        BTrees.OOBTree.OOTreeSet))
-
-
 def get_data(obj):
     """Return data of object. Return `None` if not possible.
 
-    We try to fetch data by reading __dict__, but this is not possible for
-    `BTree`s. Call `keys` or `items` on obj respectively.
+    The data is returned by the scanner registered for the class of the
+    object, see `.scanners`. By default we read the `__dict__` or the slots
+    of the object, for `BTree`s we call `keys` or `items` on obj
+    respectively.
 
     """
-    result = None
-    if is_container(obj):
-        result = obj
-    elif is_treeset(obj):
-        result = dict.fromkeys(obj.keys())
-    else:
-        try:
-            result = vars(obj)
-        except TypeError:
-            pass
-    return result
+    return get_scanner(obj)(obj)
+
+
+def is_ascii(value):
+    """Tell whether the `str` object `value` contains only ASCII bytes."""
+    try:
+        value.decode('ascii')
+    except UnicodeDecodeError:
+        return False
+    return True
 
 
 def find_binary(value):
@@ -76,12 +59,9 @@ def find_binary(value):
         # Already marked as binary, skip.
         return None
     if isinstance(value, str):
-        try:
-            value.decode('ascii')
-        except UnicodeDecodeError:
-            return 'string'
-        else:
+        if is_ascii(value):
             return None
+        return 'string'
     elif isinstance(value, collections.Mapping):
         for k, v in value.items():
             if find_binary(k) or find_binary(v):
@@ -99,6 +79,9 @@ def find_binary(value):
 
 
 def get_classname(obj):
+    if is_bucket(obj):
+        # Its items are reported as the ones of its tree.
+        return get_tree_classname(obj)
     return obj.__class__.__module__ + '.' + obj.__class__.__name__
 
 
@@ -111,33 +94,109 @@ def get_items(obj):
     return items
 
 
+def iter_storage_oids(storage, start_at=None):
+    """Iterate the OIDs of the current records in `storage`.
+
+    `start_at` ... representation of the OID to start with.
+
+    The OIDs are read from the index of the wrapped `FileStorage`, so the
+    records are neither read nor decompressed.
+    """
+    if start_at is not None:
+        next = ZODB.utils.repr_to_oid(start_at)
+    else:
+        next = None  # first OID in storage
+    while isinstance(storage, StorageWrapper):
+        storage = storage.base
+    index = storage._index
+    oid = index.minKey(next)
+    while True:
+        yield oid
+        try:
+            oid = index.minKey(ZODB.utils.p64(ZODB.utils.u64(oid) + 1))
+        except ValueError:
+            # There is no larger OID.
+            break
+
+
+def iter_prefetched(connection, oids, size=100):
+    """Iterate `oids` letting the storage prefetch the next `size` records.
+
+    The records of the next batch of OIDs are prefetched while the current
+    batch is iterated.
+    """
+    oids = iter(oids)
+    batch = list(itertools.islice(oids, size))
+    connection.prefetch(batch)
+    while batch:
+        next_batch = list(itertools.islice(oids, size))
+        if next_batch:
+            connection.prefetch(next_batch)
+        for oid in batch:
+            yield oid
+        batch = next_batch
+
+
+def iter_scanned_objects(connection, oids):
+    """Iterate the objects of `oids` which need to be scanned.
+
+    The items of a bucket are scanned via its tree. The buckets are held back
+    until all other objects were iterated and are only returned if their tree
+    was not among them, e. g. if `oids` are the records the index flags or
+    the ones copied while following.
+    """
+    buckets = []
+    covered = set()  # OIDs of the buckets of the iterated trees
+    for oid in iter_prefetched(connection, oids):
+        obj = connection.get(oid)
+        if is_bucket(obj):
+            buckets.append(oid)
+            continue
+        if is_container(obj) or is_treeset(obj):
+            covered.update(iter_bucket_oids(obj))
+        yield obj
+    for oid in buckets:
+        if oid not in covered:
+            yield connection.get(oid)
+
+
 def find_obj_with_binary_content(
-        storage, errors, start_at=None, limit=None, watermark=10000):
+        storage, errors, start_at=None, limit=None, watermark=10000,
+        oids=None, pacer=None, profile=None, error_summary=None, db=None):
     """Generator which finds objects in `storage` having binary content.
 
     Yields tuple: (object, data, key-name, value, type)
 
     `type` can be one of 'string', 'dict', 'iterable', 'key'.
+
+    `oids` ... iterable of the OIDs to look at, default: all OIDs of the
+               storage beginning with `start_at`.
+    `pacer` ... `.pacing.Pacer` limiting the rate objects are read at.
+    `profile` ... `.profiling.MemoryProfile` recording the memory use at the
+                  start, at each watermark and at the end.
+    `error_summary` ... `.errors.ErrorSummary` counting the values which
+                        cannot be scanned, default: log each of them.
+    `db` ... `DB` opened on `storage` to read the objects with, default: a
+             new one which is not closed.
     """
-    db = DB(storage)
+    if error_summary is None:
+        error_summary = ErrorSummary(trace=True)
+    if db is None:
+        db = DB(storage)
     connection = db.open()
-    if start_at is not None:
-        next = ZODB.utils.repr_to_oid(start_at)
-    else:
-        next = None  # first OID in storage
+    if oids is None:
+        oids = iter_storage_oids(storage, start_at)
     len_storage = len(storage)
     log.warn('Analyzing about %s objects.', len_storage)
     count = 0
-    run = True
-    while run:
-        oid, tid, data, next = storage.record_iternext(next)
-        if next is None:
-            run = False
-
-        obj = connection.get(oid)
+    if profile is not None:
+        profile.record(connection, count)
+    for obj in iter_scanned_objects(connection, oids):
         klassname = get_classname(obj)
 
         wake_object(obj)
+        if pacer is not None:
+            pacer.pace(size=obj._p_estimated_size)
         data = get_data(obj)
         if data is None:
             errors[klassname] += 1
@@ -152,7 +211,11 @@ def find_obj_with_binary_content(
                 if type_ is not None:
                     yield obj, data, key, key, 'key'
             except Exception:
-                log.error('Could not execute %r', value, exc_info=True)
+                if is_treeset(obj) or is_container(obj) or is_bucket(obj):
+                    name = '{}[*]'.format(klassname)
+                else:
+                    name = '{}.{}'.format(klassname, key)
+                error_summary.add(name, obj._p_oid, value)
                 continue
 
         count += 1
@@ -160,20 +223,23 @@ def find_obj_with_binary_content(
             log.warn('%s of about %s objects analyzed.', count, len_storage)
             transaction.savepoint()
             connection.cacheMinimize()
+            if profile is not None:
+                profile.record(connection, count)
         if limit is not None and count >= limit:
-            return
+            break
+    if profile is not None and count % watermark:
+        profile.record(connection, count)
 
 
-def get_format_string(obj, display_type=False, verbose=False):
+def get_format_string(obj, display_type=False):
     format_string = ''
-    if is_treeset(obj) or is_container(obj):
+    if is_treeset(obj) or is_container(obj) or is_bucket(obj):
         format_string = '{klassname}[{key!r}]'
     else:
         format_string = '{klassname}.{key}'
 
     if display_type:
-        format_string += ' is {type_}%s' % (
-            ': {value!r:.30}' if verbose else '')
+        format_string += ' is {type_}'
 
     return format_string
 
@@ -209,11 +275,29 @@ def get_argparse_parser(description):
     group.add_argument(
         '-b', '--blob-dir', default=None,
         help='Path to the blob directory if ZODB blobs are used.')
+    group.add_argument(
+        '--zlib', action='store_true',
+        help='The records of the storage are compressed using '
+        'zc.zlibstorage.')
+    group.add_argument(
+        '--read-only', action='store_true',
+        help='Open the storage read-only without locking it, so it can be '
+        'used by an application at the same time. Transactions committed '
+        'after opening the storage are ignored.')
+    group.add_argument(
+        '--index-jobs', default=None, type=int, metavar='N',
+        help='Number of processes building the index of the storage in '
+        'parallel if it is missing or covers only a part of the file. '
+        'Default: number of CPUs')
     group.add_argument(
         '-v', '--verbose', action='store_true',
         help='Be more verbose in output')
     group.add_argument(
         '--pdb', action='store_true', help='Drop into a debugger on an error')
+    group.add_argument(
+        '--trace-errors', action='store_true',
+        help='Log the traceback of each value which cannot be scanned instead '
+        'of only summarizing them per field and exception type.')
     return parser
 
 
@@ -232,10 +316,24 @@ def run(parser, callable, *arg_names, **kw):
 
     args = parser.parse_args(args)
     try:
+        kw = {}
+        if args.read_only:
+            kw['read_only'] = True
+        if not args.read_only:
+            # Do not write next to a storage another process may be using:
+            prepare_index(args.zodb_path, args.index_jobs)
         storage = ZODB.FileStorage.FileStorage(
-            args.zodb_path, blob_dir=args.blob_dir)
+            args.zodb_path, blob_dir=args.blob_dir, **kw)
+        if args.read_only:
+            log.warn('Reading %s as of transaction %s.', args.zodb_path,
+                     ZODB.utils.tid_repr(storage.lastTransaction()))
+        if args.zlib:
+            storage = ZlibStorage(storage)
         callable_args = [getattr(args, x) for x in arg_names]
-        return callable(storage, *callable_args)
+        try:
+            return callable(storage, *callable_args)
+        finally:
+            storage.close()
     except Exception:
         if args.pdb:
             pdb.post_mortem()
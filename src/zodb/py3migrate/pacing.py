@@ -0,0 +1,57 @@
+import multiprocessing
+import time
+
+
+class Pacer(object):
+    """Token buckets limiting the rate of objects and bytes read.
+
+    `objects_per_sec` ... maximum number of objects per second.
+    `bytes_per_sec` ... maximum number of bytes per second.
+    `burst` ... number of seconds the unused rate is saved up for.
+
+    The buckets are kept in shared memory, so worker processes forked after
+    creating the pacer share the rates.
+    """
+
+    def __init__(self, objects_per_sec=None, bytes_per_sec=None, burst=1.0):
+        self.rates = (objects_per_sec, bytes_per_sec)
+        self.burst = burst
+        self._lock = multiprocessing.Lock()
+        # Time of the last update and the tokens in the buckets:
+        self._state = multiprocessing.RawArray(
+            'd', [time.time()] + [(rate or 0) * burst for rate in self.rates])
+
+    def pace(self, objects=1, size=0):
+        """Take tokens for `objects` of `size` bytes from the buckets.
+
+        Sleeps until the buckets are no longer in debt.
+        """
+        wait = 0
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._state[0]
+            self._state[0] = now
+            for i, (rate, amount) in enumerate(
+                    zip(self.rates, (objects, size)), 1):
+                if not rate:
+                    continue
+                tokens = min(self._state[i] + elapsed * rate,
+                             rate * self.burst) - amount
+                self._state[i] = tokens
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+        if wait:
+            time.sleep(wait)
+
+
+def get_pacer(max_read_rate=None, max_objects_per_sec=None):
+    """Return a `Pacer` for the command line limits, `None` if unlimited.
+
+    `max_read_rate` ... MB per second.
+    """
+    if not max_read_rate and not max_objects_per_sec:
+        return None
+    bytes_per_sec = None
+    if max_read_rate:
+        bytes_per_sec = max_read_rate * 1024 * 1024
+    return Pacer(max_objects_per_sec, bytes_per_sec)
@@ -0,0 +1,91 @@
+import collections
+import gc
+import resource
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 only has it using the `pytracemalloc` patches.
+    tracemalloc = None
+
+
+class Watermark(collections.namedtuple('Watermark', [
+        'count', 'max_rss', 'cached', 'non_ghosts', 'lengths'])):
+    """Memory use after analyzing `count` objects."""
+
+
+class Objects(collections.namedtuple('Objects', ['types', 'snapshot'])):
+    """Objects per type and `tracemalloc` snapshot at a watermark."""
+
+
+class MemoryProfile(object):
+    """Record the memory use at the watermarks of a scan.
+
+    At each watermark the maximum resident set size, the number of objects
+    in the pickle cache, the lengths of the watched containers and the
+    number of objects per type tracked by the garbage collector are
+    recorded. If `tracemalloc` is available, a snapshot of the allocation
+    sites is taken, too. Only the `Objects` of the `first` and of the `last`
+    watermark are kept, as they are large.
+
+    `top` ... number of types and allocation sites in the report.
+    """
+
+    def __init__(self, top=20):
+        self.top = top
+        self.watermarks = []
+        self.containers = {}
+        self.first = self.last = None
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def watch(self, **containers):
+        """Record the lengths of the keyword arguments at the watermarks."""
+        self.containers.update(containers)
+
+    def record(self, connection, count):
+        """Record the memory use after analyzing `count` objects."""
+        types = collections.Counter(
+            type(x).__name__ for x in gc.get_objects())
+        snapshot = None
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+        self.last = Objects(types, snapshot)
+        if self.first is None:
+            self.first = self.last
+        self.watermarks.append(Watermark(
+            count,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            len(connection._cache),
+            connection._cache.ringlen(),
+            {name: len(x) for name, x in self.containers.items()}))
+
+    def write_report(self, path):
+        """Write the differences between the first and the last watermark."""
+        first, last = self.first, self.last
+        with open(path, 'w') as file:
+            file.write(
+                'Memory at {} watermarks: (objects analyzed, max RSS in KB, '
+                'objects in the pickle cache, non-ghosts, lengths)\n'.format(
+                    len(self.watermarks)))
+            for mark in self.watermarks:
+                file.write('{} ({}, {}, {}, {})\n'.format(
+                    mark.count, mark.max_rss, mark.cached, mark.non_ghosts,
+                    ', '.join('{} {}'.format(name, length) for name, length
+                              in sorted(mark.lengths.items()))))
+            growth = sorted(
+                ((last.types[x] - first.types[x], x) for x in last.types
+                 if last.types[x] > first.types[x]),
+                key=lambda x: (-x[0], x[1]))
+            file.write('\nGrowth of the number of objects per type: '
+                       '(first, last watermark)\n')
+            for difference, name in growth[:self.top]:
+                file.write('{} +{} ({}, {})\n'.format(
+                    name, difference, first.types[name], last.types[name]))
+            file.write('\nTop allocation sites since the first watermark:\n')
+            if last.snapshot is None:
+                file.write('tracemalloc is not available.\n')
+                return
+            for stat in last.snapshot.compare_to(
+                    first.snapshot, 'lineno')[:self.top]:
+                file.write('{}\n'.format(stat))
@@ -0,0 +1,204 @@
+import ZODB._compat
+import ZODB.POSException
+import ZODB.serialize
+import ZODB.utils
+import cStringIO
+import collections
+import logging
+import time
+import zodbpickle.pickletools_2 as pickletools
+
+
+log = logging.getLogger(__name__)
+
+
+# Opcodes whose argument is a `str`, i.e. neither `unicode` nor
+# `zodbpickle.binary`:
+STRING_OPCODES = frozenset(['STRING', 'BINSTRING', 'SHORT_BINSTRING'])
+
+# Opcodes referring to a class by its module and name:
+CLASS_OPCODES = frozenset(['GLOBAL', 'INST'])
+
+
+def get_record_classname(data):
+    """Return the dotted name of the class of a pickled record.
+
+    Only the class pickle at the beginning of `data` is read, the class
+    itself does not get imported.
+
+    """
+    module, name = ZODB.utils.get_pickle_metadata(data)
+    return '{}.{}'.format(module, name)
+
+
+def iter_record_ops(data):
+    """Iterate the opcodes of both pickles of a record without unpickling.
+
+    Yields the tuples of `pickletools.genops`.
+    """
+    file = cStringIO.StringIO(data)
+    for pickle in ('class', 'state'):
+        for op in pickletools.genops(file):
+            yield op
+
+
+def has_binary_strings(data):
+    """Tell whether the record `data` contains non-ASCII `str` objects."""
+    for opcode, arg, pos in iter_record_ops(data):
+        if opcode.name in STRING_OPCODES:
+            try:
+                arg.decode('ascii')
+            except UnicodeDecodeError:
+                return True
+    return False
+
+
+def optimize_record(data):
+    """Remove the memo PUT opcodes no GET refers to from a record.
+
+    This is what `pickletools.optimize` does for a single pickle, but the
+    class pickle and the state pickle of a record share their memo.
+    """
+    gets = set()
+    puts = []  # tuples (memo key, start, end)
+    put = None
+    for opcode, arg, pos in iter_record_ops(data):
+        if put is not None:
+            puts.append(put + (pos,))
+            put = None
+        if 'PUT' in opcode.name:
+            put = (arg, pos)
+        elif 'GET' in opcode.name:
+            gets.add(arg)
+    chunks = []
+    start = 0
+    for key, put_start, put_end in puts:
+        if key not in gets:
+            chunks.append(data[start:put_start])
+            start = put_end
+    chunks.append(data[start:])
+    return b''.join(chunks)
+
+
+def rename_classes(data, renames, counts):
+    """Rewrite the class references of the record `data`.
+
+    `renames` ... dict mapping dotted class names to new ones.
+    `counts` ... dict mapping tuples `(old name, new name)` to the number of
+                 rewritten references, it gets updated.
+
+    The `GLOBAL` and `INST` opcodes of both pickles are rewritten, they
+    refer to classes by module and name. Returns the new record.
+    """
+    chunks = []
+    start = 0
+    for opcode, arg, pos in iter_record_ops(data):
+        if opcode.name not in CLASS_OPCODES:
+            continue
+        module, name = arg.split(' ')
+        old = '{}.{}'.format(module, name)
+        new = renames.get(old)
+        if new is None:
+            continue
+        chunks.append(data[start:pos])
+        chunks.append('{}{}\n{}\n'.format(
+            opcode.code, *new.rsplit('.', 1)))
+        start = pos + len(module) + len(name) + 3
+        counts[old, new] = counts.get((old, new), 0) + 1
+    chunks.append(data[start:])
+    return b''.join(chunks)
+
+
+class Placeholder(dict):
+    """Stands in for the classes a record refers to when timing its load.
+
+    It accepts the arguments, the state and the items an unpickled object
+    gets.
+    """
+
+    def __init__(self, *args, **kw):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+    def append(self, item):
+        pass
+
+
+def time_load(data):
+    """Return the seconds unpickling the record `data` takes.
+
+    Persistent references are not loaded and the classes the record refers
+    to are not imported, so records of missing classes can be timed, too.
+    """
+    started = time.time()
+    unpickler = ZODB._compat.Unpickler(cStringIO.StringIO(data))
+    unpickler.persistent_load = lambda reference: None
+    unpickler.find_global = lambda module, name: Placeholder
+    unpickler.load()
+    unpickler.load()
+    return time.time() - started
+
+
+class OIDBitmap(object):
+    """Compact set of OIDs using one bit per OID.
+
+    `max_bytes` ... size the bitmap may grow to at most, the OIDs beyond it
+                    are kept in a `set`, e. g. the few huge OIDs a
+                    `DemoStorage` hands out. Default: no limit.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._bits = bytearray()
+        self._max_bytes = max_bytes
+        self._others = set()
+
+    def __contains__(self, oid):
+        byte, bit = divmod(ZODB.utils.u64(oid), 8)
+        if byte >= len(self._bits):
+            return oid in self._others
+        return bool(self._bits[byte] & 1 << bit)
+
+    def add(self, oid):
+        """Add `oid` to the set. Return `False` if it was already contained."""
+        byte, bit = divmod(ZODB.utils.u64(oid), 8)
+        if byte >= len(self._bits):
+            size = max(byte + 1, 2 * len(self._bits))
+            if self._max_bytes is not None:
+                size = min(size, self._max_bytes)
+            if byte >= size:
+                # Never covered by the bitmap as it does not grow beyond:
+                if oid in self._others:
+                    return False
+                self._others.add(oid)
+                return True
+            # Grow exponentially to avoid copying the bitmap too often:
+            self._bits.extend(bytearray(size - len(self._bits)))
+        if self._bits[byte] & 1 << bit:
+            return False
+        self._bits[byte] |= 1 << bit
+        return True
+
+
+def iter_reachable_oids(storage, root=ZODB.utils.z64):
+    """Iterate the OIDs of the records reachable from the `root` OID.
+
+    The persistent references are read from the pickles without loading the
+    objects, the OIDs are yielded in breadth-first order.
+    """
+    # A bitmap of about one bit per record, OIDs beyond are kept in a set:
+    visited = OIDBitmap(max_bytes=len(storage) // 8 + 1)
+    visited.add(root)
+    queue = collections.deque([root])
+    while queue:
+        oid = queue.popleft()
+        try:
+            data, tid = ZODB.utils.load_current(storage, oid)
+        except ZODB.POSException.POSKeyError:
+            log.error('Dangling reference to %s.', ZODB.utils.oid_repr(oid))
+            continue
+        yield oid
+        for reference in ZODB.serialize.referencesf(data):
+            if visited.add(reference):
+                queue.append(reference)
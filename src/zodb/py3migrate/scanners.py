@@ -0,0 +1,215 @@
+import BTrees.IOBTree
+import BTrees.LOBTree
+import BTrees.OIBTree
+import BTrees.OLBTree
+import BTrees.OOBTree
+import inspect
+import persistent
+import persistent.list
+import persistent.mapping
+import pkg_resources
+
+
+# Entry point group to register scanners for classes. The name of an entry
+# point is the dotted name of the class, it points to a scanner.
+ENTRY_POINT_GROUP = 'zodb.py3migrate.scanners'
+
+# A scanner is a callable taking an object, it returns the data to look for
+# binary strings in. The data has an `items` method and supports item
+# assignment to change the object. `None` means the object cannot be scanned.
+SCANNERS = {}  # dotted name of a class -> scanner
+_cache = {}  # class -> scanner
+
+
+def is_container(obj):
+    return isinstance(obj, (
+        BTrees.IOBTree.IOBTree,
+        BTrees.LOBTree.LOBTree,
+        BTrees.OIBTree.OIBTree,
+        BTrees.OLBTree.OLBTree,
+        BTrees.OOBTree.OOBTree,
+        persistent.mapping.PersistentMapping,
+        persistent.list.PersistentList))
+
+
+def is_treeset(obj):
+    return isinstance(obj, (
+        BTrees.IOBTree.IOTreeSet,
+        BTrees.LOBTree.LOTreeSet,
+        BTrees.OIBTree.OITreeSet,
+        BTrees.OLBTree.OLTreeSet,
+        BTrees.OOBTree.OOTreeSet))
+
+
+# The buckets resp. sets of the trees above and the dotted name of the tree
+# class they belong to:
+BUCKET_TREES = {
+    BTrees.IOBTree.IOBucket: 'BTrees.IOBTree.IOBTree',
+    BTrees.IOBTree.IOSet: 'BTrees.IOBTree.IOTreeSet',
+    BTrees.LOBTree.LOBucket: 'BTrees.LOBTree.LOBTree',
+    BTrees.LOBTree.LOSet: 'BTrees.LOBTree.LOTreeSet',
+    BTrees.OIBTree.OIBucket: 'BTrees.OIBTree.OIBTree',
+    BTrees.OIBTree.OISet: 'BTrees.OIBTree.OITreeSet',
+    BTrees.OLBTree.OLBucket: 'BTrees.OLBTree.OLBTree',
+    BTrees.OLBTree.OLSet: 'BTrees.OLBTree.OLTreeSet',
+    BTrees.OOBTree.OOBucket: 'BTrees.OOBTree.OOBTree',
+    BTrees.OOBTree.OOSet: 'BTrees.OOBTree.OOTreeSet',
+}
+
+
+def is_bucket(obj):
+    return isinstance(obj, tuple(BUCKET_TREES))
+
+
+def get_tree_classname(bucket):
+    """Return the dotted name of the tree class `bucket` belongs to."""
+    return [BUCKET_TREES[x] for x in inspect.getmro(bucket.__class__)
+            if x in BUCKET_TREES][0]
+
+
+def iter_bucket_oids(obj):
+    """Iterate the OIDs of the buckets of the tree or tree set `obj`.
+
+    Nothing is returned for other objects and for small trees, which store
+    their items in their own record.
+    """
+    bucket = getattr(obj, '_firstbucket', None)
+    while bucket is not None:
+        if bucket._p_oid is not None:
+            yield bucket._p_oid
+        bucket = bucket._next
+
+
+class AttributeProxy(object):
+    """Write-through view on some attributes of an object."""
+
+    def __init__(self, obj, names):
+        self.obj = obj
+        self.names = names
+
+    def items(self):
+        return [(name, getattr(self.obj, name)) for name in self.names
+                if hasattr(self.obj, name)]
+
+    def __setitem__(self, name, value):
+        setattr(self.obj, name, value)
+
+
+class StateProxy(object):
+    """Write-through view on the state `__getstate__` returns."""
+
+    def __init__(self, obj, state):
+        self.obj = obj
+        self.state = state
+
+    def items(self):
+        if isinstance(self.state, dict):
+            return self.state.items()
+        return list(enumerate(self.state))
+
+    def __setitem__(self, key, value):
+        if isinstance(self.state, dict):
+            state = dict(self.state)
+            state[key] = value
+        else:
+            state = list(self.state)
+            state[key] = value
+            state = type(self.state)(state)
+        self.obj.__setstate__(state)
+        self.state = state
+
+
+def scan_container(obj):
+    return obj
+
+
+def scan_treeset(obj):
+    return dict.fromkeys(obj.keys())
+
+
+def scan_dict(obj):
+    return vars(obj)
+
+
+def scan_state(obj):
+    state = obj.__getstate__()
+    if state is None:
+        return None
+    return StateProxy(obj, state)
+
+
+def scan_bucket(obj):
+    if hasattr(obj, 'items'):
+        return obj
+    return dict.fromkeys(obj.keys())
+
+
+def scan_nothing(obj):
+    return None
+
+
+def get_slot_names(klass):
+    """Return the names of the `__slots__` of `klass` and its bases."""
+    names = []
+    for base in inspect.getmro(klass):
+        if base is persistent.Persistent:
+            # Its slots hold the persistence machinery.
+            continue
+        slots = base.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = [slots]
+        names.extend(x for x in slots
+                     if x not in ('__dict__', '__weakref__') and
+                     x not in names)
+    return names
+
+
+def register_scanner(classname, scanner):
+    """Register `scanner` for the class with the dotted name `classname`.
+
+    It is used for the subclasses of the class, too.
+    """
+    SCANNERS[classname] = scanner
+    _cache.clear()
+
+
+def load_entry_points():
+    """Register the scanners of the entry points."""
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        SCANNERS.setdefault(entry_point.name, entry_point.load())
+
+
+def choose_scanner(obj):
+    """Choose the scanner for the class of `obj`."""
+    klass = obj.__class__
+    for base in inspect.getmro(klass):
+        classname = '{}.{}'.format(base.__module__, base.__name__)
+        if classname in SCANNERS:
+            return SCANNERS[classname]
+    if is_container(obj):
+        return scan_container
+    if is_treeset(obj):
+        return scan_treeset
+    if is_bucket(obj):
+        return scan_bucket
+    if getattr(klass, '__dictoffset__', 1):
+        # Instances of new style classes with a `__dict__` have a non-zero
+        # offset, old style classes do not have this attribute.
+        return scan_dict
+    names = get_slot_names(klass)
+    if names:
+        return lambda obj: AttributeProxy(obj, names)
+    if hasattr(obj, '__getstate__'):
+        return scan_state
+    return scan_nothing
+
+
+def get_scanner(obj):
+    """Return the scanner for `obj`, the choice is cached per class."""
+    scanner = _cache.get(obj.__class__)
+    if scanner is None:
+        if not _cache:
+            # First lookup or new scanners were registered:
+            load_entry_points()
+        scanner = _cache[obj.__class__] = choose_scanner(obj)
+    return scanner
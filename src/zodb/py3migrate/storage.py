@@ -0,0 +1,149 @@
+from .records import get_record_classname, optimize_record, time_load
+from multiprocessing.pool import ThreadPool
+import ZODB.POSException
+import ZODB.utils
+import zlib
+import zope.interface
+
+
+# Prefix of compressed records as written by `zc.zlibstorage`:
+ZLIB_PREFIX = b'.z'
+
+
+def compress(data):
+    """Compress a record unless compressing does not make it smaller."""
+    if not data or data.startswith(ZLIB_PREFIX):
+        return data
+    compressed = ZLIB_PREFIX + zlib.compress(data)
+    if len(compressed) < len(data):
+        return compressed
+    return data
+
+
+def decompress(data):
+    """Decompress a record if it is compressed."""
+    if data and data.startswith(ZLIB_PREFIX):
+        return zlib.decompress(data[len(ZLIB_PREFIX):])
+    return data
+
+
+class StorageWrapper(object):
+    """Base class of storage wrappers delegating to the `base` storage."""
+
+    def __init__(self, base):
+        self.base = base
+        zope.interface.directlyProvides(
+            self, zope.interface.providedBy(base))
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def __len__(self):
+        return len(self.base)
+
+
+class NonClosingStorage(StorageWrapper):
+    """Storage wrapper which does not close the `base` storage.
+
+    Closing a `DB` closes its storage, a `DB` opened on this wrapper can be
+    closed while the storage is still needed.
+    """
+
+    def close(self):
+        pass
+
+
+class ZlibStorage(StorageWrapper):
+    """Storage wrapper for storages written using `zc.zlibstorage`.
+
+    Records are decompressed when loaded and compressed when stored.
+    Prefetched records are loaded and decompressed by a pool of `threads`
+    in the background, `zlib` releases the GIL while decompressing.
+    """
+
+    def __init__(self, base, threads=None):
+        super(ZlibStorage, self).__init__(base)
+        self._pool = ThreadPool(threads)
+        self._prefetched = {}
+        self._prefetched_before = {}
+
+    def load(self, oid, version=''):
+        data, tid = self.base.load(oid, version)
+        return decompress(data), tid
+
+    def _loadBefore(self, oid, tid):
+        result = self.base.loadBefore(oid, tid)
+        if result is None:
+            return None
+        data, start, end = result
+        return decompress(data), start, end
+
+    def loadBefore(self, oid, tid):
+        key = (oid, tid)
+        result = (self._prefetched.pop(key, None) or
+                  self._prefetched_before.pop(key, None))
+        if result is not None:
+            return result.get()
+        return self._loadBefore(oid, tid)
+
+    def loadSerial(self, oid, serial):
+        return decompress(self.base.loadSerial(oid, serial))
+
+    def prefetch(self, oids, tid):
+        """Load and decompress the records of `oids` in the background.
+
+        Only the records of the last two calls are kept.
+        """
+        self._prefetched_before = self._prefetched
+        self._prefetched = {
+            (oid, tid): self._pool.apply_async(self._loadBefore, (oid, tid))
+            for oid in oids}
+
+    def record_iternext(self, next=None):
+        oid, tid, data, next = self.base.record_iternext(next)
+        return oid, tid, decompress(data), next
+
+    def store(self, oid, serial, data, version, transaction):
+        return self.base.store(
+            oid, serial, compress(data), version, transaction)
+
+    def restore(self, oid, serial, data, version, prev_txn, transaction):
+        return self.base.restore(
+            oid, serial, compress(data), version, prev_txn, transaction)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+        self.base.close()
+
+
+class RepicklingStorage(StorageWrapper):
+    """Storage wrapper optimizing the pickles of the stored records.
+
+    The unused memo entries are removed from the pickles, see
+    `.records.optimize_record`. `stats` maps the dotted name of a class to a
+    tuple `(records, old bytes, new bytes, old load seconds, new load
+    seconds)` comparing the stored records to the ones they replace.
+    """
+
+    def __init__(self, base):
+        super(RepicklingStorage, self).__init__(base)
+        self.stats = {}
+
+    def _count(self, old_data, data):
+        classname = get_record_classname(data)
+        records, old_bytes, new_bytes, old_time, new_time = self.stats.get(
+            classname, (0, 0, 0, 0.0, 0.0))
+        self.stats[classname] = (
+            records + 1, old_bytes + len(old_data), new_bytes + len(data),
+            old_time + time_load(old_data), new_time + time_load(data))
+
+    def store(self, oid, serial, data, version, transaction):
+        data = optimize_record(data)
+        try:
+            old_data = ZODB.utils.load_current(self.base, oid)[0]
+        except ZODB.POSException.POSKeyError:
+            pass  # A new object does not replace a record.
+        else:
+            self._count(old_data, data)
+        return self.base.store(oid, serial, data, version, transaction)
@@ -15,3 +15,13 @@ class Example(persistent.Persistent):
     def __init__(self, **kw):
         for key, value in kw.items():
             setattr(self, key, value)
+
+
+class SlotsExample(persistent.Persistent):
+    """Object without `__dict__` storing its attributes in slots."""
+
+    __slots__ = ('text', 'title')
+
+    def __init__(self, **kw):
+        for key, value in kw.items():
+            setattr(self, key, value)
@@ -1,12 +1,21 @@
 # encoding: utf-8
-from ..analyze import analyze, analyze_storage
-from ..testing import Example
+from ..analyze import analyze, analyze_storage, analyze_encodings
+from ..analyze import choose_encodings, expand_paths, analyze_file
+from ..analyze import analyze_fleet, parse_shard, select_shard
+from ..analyze import parse_encodings
+from ..testing import Example, SlotsExample
+from ZODB.DB import DB
 import BTrees.IIBTree
 import BTrees.OOBTree
+import ZODB.FileStorage
+import ZODB.utils
 import Products.PythonScripts.PythonScript
+import argparse
+import json
 import mock
 import persistent.list
 import persistent.mapping
+import pytest
 import transaction
 import zodb.py3migrate.analyze
 import zodbpickle
@@ -56,6 +65,19 @@ def test_analyze__analyze_storage__2(zodb_storage, zodb_root):
     } == errors
 
 
+def test_analyze__analyze_storage__3(zodb_storage, zodb_root):
+    """It analyzes the slots and the state of objects without a dict."""
+    zodb_root['obj'] = SlotsExample(text=b'tëxt')
+    zodb_root['tree'] = BTrees.IIBTree.IIBTree({1: 2})
+    transaction.commit()
+
+    result, errors = analyze_storage(zodb_storage)
+    assert {
+        'zodb.py3migrate.testing.SlotsExample.text is string': 1
+    } == result
+    assert {} == errors
+
+
 def test_analyze__analyze_storage__4(zodb_storage, zodb_root):
     """It counts iterable fields that contain binary strings."""
     zodb_root['obj'] = Example(data=['bïnäry', 'anöther_binäry'])
@@ -173,16 +195,19 @@ def test_analyze__analyze_storage__9(zodb_storage, zodb_root, caplog):
 
 
 def test_analyze__analyze_storage__10(zodb_storage, zodb_root):
-    """It includes first bytes of the string in result if verbose is true."""
+    """It collects the first bytes of sample values if requested."""
     zodb_root['obj'] = Example(
         data=[0, b'löng string containing an umlaut.'])
     transaction.commit()
-    result, errors = analyze_storage(
-        zodb_storage, verbose=True)
+    samples = {}
+    result, errors = analyze_storage(zodb_storage, samples=samples)
     assert {
-        "zodb.py3migrate.testing.Example.data "
-        "is iterable: [0, 'l\\xc3\\xb6ng string contai": 1,
+        "zodb.py3migrate.testing.Example.data is iterable": 1,
     } == result
+    assert {
+        "zodb.py3migrate.testing.Example.data is iterable": [
+            "[0, 'l\\xc3\\xb6ng string contai"],
+    } == samples
     assert {} == errors
 
 
@@ -216,3 +241,579 @@ def test_analyze__analyze__1(zodb_storage, capsys):
     analyze(zodb_storage)
     out, err = capsys.readouterr()
     assert 'Found 0 binary fields: (number of occurrences)\n' == out
+
+
+def test_analyze__analyze__2(zodb_storage, zodb_root, capsys):
+    """It analyzes the records flagged in the index if requested.
+
+    An index which is older than the storage is rebuilt.
+    """
+    from ..index import build_index, get_index_path
+    zodb_root['obj'] = Example(binary=b'bär')
+    transaction.commit()
+    build_index(zodb_storage).save(get_index_path(zodb_storage.getName()))
+    zodb_root['obj2'] = Example(binary=b'bär')
+    transaction.commit()
+    analyze(zodb_storage, use_index=True)
+    out, err = capsys.readouterr()
+    assert '''\
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.binary is string (2)
+''' == out
+
+
+def test_analyze__analyze__3(zodb_storage, zodb_root, capsys):
+    """It analyzes only objects reachable from the root if requested."""
+    zodb_root['obj'] = Example(binary=b'bär')
+    zodb_root['garbage'] = Example(binary=b'bär')
+    transaction.commit()
+    del zodb_root['garbage']
+    transaction.commit()
+    analyze(zodb_storage, reachable_only=True)
+    out, err = capsys.readouterr()
+    assert '''\
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.binary is string (1)
+''' == out
+
+
+def test_analyze__main__2(zodb_storage, zodb_root, tmpdir, capsys):
+    """It tests binary strings against encodings and writes a config file."""
+    from ..convert import read_mapping
+    zodb_root['0'] = Example(title=u'bïnäry'.encode('utf-8'),
+                             text=u'bïnäry'.encode('latin-1'))
+    zodb_root['1'] = Example(title=u'bär'.encode('utf-8'),
+                             text=u'€'.encode('cp1252'),
+                             data=[b'bïnäry'])
+    transaction.commit()
+    zodb_storage.close()
+    config = str(tmpdir.join('convert.ini'))
+
+    zodb.py3migrate.analyze.main([
+        zodb_storage.getName(), '--encodings=utf-8,cp1252',
+        '--write-config', config])
+    out, err = capsys.readouterr()
+    assert '''\
+Tested 2 binary fields: (number of values, clean decodes)
+zodb.py3migrate.testing.Example.text (2): utf-8 0.0%, cp1252 100.0%
+zodb.py3migrate.testing.Example.title (2): utf-8 100.0%, cp1252 100.0%
+''' == out
+    assert {
+        'zodb.py3migrate.testing.Example.text': 'cp1252',
+        'zodb.py3migrate.testing.Example.title': 'utf-8',
+    } == read_mapping(config)
+
+
+def test_analyze__analyze_encodings__1(zodb_storage, zodb_root):
+    """It counts the clean decodes of each field in batches."""
+    zodb_root['0'] = Example(text=u'bïnäry'.encode('latin-1'))
+    zodb_root['1'] = Example(text=u'bïnäry'.encode('utf-8'))
+    zodb_root['2'] = Example(text=u'bïnäry'.encode('utf-8'))
+    transaction.commit()
+    matrix, totals, errors = analyze_encodings(
+        zodb_storage, ['utf-8', 'latin-1'], batch_size=1)
+    assert {'zodb.py3migrate.testing.Example.text': [2, 3]} == matrix
+    assert {'zodb.py3migrate.testing.Example.text': 3} == totals
+    assert {} == errors
+
+
+def test_analyze__choose_encodings__1():
+    """It chooses the first encoding which decodes all values of a field."""
+    assert {
+        'foo.Bar.a': 'latin-1',
+        'foo.Bar.b': 'utf-8',
+        'foo.Bar.c': 'zodbpickle.binary',
+    } == choose_encodings(
+        {'foo.Bar.a': [1, 2], 'foo.Bar.b': [2, 2], 'foo.Bar.c': [0, 1]},
+        {'foo.Bar.a': 2, 'foo.Bar.b': 2, 'foo.Bar.c': 2},
+        ['utf-8', 'latin-1'])
+
+
+def test_analyze__analyze__4(zodb_storage, zodb_root, capsys):
+    """It tests against default encodings if only a config path is given."""
+    zodb_root['obj'] = Example(text=u'bïnäry'.encode('latin-1'))
+    transaction.commit()
+    with mock.patch('zodb.py3migrate.analyze.write_mapping') as write_mapping:
+        analyze(zodb_storage, config_path='convert.ini')
+        write_mapping.assert_called_once_with(
+            'convert.ini', {'zodb.py3migrate.testing.Example.text': 'cp1252'})
+    out, err = capsys.readouterr()
+    assert '''\
+Tested 1 binary fields: (number of values, clean decodes)
+zodb.py3migrate.testing.Example.text (1): \
+utf-8 0.0%, cp1252 100.0%, latin-1 100.0%
+''' == out
+
+
+def test_analyze__analyze__5(zodb_storage, zodb_root, capsys):
+    """It does not write a config file if no path is given."""
+    zodb_root['obj'] = Example(text=u'bïnäry'.encode('latin-1'))
+    transaction.commit()
+    with mock.patch('zodb.py3migrate.analyze.write_mapping') as write_mapping:
+        analyze(zodb_storage, encodings=['latin-1'])
+        write_mapping.assert_not_called()
+    out, err = capsys.readouterr()
+    assert out.endswith('Example.text (1): latin-1 100.0%\n')
+
+
+def create_storage(path, **kw):
+    """Create a FileStorage at `path` containing an `Example` object."""
+    transaction.abort()
+    storage = ZODB.FileStorage.FileStorage(path)
+    db = DB(storage)
+    connection = db.open()
+    connection.root()['obj'] = Example(**kw)
+    transaction.commit()
+    connection.close()
+    db.close()
+
+
+def test_analyze__expand_paths__1(tmpdir):
+    """It expands glob patterns and sorts the files largest first."""
+    tmpdir.join('a.fs').write('12')
+    tmpdir.join('b.fs').write('123')
+    tmpdir.join('c.txt').write('1')
+    assert [str(tmpdir.join('b.fs')), str(tmpdir.join('a.fs')),
+            str(tmpdir.join('c.txt'))] == expand_paths([
+                str(tmpdir.join('*.fs')), str(tmpdir.join('c.txt')),
+                str(tmpdir.join('a.fs'))])
+
+
+def test_analyze__analyze_file__1(tmpdir):
+    """It analyzes a storage opened read-only."""
+    path = str(tmpdir.join('Data.fs'))
+    create_storage(path, text=b'tëxt')
+    result = analyze_file((path, dict(reachable_only=True, verbose=True)))
+    assert (path, {
+        'zodb.py3migrate.testing.Example.text is string': 1
+    }, {}, {
+        'zodb.py3migrate.testing.Example.text is string': [
+            "'t\\xc3\\xabxt'"],
+    }) == result[:4]
+    assert {} == result[4].counts
+
+
+def test_analyze__analyze_file__2(tmpdir):
+    """It analyzes a compressed storage."""
+    path = str(tmpdir.join('Data.fs'))
+    create_storage(path, text=b'tëxt')
+    with mock.patch('zodb.py3migrate.analyze.ZlibStorage',
+                    side_effect=lambda x: x) as zlib_storage:
+        analyze_file((path, dict(zlib=True)))
+    assert zlib_storage.called
+
+
+def test_analyze__analyze_file__3(tmpdir, caplog):
+    """It returns the exception which aborted the analysis."""
+    path = str(tmpdir.join('Data.fs'))
+    create_storage(path, text=b'tëxt')
+    with mock.patch('zodb.py3migrate.analyze.select_oids',
+                    side_effect=RuntimeError('boom')):
+        result = analyze_file((path, {}))
+    assert (path, {}, {}, {}) == result[:4]
+    assert 'RuntimeError: boom' == result[5]
+    assert 'Could not analyze {}.'.format(
+        path) == caplog.records[-1].getMessage()
+    # A storage which cannot be opened:
+    failure = analyze_file((str(tmpdir.join('missing.fs')), {}))[5]
+    assert failure.startswith('IOError: [Errno 2] No such file')
+
+
+def test_analyze__analyze_fleet__1(tmpdir, capsys):
+    """It prints only the occurrences if not verbose."""
+    path = str(tmpdir.join('Data.fs'))
+    create_storage(path, text=b'tëxt')
+    analyze_fleet([path], jobs=1)
+    out, err = capsys.readouterr()
+    assert """\
+# {}
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+
+# All 1 storages
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+""".format(path) == out
+
+
+def test_analyze__main__3(tmpdir, capsys):
+    """It analyzes many storages using worker processes."""
+    create_storage(str(tmpdir.join('a.fs')), text=b'tëxt')
+    create_storage(str(tmpdir.join('b.fs')), text=b'tëxt', title=b'tïtle')
+    zodb.py3migrate.analyze.main([
+        str(tmpdir.join('*.fs')), str(tmpdir.join('a.fs')), '--jobs=2', '-v'])
+    out, err = capsys.readouterr()
+    assert """\
+# {0}/a.fs
+Found 0 classes whose objects do not have __dict__: (number of occurrences)
+
+# ########################################################### #
+
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+
+Sample values:
+zodb.py3migrate.testing.Example.text is string: 't\\xc3\\xabxt'
+
+# {0}/b.fs
+Found 0 classes whose objects do not have __dict__: (number of occurrences)
+
+# ########################################################### #
+
+Found 2 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+zodb.py3migrate.testing.Example.title is string (1)
+
+Sample values:
+zodb.py3migrate.testing.Example.text is string: 't\\xc3\\xabxt'
+zodb.py3migrate.testing.Example.title is string: 't\\xc3\\xaftle'
+
+# All 2 storages
+Found 0 classes whose objects do not have __dict__: (number of occurrences)
+
+# ########################################################### #
+
+Found 2 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (2)
+zodb.py3migrate.testing.Example.title is string (1)
+""".format(tmpdir) == out
+
+
+def test_analyze__main__4(tmpdir, capsys):
+    """It refuses single storage options when analyzing many storages."""
+    with pytest.raises(SystemExit):
+        zodb.py3migrate.analyze.main(['a.fs', 'b.fs', '--limit=1'])
+    out, err = capsys.readouterr()
+    assert 'can only be used with a single storage' in err
+    with pytest.raises(SystemExit):
+        zodb.py3migrate.analyze.main(['a.fs', 'b.fs', '--index-jobs=2'])
+    out, err = capsys.readouterr()
+    assert '--blob-dir and --index-jobs can only be used' in err
+
+
+def test_analyze__analyze_storage__13(zodb_storage, zodb_root):
+    """It keeps at most `sample_size` sample values for each field."""
+    for i in range(10):
+        zodb_root[i] = Example(text='tëxt{}'.format(i))
+    transaction.commit()
+    samples = {}
+    result, errors = analyze_storage(
+        zodb_storage, samples=samples, sample_size=3)
+    assert {'zodb.py3migrate.testing.Example.text is string': 10} == result
+    values = samples['zodb.py3migrate.testing.Example.text is string']
+    assert 3 == len(values)
+    assert set(values) <= set(
+        repr('tëxt{}'.format(i)) for i in range(10))
+
+
+def test_analyze__analyze_storage__14(zodb_storage, zodb_root):
+    """It does not analyze the buckets of a `BTree` a second time."""
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'key{:03}'.format(i): b'bïnäry' for i in range(200)})
+    zodb_root['set'] = BTrees.OOBTree.OOTreeSet(
+        b'këy{:03}'.format(i) for i in range(200))
+    transaction.commit()
+    assert zodb_root['tree']._firstbucket._next is not None
+    result, errors = analyze_storage(zodb_storage)
+    assert 400 == len(result)
+    assert {1} == set(result.values())
+    assert not [x for x in result if not x.startswith(
+        ('BTrees.OOBTree.OOBTree[', 'BTrees.OOBTree.OOTreeSet['))]
+    assert {} == errors
+
+
+def test_analyze__analyze_storage__15(zodb_storage, zodb_root):
+    """It analyzes the buckets of a `BTree` if the tree is not analyzed.
+
+    The items are reported as the ones of the tree.
+    """
+    from ..scanners import iter_bucket_oids
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'key{:03}'.format(i): b'bïnäry' for i in range(200)})
+    transaction.commit()
+    tree = zodb_root['tree']
+    bucket_oids = list(iter_bucket_oids(tree))
+    result, errors = analyze_storage(zodb_storage, oids=bucket_oids)
+    assert 200 == len(result)
+    assert "BTrees.OOBTree.OOBTree['key000'] is string" in result
+    result, errors = analyze_storage(
+        zodb_storage, oids=bucket_oids + [tree._p_oid])
+    assert 200 == len(result)
+    assert {1} == set(result.values())
+
+
+def test_analyze__analyze__7(zodb_storage, zodb_root, capsys):
+    """It analyzes the flagged records of a tree with many buckets."""
+    from ..index import build_index, get_index_path
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'key{:03}'.format(i): b'bïnäry' for i in range(200)})
+    transaction.commit()
+    assert zodb_root['tree']._firstbucket._next is not None
+    build_index(zodb_storage).save(get_index_path(zodb_storage.getName()))
+    analyze(zodb_storage, use_index=True)
+    out, err = capsys.readouterr()
+    assert out.startswith('Found 200 binary fields:')
+
+
+def test_analyze__analyze__6(zodb_storage, zodb_root, capsys):
+    """It prints sample values in verbose mode."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    analyze(zodb_storage, verbose=True)
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+
+Sample values:
+zodb.py3migrate.testing.Example.text is string: 't\\xc3\\xabxt'
+""")
+
+
+def test_analyze__main__5(zodb_storage, zodb_root, capsys):
+    """It limits the rate of objects read and lowers the priority."""
+    zodb_root['obj'] = Example(binary=b'bär1')
+    transaction.commit()
+    zodb_storage.close()
+    with mock.patch('zodb.py3migrate.pacing.Pacer.pace') as pace, \
+            mock.patch('os.nice') as nice:
+        zodb.py3migrate.analyze.main([
+            zodb_storage.getName(), '--max-read-rate=10',
+            '--max-objects-per-sec=100', '--nice'])
+    assert 2 == pace.call_count
+    nice.assert_called_with(10)
+    out, err = capsys.readouterr()
+    assert 'zodb.py3migrate.testing.Example.binary is string (1)' in out
+
+
+def test_analyze__analyze_fleet__2(tmpdir, capsys):
+    """It limits the rate of the worker processes."""
+    path = str(tmpdir.join('Data.fs'))
+    create_storage(path, text=b'tëxt')
+    analyze_fleet([path], jobs=1, max_objects_per_sec=1000)
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+# All 1 storages
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+""")
+
+
+def test_analyze__analyze_fleet__4(tmpdir, capsys):
+    """It continues with the other storages if one cannot be analyzed."""
+    path = str(tmpdir.join('Data.fs'))
+    create_storage(path, text=b'tëxt')
+    missing = str(tmpdir.join('missing.fs'))
+    analyze_fleet([path, missing], jobs=1)
+    out, err = capsys.readouterr()
+    assert out.startswith("""\
+# {0}
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+
+# {1}
+Could not analyze the storage: """.format(path, missing))
+    assert out.endswith("""\
+# All 1 storages
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text is string (1)
+
+Could not analyze 1 storages:
+{}
+""".format(missing))
+
+
+def test_analyze__main__6(zodb_storage, zodb_root, tmpdir, capsys):
+    """It writes a memory profile if requested."""
+    zodb_root['obj'] = Example(binary=b'bär1')
+    transaction.commit()
+    zodb_storage.close()
+    path = str(tmpdir.join('profile.txt'))
+    zodb.py3migrate.analyze.main(
+        [zodb_storage.getName(), '--memory-profile', path])
+    out, err = capsys.readouterr()
+    assert 'zodb.py3migrate.testing.Example.binary is string (1)' in out
+    with open(path) as file:
+        report = file.read()
+    assert ', errors 0, result 1)\n' in report
+
+
+def test_analyze__parse_shard__1():
+    """It parses a shard given as `i/N`."""
+    assert (2, 4) == parse_shard('2/4')
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        parse_shard('2')
+    assert "'2' is not of the form i/N." == str(err.value)
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        parse_shard('0/4')
+    assert "The shard number of '0/4' is not between 1 and N." == str(
+        err.value)
+
+
+def test_analyze__parse_encodings__1():
+    """It parses a comma separated list of known encodings."""
+    assert ['utf-8', 'latin-1'] == parse_encodings('utf-8,latin-1')
+    with pytest.raises(argparse.ArgumentTypeError) as err:
+        parse_encodings('utf-8,utf8x')
+    assert "'utf8x' is not a known encoding." == str(err.value)
+
+
+def test_analyze__select_shard__1(zodb_storage, zodb_root):
+    """It splits the OIDs of the storage into ranges of equal size."""
+    for i in range(4):
+        zodb_root[i] = Example()
+    transaction.commit()
+    # OIDs without records, e. g. of aborted transactions:
+    zodb_storage.new_oid()
+    zodb_storage.new_oid()
+    shards = [[ZODB.utils.u64(x)
+               for x in select_shard(zodb_storage, None, (i, 3))]
+              for i in range(1, 4)]
+    assert [[0, 1, 2], [3, 4], []] == shards
+    oids = [ZODB.utils.p64(x) for x in (4, 2, 0)]
+    assert [ZODB.utils.p64(x) for x in (2, 0)] == list(
+        select_shard(zodb_storage, oids, (1, 3)))
+
+
+def test_analyze__main__7(zodb_storage, zodb_root, tmpdir, capsys):
+    """It analyzes a shard and writes the result to a file."""
+    zodb_root['obj'] = Example(binary=b'bär1')
+    zodb_root['obj2'] = Example(binary=b'bär2')
+    transaction.commit()
+    last_transaction = zodb_storage.lastTransaction()
+    zodb_storage.close()
+    path = str(tmpdir.join('result.json'))
+    zodb.py3migrate.analyze.main([
+        zodb_storage.getName(), '--shard=1/2', '--output', path, '-v'])
+    out, err = capsys.readouterr()
+    assert 'zodb.py3migrate.testing.Example.binary is string (1)' in out
+    with open(path) as file:
+        data = json.load(file)
+    assert {
+        'format': 'zodb.py3migrate.analyze 1',
+        'storage': zodb_storage.getName(),
+        'last_transaction': ZODB.utils.tid_repr(last_transaction),
+        'max_oid': '0x02',
+        'shard': [1, 2],
+        'result': {'zodb.py3migrate.testing.Example.binary is string': 1},
+        'errors': {},
+        'samples': {'zodb.py3migrate.testing.Example.binary is string': [
+            data['samples'].values()[0][0]]},
+        'error_summary': [],
+    } == data
+
+
+def test_analyze__main__8(capsys):
+    """It refuses to write the result of testing encodings."""
+    with pytest.raises(SystemExit):
+        zodb.py3migrate.analyze.main(
+            ['Data.fs', '--output=result.json', '--encodings=utf-8'])
+    out, err = capsys.readouterr()
+    assert '--output cannot be used together with --encodings' in err
+
+
+def test_analyze__main__9(zodb_storage, zodb_root, capsys):
+    """It reads the records in the order they are stored if requested."""
+    zodb_root['obj'] = Example(binary=b'bär1')
+    transaction.commit()
+    zodb_root['obj2'] = Example(binary=b'bär2')
+    transaction.commit()
+    zodb_storage.close()
+    analyzed = []
+
+    def analyze_storage_(storage, oids, **kw):
+        analyzed.extend(oids)
+        return analyze_storage(storage, oids=analyzed, **kw)
+
+    with mock.patch('zodb.py3migrate.analyze.analyze_storage',
+                    side_effect=analyze_storage_):
+        zodb.py3migrate.analyze.main(
+            [zodb_storage.getName(), '--order=offset'])
+    out, err = capsys.readouterr()
+    assert '''\
+Found 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.binary is string (2)
+''' == out
+    assert [b'\0' * 7 + b'\1', b'\0' * 8, b'\0' * 7 + b'\2'] == analyzed
+
+
+def test_analyze__main__10(capsys):
+    """It refuses to start at an OID when reading in file order."""
+    with pytest.raises(SystemExit):
+        zodb.py3migrate.analyze.main(
+            ['Data.fs', '--start=0x01', '--order=offset'])
+    out, err = capsys.readouterr()
+    assert '--start cannot be used together with --order offset.' in err
+
+
+def test_analyze__main__11(zodb_storage, zodb_root, capsys, caplog):
+    """It summarizes the values which cannot be scanned."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    zodb_root['list'] = persistent.list.PersistentList([b'tëxt'])
+    transaction.commit()
+    zodb_storage.close()
+    with mock.patch('zodb.py3migrate.migrate.find_binary',
+                    side_effect=RuntimeError):
+        zodb.py3migrate.analyze.main([zodb_storage.getName()])
+    out, err = capsys.readouterr()
+    assert '''\
+Found 0 binary fields: (number of occurrences)
+Could not scan the values of 3 fields: (exception, number of occurrences, \
+sample OIDs)
+persistent.list.PersistentList[*] RuntimeError (1, 0x01)
+''' in out
+    assert ('\npersistent.mapping.PersistentMapping[*] RuntimeError (2, 0x00)'
+            '\n' in out)
+    assert ('\nzodb.py3migrate.testing.Example.text RuntimeError (1, 0x02)\n'
+            in out)
+    assert not [x for x in caplog.records if x.exc_text]
+    with mock.patch('zodb.py3migrate.migrate.find_binary',
+                    side_effect=RuntimeError):
+        zodb.py3migrate.analyze.main(
+            [zodb_storage.getName(), '--trace-errors'])
+    assert 4 == len([x for x in caplog.records if x.exc_text])
+
+
+def test_analyze__main__12(zodb_storage, zodb_root, tmpdir, capsys):
+    """It writes the summary of the values which cannot be scanned."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    zodb_storage.close()
+    path = str(tmpdir.join('result.json'))
+    with mock.patch('zodb.py3migrate.migrate.find_binary',
+                    side_effect=RuntimeError):
+        zodb.py3migrate.analyze.main(
+            [zodb_storage.getName(), '--output', path])
+    with open(path) as file:
+        error_summary = json.load(file)['error_summary']
+    assert [
+        ('persistent.mapping.PersistentMapping[*]', 'RuntimeError', 1,
+         ['0x00']),
+        ('zodb.py3migrate.testing.Example.text', 'RuntimeError', 1,
+         ['0x01']),
+    ] == [(x['name'], x['exception'], x['count'], x['oids'])
+          for x in error_summary]
+    assert 'RuntimeError' in error_summary[0]['traceback']
+
+
+def test_analyze__analyze_fleet__3(tmpdir, capsys):
+    """It merges the summaries of the values which cannot be scanned."""
+    paths = [str(tmpdir.join('a.fs')), str(tmpdir.join('b.fs'))]
+    for path in paths:
+        create_storage(path, text=b'tëxt')
+    with mock.patch('multiprocessing.Pool') as pool, \
+            mock.patch('zodb.py3migrate.migrate.find_binary',
+                       side_effect=RuntimeError):
+        # Analyze the storages in this process to be able to mock:
+        pool().imap_unordered.side_effect = lambda func, args: [
+            func(x) for x in args]
+        analyze_fleet(paths)
+    out, err = capsys.readouterr()
+    merged = out[out.index('# All 2 storages'):].splitlines()
+    assert [
+        'Found 0 binary fields: (number of occurrences)',
+        'Could not scan the values of 2 fields: (exception, number of '
+        'occurrences, sample OIDs)',
+        'persistent.mapping.PersistentMapping[*] RuntimeError (2)',
+    ] == merged[1:4]
+    assert 'zodb.py3migrate.testing.Example.text RuntimeError (2)' in merged
@@ -0,0 +1,96 @@
+from ..blobs import BlobRecordingStorage, list_blobs, check_blobs
+from ZODB.DB import DB
+import ZODB.FileStorage
+import ZODB.blob
+import ZODB.utils
+import os
+import pytest
+import transaction
+import zodb.py3migrate.analyze
+
+
+OK_OID = ZODB.utils.p64(1)
+MISSING_OID = ZODB.utils.p64(2)
+ORPHANED_OID = ZODB.utils.p64(42)
+
+
+@pytest.yield_fixture(scope='function')
+def blob_storage(tmpdir):
+    """FileStorage containing two blobs, a missing and an orphaned one."""
+    path = str(tmpdir.join('Data.fs'))
+    blob_dir = str(tmpdir.join('blobs'))
+    transaction.abort()
+    storage = ZODB.FileStorage.FileStorage(path, blob_dir=blob_dir)
+    db = DB(storage)
+    connection = db.open()
+    root = connection.root()
+    for name in ['ok', 'missing']:
+        root[name] = ZODB.blob.Blob(b'data')
+        transaction.commit()
+    connection.close()
+    os.remove(storage.loadBlob(
+        MISSING_OID, ZODB.utils.load_current(storage, MISSING_OID)[1]))
+    orphan = storage.fshelper.getBlobFilename(
+        ORPHANED_OID, storage.lastTransaction())
+    os.makedirs(os.path.dirname(orphan))
+    with open(orphan, 'wb') as file:
+        file.write(b'orphan')
+    # Files below the blob directory which are no blobs are ignored:
+    with open(os.path.join(blob_dir, 'unknown.blob'), 'wb') as file:
+        file.write(b'unknown')
+    yield storage
+    db.close()
+
+
+def get_tid(storage, oid):
+    """Return the TID of the current record of `oid`."""
+    return ZODB.utils.load_current(storage, oid)[1]
+
+
+def test_blobs__list_blobs__1(blob_storage):
+    """It lists the `oid + tid` of all blob files."""
+    assert {OK_OID + get_tid(blob_storage, OK_OID),
+            ORPHANED_OID + blob_storage.lastTransaction()} == list_blobs(
+                blob_storage.fshelper, threads=2)
+
+
+def test_blobs__check_blobs__1(blob_storage):
+    """It reports missing blobs and blobs of objects not in the storage."""
+    storage = BlobRecordingStorage(blob_storage)
+    db = DB(storage)
+    connection = db.open()
+    root = connection.root()
+    for name in ['ok', 'missing']:
+        # Loading does not look at the blob file:
+        root[name]._p_activate()
+    connection.close()
+    ok = OK_OID, get_tid(blob_storage, OK_OID)
+    missing = MISSING_OID, get_tid(blob_storage, MISSING_OID)
+    assert {''.join(ok), ''.join(missing)} == storage.blobs
+    assert ([missing], [(ORPHANED_OID, blob_storage.lastTransaction())]) == \
+        check_blobs(storage)
+
+
+def test_blobs__main__1(blob_storage, capsys):
+    """It reports the blobs after the analysis."""
+    blob_storage.close()
+    zodb.py3migrate.analyze.main([
+        blob_storage.getName(), '--blob-dir', blob_storage.blob_dir, '-v'])
+    out, err = capsys.readouterr()
+    assert out.endswith('''\
+Checked 2 blob records against the blob directory.
+Found 1 missing blobs: (OID, TID)
+0x02 {}
+Found 1 orphaned blobs: (OID, TID)
+0x2a {}
+'''.format(ZODB.utils.tid_repr(blob_storage.lastTransaction()),
+           ZODB.utils.tid_repr(blob_storage.lastTransaction())))
+    zodb.py3migrate.analyze.main([
+        blob_storage.getName(), '--blob-dir', blob_storage.blob_dir,
+        '--encodings=utf-8'])
+    out, err = capsys.readouterr()
+    assert out.endswith('''\
+Checked 2 blob records against the blob directory.
+Found 1 missing blobs.
+Found 1 orphaned blobs.
+''')
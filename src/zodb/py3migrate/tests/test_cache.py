@@ -0,0 +1,62 @@
+from ..cache import value_cache, print_cache_stats
+import pytest
+
+
+def test_cache__value_cache__1():
+    """It calls the function only once for equal arguments."""
+    calls = []
+
+    @value_cache(maxsize=2)
+    def upper(value):
+        calls.append(value)
+        return value.upper()
+
+    assert 'A' == upper('a')
+    assert 'A' == upper('a')
+    assert ['a'] == calls
+    assert (1, 1) == (upper.hits, upper.misses)
+    assert 'upper' == upper.__name__
+
+
+def test_cache__value_cache__2():
+    """It is cleared if full."""
+    cache = value_cache(maxsize=2, max_length=10)(lambda x, y: x + y)
+    cache('a', 'b')
+    cache('c', 'd')
+    cache('a', 'b')
+    cache('e', 'f')  # clears the cache
+    assert [('e', 'f')] == list(cache._results)
+    cache.clear()
+    assert [] == list(cache._results)
+    assert (0, 0) == (cache.hits, cache.misses)
+
+
+def test_cache__value_cache__3():
+    """It does not cache results for long values."""
+    cache = value_cache(maxsize=2, max_length=3)(len)
+    assert 4 == cache('abcd')
+    assert 3 == cache('abc')
+    assert [('abc',)] == list(cache._results)
+    assert (0, 1) == (cache.hits, cache.misses)
+
+
+def test_cache__value_cache__4():
+    """It does not cache exceptions."""
+    cache = value_cache(maxsize=2, max_length=10)(
+        lambda x: x.decode('ascii'))
+    with pytest.raises(UnicodeDecodeError):
+        cache(b'\xff')
+    assert [] == list(cache._results)
+
+
+def test_cache__print_cache_stats__1(capsys):
+    """It prints the hit rate of each cache."""
+    cache = value_cache(maxsize=2, max_length=10)(len)
+    for value in ('a', 'a', 'a', 'b'):
+        cache(value)
+    print_cache_stats(cache)
+    out, err = capsys.readouterr()
+    assert '''
+Cache hit rates: (hits, lookups)
+len 50.0% (2, 4)
+''' == out
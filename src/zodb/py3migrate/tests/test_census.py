@@ -0,0 +1,69 @@
+# encoding: utf-8
+from ..census import get_prefix_classname, read_classname, count_classes
+from ..storage import ZlibStorage, compress
+from ..testing import Example
+from ZODB.DB import DB
+import ZODB.FileStorage
+import persistent.mapping
+import transaction
+import zodb.py3migrate.census
+
+
+def test_census__get_prefix_classname__1():
+    """It returns the class name if the prefix contains it."""
+    assert 'foo.Bar' == get_prefix_classname(b'\x80\x03cfoo\nBar\nq\x01.')
+    assert get_prefix_classname(b'\x80\x03cfoo\nBa') is None
+    assert get_prefix_classname(b'\x80\x03(') is None
+
+
+def test_census__read_classname__1():
+    """It reads the whole record if the class reference is long."""
+    data = b'\x80\x03c' + b'a' * 300 + b'\nBar\nq\x01.\x80\x03}q\x02.'
+    record = b'xx' + data + b'yy'
+    assert 'a' * 300 + '.Bar' == read_classname(record, 2, len(data))
+    record = b'xx' + compress(data) + b'yy'
+    assert 'a' * 300 + '.Bar' == read_classname(
+        record, 2, len(record) - 4)
+
+
+def test_census__count_classes__1(zodb_storage, zodb_root, caplog):
+    """It counts the current records and their bytes per class."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    zodb_root['obj'].text = b'other'
+    transaction.commit()
+    db = zodb_root._p_jar.db()
+    # The undo writes a back pointer to the first record of `obj`:
+    db.undo(db.undoLog(0, 1)[0]['id'])
+    transaction.commit()
+    zodb_root['obj2'] = persistent.mapping.PersistentMapping()
+    transaction.commit()
+    # The undo of the creation of `obj2` writes a back pointer to nowhere:
+    db.undo(db.undoLog(0, 1)[0]['id'])
+    transaction.commit()
+    sizes = count_classes(zodb_storage, watermark=2)
+    assert ['persistent.mapping.PersistentMapping',
+            'zodb.py3migrate.testing.Example'] == sorted(sizes)
+    assert 1 == sizes['zodb.py3migrate.testing.Example'][0]
+    assert 1 == sizes['persistent.mapping.PersistentMapping'][0]
+    assert '2 of 3 records counted.' in [
+        x.getMessage() for x in caplog.records]
+
+
+def test_census__main__1(tmpdir, capsys):
+    """It prints the census of a compressed storage."""
+    path = str(tmpdir.join('Data.fs'))
+    transaction.abort()
+    storage = ZlibStorage(ZODB.FileStorage.FileStorage(path))
+    db = DB(storage)
+    connection = db.open()
+    connection.root()['obj'] = Example(text=b'tëxt' * 100)
+    transaction.commit()
+    connection.close()
+    db.close()
+    zodb.py3migrate.census.main([path, '--zlib'])
+    out, err = capsys.readouterr()
+    assert out.startswith('2 classes: (number of records, bytes)\n')
+    assert '\nzodb.py3migrate.testing.Example (1, ' in out
+    assert '\npersistent.mapping.PersistentMapping (1, ' in out
+    assert '\nTotal: 2 records, ' in out
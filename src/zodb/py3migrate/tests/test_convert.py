@@ -1,12 +1,23 @@
 # encoding: utf-8
-from ..convert import convert, convert_storage, read_mapping
-from ..testing import Example, sync_zodb_connection
+from ..convert import convert, convert_storage, read_mapping, write_mapping
+from ..convert import Quarantine, read_quarantine, catch_up, follow
+from ..convert import decode, open_overlay, promote, repickle_storage
+from ..convert import read_renames, rename_storage
+from ..records import get_record_classname
+from ..follow import get_state_path, read_state, write_state
+from ..testing import Example, SlotsExample, sync_zodb_connection
+from ZODB.DB import DB
 import BTrees.IIBTree
 import BTrees.OOBTree
+import ZODB.FileStorage
 import ZODB.POSException
+import ZODB.utils
+import mock
 import persistent
 import persistent.list
 import persistent.mapping
+import pytest
+import shutil
 import transaction
 import zodb.py3migrate.convert
 import zodbpickle
@@ -61,6 +72,9 @@ foo.bar.Baz.title
 [latin-1]
 foo.bar.Baz.legacy
 BTrees.OOBTree.OOBTree['7b6d22fa-594e']
+
+[rename]
+foo.bar.Old = foo.bar.New
 """)
     mapping = read_mapping(str(file))
     assert {
@@ -202,3 +216,906 @@ def test_convert__convert_storage_7(zodb_storage, zodb_root):
     assert {} == errors
     sync_zodb_connection(zodb_root)
     assert [u'unicöde', u'bïnäry'] == zodb_root['list']
+
+
+def test_convert__convert__2(zodb_storage, zodb_root, capsys, tmpdir):
+    """It converts the records flagged in the index if requested.
+
+    An index which is older than the storage is rebuilt, so records
+    committed after building it are converted, too.
+    """
+    from ..index import build_index, get_index_path
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    build_index(zodb_storage).save(get_index_path(zodb_storage.getName()))
+    zodb_root['obj2'] = Example(text=b'tëxt')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write('[utf-8]\nzodb.py3migrate.testing.Example.text\n')
+    convert(zodb_storage, str(file), use_index=True)
+    out, err = capsys.readouterr()
+    assert '''\
+Converted 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text (2)
+''' == out
+    sync_zodb_connection(zodb_root)
+    assert u'tëxt' == zodb_root['obj'].text
+    assert u'tëxt' == zodb_root['obj2'].text
+
+
+def test_convert__write_mapping__1(tmpdir):
+    """It writes a mapping to a config file readable by `read_mapping`."""
+    mapping = {
+        'foo.bar.Baz.image': 'zodbpickle.binary',
+        'foo.bar.Baz.text': 'utf-8',
+        'foo.bar.Baz.title': 'utf-8',
+        "BTrees.OOBTree.OOBTree['7b6d22fa-594e']": 'latin-1',
+    }
+    path = str(tmpdir.join('config.ini'))
+    write_mapping(path, mapping)
+    assert mapping == read_mapping(path)
+    assert '''\
+[latin-1]
+BTrees.OOBTree.OOBTree['7b6d22fa-594e']
+
+[utf-8]
+foo.bar.Baz.text
+foo.bar.Baz.title
+
+[zodbpickle.binary]
+foo.bar.Baz.image
+
+''' == tmpdir.join('config.ini').read()
+
+
+def test_convert__convert_storage__8(zodb_storage, zodb_root):
+    """It aborts on values which cannot be decoded by default."""
+    zodb_root['obj'] = Example(text=b'\xff')
+    transaction.commit()
+    mapping = {'zodb.py3migrate.testing.Example.text': 'utf-8'}
+    with pytest.raises(UnicodeDecodeError):
+        convert_storage(zodb_storage, mapping)
+
+
+def test_convert__convert_storage__9(zodb_storage, zodb_root, tmpdir):
+    """It records values which cannot be decoded in the quarantine."""
+    zodb_root['good'] = Example(text=u'bïnäry'.encode('utf-8'))
+    transaction.commit()
+    zodb_root['bad'] = Example(text=b'\xff')
+    transaction.commit()
+    mapping = {'zodb.py3migrate.testing.Example.text': 'utf-8'}
+    quarantine = Quarantine(str(tmpdir.join('quarantine')))
+    result, errors = convert_storage(
+        zodb_storage, mapping, quarantine=quarantine)
+    quarantine.close()
+    assert {'zodb.py3migrate.testing.Example.text': 1} == result
+    assert 1 == quarantine.count
+    assert '0x02\tzodb.py3migrate.testing.Example.text\tutf-8\n' == \
+        tmpdir.join('quarantine').read()
+    sync_zodb_connection(zodb_root)
+    assert u'bïnäry' == zodb_root['good'].text
+    assert b'\xff' == zodb_root['bad'].text
+    assert not isinstance(zodb_root['bad'].text, zodbpickle.binary)
+
+
+def test_convert__convert_storage__10(zodb_storage, zodb_root, tmpdir):
+    """It wraps quarantined values in `zodbpickle.binary` if requested."""
+    zodb_root['bad'] = Example(text=b'\xff')
+    transaction.commit()
+    mapping = {'zodb.py3migrate.testing.Example.text': 'utf-8'}
+    quarantine = Quarantine(str(tmpdir.join('quarantine')), binary=True)
+    result, errors = convert_storage(
+        zodb_storage, mapping, quarantine=quarantine)
+    quarantine.close()
+    assert {} == result
+    sync_zodb_connection(zodb_root)
+    assert isinstance(zodb_root['bad'].text, zodbpickle.binary)
+
+
+def test_convert__main__2(zodb_storage, zodb_root, tmpdir, capsys):
+    """It converts only quarantined objects in a follow-up run."""
+    zodb_root['0'] = Example(text=b'\xff')
+    transaction.commit()
+    zodb_root['1'] = Example(text=u'bïnäry'.encode('utf-8'))
+    transaction.commit()
+    zodb_storage.close()
+    quarantine = str(tmpdir.join('quarantine'))
+    file = tmpdir.join('config.ini')
+    file.write('[utf-8]\nzodb.py3migrate.testing.Example.text\n')
+    zodb.py3migrate.convert.main([
+        zodb_storage.getName(), '--config={}'.format(file),
+        '--quarantine', quarantine])
+    out, err = capsys.readouterr()
+    assert out.endswith('Quarantined 1 values to {}.\n'.format(quarantine))
+
+    file.write('[latin-1]\nzodb.py3migrate.testing.Example.text\n')
+    zodb.py3migrate.convert.main([
+        zodb_storage.getName(), '--config={}'.format(file),
+        '--from-quarantine', quarantine])
+    out, err = capsys.readouterr()
+    assert '''\
+Converted 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text (1)
+''' == out
+
+
+def test_convert__read_quarantine__1(tmpdir):
+    """It returns the sorted unique OIDs of a quarantine file."""
+    file = tmpdir.join('quarantine')
+    file.write('0x03\tfoo.Bar.baz\tutf-8\n'
+               '0x01\tfoo.Bar.baz\tutf-8\n'
+               '0x03\tfoo.Bar.qux\tutf-8\n\n')
+    assert [ZODB.utils.p64(1), ZODB.utils.p64(3)] == read_quarantine(
+        str(file))
+
+
+def test_convert__convert_storage__11(zodb_storage, zodb_root):
+    """It converts the binary keys of a BTree given by class in bulk."""
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree()
+    zodb_root['tree'][b'bïnäry'] = b'välue'
+    zodb_root['tree'][b'äscii'] = 1
+    zodb_root['tree'][b'ascii'] = 2
+    zodb_root['tree'][(b'tüple',)] = 3
+    transaction.commit()
+    mapping = {
+        "BTrees.OOBTree.OOBTree[*]": 'utf-8',
+        "BTrees.OOBTree.OOBTree['b\\xc3\\xafn\\xc3\\xa4ry']": 'utf-8',
+    }
+    result, errors = convert_storage(zodb_storage, mapping)
+    assert {
+        "BTrees.OOBTree.OOBTree[*]": 1,
+        "BTrees.OOBTree.OOBTree['b\\xc3\\xafn\\xc3\\xa4ry']": 2,
+    } == result
+    sync_zodb_connection(zodb_root)
+    tree = zodb_root['tree']
+    # Python 2 sorts objects of different types by their type name:
+    assert ['ascii', (b'tüple',), u'bïnäry', u'äscii'] == list(tree.keys())
+    assert isinstance(tree.keys()[2], unicode)
+    assert isinstance(tree.keys()[3], unicode)
+    assert u'välue' == tree[u'bïnäry']
+    assert 1 == tree[u'äscii']
+
+
+def test_convert__convert_storage__12(zodb_storage, zodb_root):
+    """It converts the binary keys of `TreeSet`s and `PersistentMapping`s."""
+    zodb_root['set'] = BTrees.OOBTree.OOTreeSet()
+    zodb_root['set'].insert(b'bïnäry')
+    zodb_root['map'] = persistent.mapping.PersistentMapping()
+    zodb_root['map'][b'kéy'] = 1
+    transaction.commit()
+    mapping = {
+        "BTrees.OOBTree.OOTreeSet[*]": 'utf-8',
+        "persistent.mapping.PersistentMapping[*]": 'zodbpickle.binary',
+    }
+    convert_storage(zodb_storage, mapping)
+    sync_zodb_connection(zodb_root)
+    assert [u'bïnäry'] == list(zodb_root['set'].keys())
+    key = list(zodb_root['map'].keys())[0]
+    assert isinstance(key, zodbpickle.binary)
+    assert 1 == zodb_root['map'][b'kéy']
+
+
+def test_convert__convert_storage__13(zodb_storage, zodb_root, tmpdir):
+    """It quarantines binary keys which cannot be decoded."""
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree()
+    zodb_root['tree'][b'\xff'] = 1
+    transaction.commit()
+    mapping = {"BTrees.OOBTree.OOBTree[*]": 'utf-8'}
+    quarantine = Quarantine(str(tmpdir.join('quarantine')), binary=True)
+    result, errors = convert_storage(
+        zodb_storage, mapping, quarantine=quarantine)
+    quarantine.close()
+    assert {} == result
+    assert 1 == quarantine.count
+    sync_zodb_connection(zodb_root)
+    assert isinstance(zodb_root['tree'].keys()[0], zodbpickle.binary)
+
+
+def test_convert__convert_storage__18(
+        zodb_storage, zodb_root, tmpdir, caplog):
+    """It leaves the keys of a container unchanged if not all can be decoded.
+
+    Python 2 cannot sort the decoded keys together with the binary ones.
+    """
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree()
+    for key in [b'a\xc3\xa4', b'b\xe4', b'c\xc3\xa4']:
+        zodb_root['tree'][key] = 1
+    zodb_root['tree2'] = BTrees.OOBTree.OOBTree()
+    for key in [b'a\xc3\xa4', b'c\xc3\xa4']:
+        zodb_root['tree2'][key] = 1
+    transaction.commit()
+    mapping = {"BTrees.OOBTree.OOBTree[*]": 'utf-8'}
+    quarantine = Quarantine(str(tmpdir.join('quarantine')), binary=True)
+    result, errors = convert_storage(
+        zodb_storage, mapping, quarantine=quarantine)
+    quarantine.close()
+    assert {"BTrees.OOBTree.OOBTree[*]": 2} == result
+    assert 1 == quarantine.count
+    assert 'Not converting the keys of 0x01, as some of its binary keys are ' \
+        'not mapped or cannot be decoded.' == caplog.records[-1].getMessage()
+    sync_zodb_connection(zodb_root)
+    keys = list(zodb_root['tree'].keys())
+    assert [b'a\xc3\xa4', b'b\xe4', b'c\xc3\xa4'] == keys
+    assert [str, zodbpickle.binary, str] == [type(x) for x in keys]
+    assert [u'a\xe4', u'c\xe4'] == list(zodb_root['tree2'].keys())
+
+
+def test_convert__convert_storage__19(zodb_storage, zodb_root):
+    """It leaves the keys of a container unchanged if not all are mapped."""
+    zodb_root['obj'] = Example(text=b't\xc3\xabxt')
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree()
+    for key in [b'a\xc3\xa4', b'b\xc3\xa4']:
+        zodb_root['tree'][key] = 1
+    transaction.commit()
+    mapping = {"BTrees.OOBTree.OOBTree['a\\xc3\\xa4']": 'utf-8'}
+    result, errors = convert_storage(zodb_storage, mapping)
+    assert {} == result
+    sync_zodb_connection(zodb_root)
+    keys = list(zodb_root['tree'].keys())
+    assert [b'a\xc3\xa4', b'b\xc3\xa4'] == keys
+    assert [str, str] == [type(x) for x in keys]
+
+
+def test_convert__convert_storage__14(zodb_storage, zodb_root):
+    """It commits in batches of the given size at object boundaries."""
+    zodb_root['obj1'] = Example(text=b'tëxt1', title=b'tïtle')
+    zodb_root['obj2'] = Example(text=b'tëxt2')
+    transaction.commit()
+    before = len(list(zodb_storage.iterator()))
+    mapping = {'zodb.py3migrate.testing.Example.text': 'utf-8',
+               'zodb.py3migrate.testing.Example.title': 'utf-8'}
+    convert_storage(zodb_storage, mapping, batch_size=1)
+    assert before + 2 == len(list(zodb_storage.iterator()))
+    sync_zodb_connection(zodb_root)
+    assert u'tëxt1' == zodb_root['obj1'].text
+    assert u'tïtle' == zodb_root['obj1'].title
+    assert u'tëxt2' == zodb_root['obj2'].text
+
+
+def test_convert__convert__3(zodb_storage, zodb_root, tmpdir):
+    """It copies and converts the changes of the source when following."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    target_path = str(tmpdir.join('Target.fs'))
+    shutil.copy(zodb_storage.getName(), target_path)
+    zodb_root['obj'].text = b'chängëd'
+    zodb_root['new'] = Example(text=b'nëw')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    target = ZODB.FileStorage.FileStorage(target_path)
+    convert(target, str(file), follow_path=zodb_storage.getName(), once=True)
+    state_path = get_state_path(target_path)
+    assert zodb_storage.lastTransaction() == read_state(state_path)
+    db = DB(target)
+    root = db.open().root()
+    assert u'chängëd' == root['obj'].text
+    assert u'nëw' == root['new'].text
+    transaction.abort()
+    # A later run only catches up with the source:
+    zodb_root['new'].text = b'nëwer'
+    transaction.commit()
+    convert(target, str(file), follow_path=zodb_storage.getName(), once=True)
+    assert zodb_storage.lastTransaction() == read_state(state_path)
+    root._p_jar.cacheMinimize()
+    root._p_jar.sync()
+    assert u'nëwer' == root['new'].text
+    db.close()
+
+
+def test_convert__catch_up__1(zodb_storage, tmpdir):
+    """It retries the conversion on conflicts."""
+    conflict = ZODB.POSException.ConflictError()
+    with mock.patch('zodb.py3migrate.convert.copy_transactions',
+                    return_value=([ZODB.utils.z64], None)), \
+            mock.patch('zodb.py3migrate.convert.convert_storage',
+                       side_effect=[conflict, ({}, {})]) as convert_storage:
+        assert 1 == catch_up(zodb_storage, 'Source.fs', {})
+    assert 2 == convert_storage.call_count
+    # The state is only written if there were transactions to copy:
+    assert read_state(get_state_path(zodb_storage.getName())) is None
+
+
+def test_convert__catch_up__2(zodb_storage, tmpdir):
+    """It gives up after the given number of conflicts."""
+    conflict = ZODB.POSException.ConflictError()
+    with mock.patch('zodb.py3migrate.convert.copy_transactions',
+                    return_value=([ZODB.utils.z64], None)), \
+            mock.patch('zodb.py3migrate.convert.convert_storage',
+                       side_effect=conflict) as convert_storage:
+        with pytest.raises(ZODB.POSException.ConflictError):
+            catch_up(zodb_storage, 'Source.fs', {}, retries=2)
+    assert 2 == convert_storage.call_count
+
+
+def test_convert__catch_up__3(zodb_storage, zodb_root, tmpdir):
+    """It does nothing if there are no new source transactions."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    state_path = get_state_path(zodb_storage.getName())
+    write_state(state_path, zodb_storage.lastTransaction())
+    with mock.patch('zodb.py3migrate.convert.convert_storage') as convert:
+        assert 0 == catch_up(
+            zodb_storage, zodb_storage.getName(), {}, retries=2)
+    assert not convert.called
+    assert zodb_storage.lastTransaction() == read_state(state_path)
+
+
+def test_convert__follow__1(zodb_storage):
+    """It waits between the catch-up passes until interrupted."""
+    with mock.patch('zodb.py3migrate.convert.catch_up') as catch_up, \
+            mock.patch('time.sleep',
+                       side_effect=[None, KeyboardInterrupt]) as sleep:
+        follow(zodb_storage, 'Source.fs', {}, interval=5)
+    assert 2 == catch_up.call_count
+    sleep.assert_called_with(5)
+
+
+def test_convert__convert_storage__15(zodb_storage, zodb_root):
+    """It counts the sizes of the converted records instead of committing."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    # The tree is big enough to get new buckets when being rebuilt:
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'këy{}'.format(i): i for i in range(100)})
+    transaction.commit()
+    mapping = {'zodb.py3migrate.testing.Example.text': 'utf-8',
+               'BTrees.OOBTree.OOBTree[*]': 'utf-8'}
+    sizes = {}
+    result, errors = convert_storage(zodb_storage, mapping, sizes=sizes)
+    assert {'zodb.py3migrate.testing.Example.text': 1,
+            'BTrees.OOBTree.OOBTree[*]': 100} == result
+    assert ['BTrees.OOBTree.OOBTree', 'BTrees.OOBTree.OOBucket',
+            'zodb.py3migrate.testing.Example'] == sorted(sizes)
+    # The buckets are new objects:
+    assert 0 == sizes['BTrees.OOBTree.OOBucket'][1]
+    records, old_bytes, new_bytes = sizes['zodb.py3migrate.testing.Example']
+    assert 1 == records
+    # The unicode string gets pickled using a longer opcode:
+    assert old_bytes < new_bytes
+    sync_zodb_connection(zodb_root)
+    assert b'tëxt' == zodb_root['obj'].text
+    assert b'këy0' == zodb_root['tree'].minKey()
+
+
+def test_convert__convert_storage__16(zodb_storage, zodb_root):
+    """It counts no sizes if nothing gets converted."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    sizes = {}
+    convert_storage(zodb_storage, {}, sizes=sizes)
+    assert {} == sizes
+
+
+def test_convert__convert__4(zodb_storage, zodb_root, tmpdir, capsys):
+    """It prints the estimated growth of the storage if requested."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    with mock.patch('zodb.py3migrate.convert.follow') as follow:
+        convert(zodb_storage, str(file), estimate=True,
+                follow_path='Source.fs')
+    assert not follow.called
+    out, err = capsys.readouterr()
+    assert """\
+Would convert 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text (1)
+Changed records of 1 classes: (number of records, old bytes, new bytes)
+zodb.py3migrate.testing.Example (1, 62, 65)
+Data.fs grows by about 138 bytes.
+A packed copy changes by about 3 bytes.
+""" == out
+    sync_zodb_connection(zodb_root)
+    assert b'tëxt' == zodb_root['obj'].text
+
+
+def test_convert__convert__5(zodb_storage, capsys, tmpdir):
+    """It estimates no growth for an empty conversion."""
+    file = tmpdir.join('config.ini')
+    file.write('')
+    convert(zodb_storage, str(file), estimate=True)
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+Changed records of 0 classes: (number of records, old bytes, new bytes)
+Data.fs grows by about 0 bytes.
+A packed copy changes by about 0 bytes.
+""")
+
+
+def test_convert__convert__6(zodb_storage, zodb_root, tmpdir, capsys):
+    """It decodes equal values once and prints the cache hits if verbose."""
+    zodb_root['obj1'] = Example(text=b'tëxt')
+    zodb_root['obj2'] = Example(text=b'tëxt')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    decode.clear()
+    convert(zodb_storage, str(file), verbose=True)
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+Cache hit rates: (hits, lookups)
+decode 50.0% (1, 2)
+""")
+    sync_zodb_connection(zodb_root)
+    assert u'tëxt' == zodb_root['obj1'].text == zodb_root['obj2'].text
+
+
+def test_convert__convert_storage__17(zodb_storage, zodb_root):
+    """It converts the slots of objects without `__dict__`."""
+    zodb_root['obj'] = SlotsExample(text=b'tëxt', title=b'tïtle')
+    transaction.commit()
+    mapping = {'zodb.py3migrate.testing.SlotsExample.text': 'utf-8'}
+    result, errors = convert_storage(zodb_storage, mapping)
+    assert {'zodb.py3migrate.testing.SlotsExample.text': 1} == result
+    sync_zodb_connection(zodb_root)
+    assert u'tëxt' == zodb_root['obj'].text
+    assert b'tïtle' == zodb_root['obj'].title
+
+
+def test_convert__convert_storage__20(zodb_storage, zodb_root, caplog):
+    """It converts the values of buckets whose tree is not converted.
+
+    Their binary keys are not converted.
+    """
+    from ..scanners import iter_bucket_oids
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'key{:03}'.format(i): b'bïnäry' for i in range(200)})
+    zodb_root['tree'][b'këy'] = b'bïnäry'
+    transaction.commit()
+    mapping = {"BTrees.OOBTree.OOBTree['key{:03}']".format(i): 'utf-8'
+               for i in range(200)}
+    mapping['BTrees.OOBTree.OOBTree[*]'] = 'utf-8'
+    result, errors = convert_storage(
+        zodb_storage, mapping, oids=iter_bucket_oids(zodb_root['tree']))
+    assert 200 == len(result)
+    assert {1} == set(result.values())
+    assert caplog.records[-1].getMessage().startswith(
+        "Not converting the binary key 'k\\xc3\\xaby' of the bucket 0x")
+    sync_zodb_connection(zodb_root)
+    tree = zodb_root['tree']
+    assert u'bïnäry' == tree['key199']
+    assert b'bïnäry' == tree[b'këy']
+
+
+def test_convert__convert__7(zodb_storage, zodb_root, tmpdir, capsys):
+    """It converts into a temporary overlay in a dry run."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    last_transaction = zodb_storage.lastTransaction()
+    with mock.patch('zodb.py3migrate.convert.time') as time:
+        time.time.side_effect = [10.0, 12.0]
+        convert(zodb_storage, str(file), dry_run=True)
+    out, err = capsys.readouterr()
+    assert """\
+Converted 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text (1)
+Dry run took 2.0 seconds (0.5 converted values per second).
+""" == out
+    assert last_transaction == zodb_storage.lastTransaction()
+    sync_zodb_connection(zodb_root)
+    assert b'tëxt' == zodb_root['obj'].text
+
+
+def test_convert__convert__8(zodb_storage, zodb_root, tmpdir, capsys):
+    """It promotes the changes kept by a dry run."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    overlay_path = str(tmpdir.join('overlay.fs'))
+    convert(zodb_storage, str(file), dry_run=True, overlay_path=overlay_path,
+            reachable_only=True)
+    out, err = capsys.readouterr()
+    assert out.endswith(
+        'Wrote the changes to {0}, copy them into the storage using '
+        '--promote={0}.\n'.format(overlay_path))
+    convert(zodb_storage, None, promote_path=overlay_path)
+    sync_zodb_connection(zodb_root)
+    assert u'tëxt' == zodb_root['obj'].text
+
+
+def test_convert__promote__1(zodb_storage, zodb_root, tmpdir):
+    """It refuses to promote if the storage was changed after the dry run."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    overlay_path = str(tmpdir.join('overlay.fs'))
+    convert_storage(open_overlay(zodb_storage, overlay_path),
+                    {'zodb.py3migrate.testing.Example.text': 'utf-8'},
+                    oids=[ZODB.utils.p64(1)])
+    zodb_root['obj2'] = Example()
+    transaction.commit()
+    with pytest.raises(ValueError) as err:
+        promote(zodb_storage, overlay_path)
+    assert 'was changed after the dry run' in str(err.value)
+
+
+def test_convert__promote__2(zodb_storage, tmpdir):
+    """It promotes an empty overlay."""
+    overlay_path = str(tmpdir.join('overlay.fs'))
+    open_overlay(zodb_storage, overlay_path).close()
+    last_transaction = zodb_storage.lastTransaction()
+    promote(zodb_storage, overlay_path)
+    assert last_transaction == zodb_storage.lastTransaction()
+
+
+def test_convert__promote__3(zodb_storage, zodb_root, tmpdir):
+    """It promotes new objects with the OIDs following the ones in storage."""
+    overlay_path = str(tmpdir.join('overlay.fs'))
+    for name in ('obj', 'obj2'):
+        overlay = open_overlay(zodb_storage, overlay_path)
+        db = DB(overlay)
+        connection = db.open()
+        connection.root()[name] = Example()
+        transaction.commit()
+        db.close()
+    zodb_storage.close()
+    storage = ZODB.FileStorage.FileStorage(zodb_storage.getName())
+    promote(storage, overlay_path)
+    assert 2 == ZODB.utils.u64(storage._oid)
+    storage.close()
+
+
+def test_convert__convert__9(zodb_storage, zodb_root, tmpdir, capsys):
+    """It optimizes the pickles of the changed records if requested."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    zodb_root['other'] = Example(text=b'text')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    with mock.patch('zodb.py3migrate.storage.time_load') as time_load:
+        time_load.side_effect = [0.004, 0.003]
+        convert(zodb_storage, str(file), repickle='changed')
+    out, err = capsys.readouterr()
+    assert """\
+Converted 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text (1)
+Repickled records of 1 classes: (number of records, old bytes, new bytes, \
+old load ms, new load ms)
+zodb.py3migrate.testing.Example (1, 62, 57, 4.0, 3.0)
+Repickling saves 5 bytes and 25.0% of the load time.
+""" == out
+    sync_zodb_connection(zodb_root)
+    assert u'tëxt' == zodb_root['obj'].text
+
+
+def test_convert__convert__10(zodb_storage, zodb_root, tmpdir, capsys):
+    """It rewrites the pickles of all records if requested."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    zodb_root['other'] = Example(text=b'text')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+""")
+    with mock.patch('zodb.py3migrate.storage.time_load') as time_load:
+        time_load.return_value = 0.001
+        convert(zodb_storage, str(file), repickle='all', dry_run=True)
+    out, err = capsys.readouterr()
+    # The converted object is repickled only once:
+    assert """\
+Repickled records of 2 classes: (number of records, old bytes, new bytes, \
+old load ms, new load ms)
+persistent.mapping.PersistentMapping (1, 140, 128, 1.0, 1.0)
+zodb.py3migrate.testing.Example (2, 117, 110, 2.0, 2.0)
+Repickling saves 19 bytes and 0.0% of the load time.
+""" in out
+
+
+def test_convert__repickle_storage__1(zodb_storage, zodb_root):
+    """It skips the objects changed after `after` and commits in batches."""
+    zodb_root['obj'] = Example(text=b'text')
+    transaction.commit()
+    after = zodb_storage.lastTransaction()
+    zodb_root['obj2'] = Example(text=b'text')
+    transaction.commit()
+    repickle_storage(
+        zodb_storage, [ZODB.utils.p64(x) for x in range(3)], after,
+        batch_size=1)
+    # The root object was changed when adding `obj2`:
+    oids = [[x.oid for x in transaction_]
+            for transaction_ in zodb_storage.iterator()]
+    assert 4 == len(oids)
+    assert [ZODB.utils.p64(1)] == oids[-1]
+
+
+def test_convert__repickle_storage__2(zodb_storage, zodb_root):
+    """It skips the objects of classes which cannot be imported."""
+    zodb_root['obj'] = Example(text=b'text')
+    transaction.commit()
+    oids = [zodb_root['obj']._p_oid]
+    rename_storage(
+        zodb_storage, {'zodb.py3migrate.testing.Example': 'gonemod.Gone'},
+        oids)
+    last_transaction = zodb_storage.lastTransaction()
+    repickle_storage(zodb_storage, oids, last_transaction)
+    assert last_transaction == zodb_storage.lastTransaction()
+
+
+def test_convert__convert__11(zodb_storage, tmpdir, capsys):
+    """It does not repickle when estimating."""
+    file = tmpdir.join('config.ini')
+    file.write('')
+    convert(zodb_storage, str(file), repickle='all', estimate=True)
+    out, err = capsys.readouterr()
+    assert 'Repickled' not in out
+
+
+def test_convert__read_renames__1(tmpdir):
+    """It maps old dotted class names to new ones."""
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+foo.bar.Baz.text
+
+[rename]
+copy_reg._reconstructor = copyreg._reconstructor
+foo.bar.Old = foo.bar.New
+""")
+    assert {
+        'copy_reg._reconstructor': 'copyreg._reconstructor',
+        'foo.bar.Old': 'foo.bar.New',
+    } == read_renames(str(file))
+    file.write('')
+    assert {} == read_renames(str(file))
+
+
+def test_convert__read_renames__2(tmpdir):
+    """It refuses names which are not dotted names."""
+    file = tmpdir.join('config.ini')
+    for rename in ['Foo = bar.Baz', 'foo.Bar = Baz', 'foo.Bar']:
+        file.write('[rename]\nfoo.bar.Old = foo.bar.New\n{}\n'.format(rename))
+        with pytest.raises(ValueError) as err:
+            read_renames(str(file))
+        assert 'a class must be given as module.Class in the [rename] ' \
+            'section of {}.'.format(file) in str(err.value)
+
+
+def test_convert__rename_storage__1(zodb_storage, zodb_root):
+    """It rewrites the records referring to renamed classes in batches."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    zodb_root['obj2'] = Example()
+    zodb_root['list'] = persistent.list.PersistentList()
+    # Only looks like a class reference:
+    zodb_root['text'] = persistent.mapping.PersistentMapping(
+        text=b'zodb.py3migrate.testing\nExample\n')
+    transaction.commit()
+    last_transaction = zodb_storage.lastTransaction()
+    renames = {'zodb.py3migrate.testing.Example': 'new_module.NewExample'}
+    oids = [ZODB.utils.p64(x) for x in range(5)]
+    counts = rename_storage(zodb_storage, renames, oids, batch_size=2)
+    # The root object refers to the class once, the memo is used afterwards:
+    assert {('zodb.py3migrate.testing.Example',
+             'new_module.NewExample'): 3} == counts
+    changed = [[x.oid for x in transaction_]
+               for transaction_ in zodb_storage.iterator(last_transaction)]
+    assert [2, 1] == [len(x) for x in changed[1:]]
+    assert zodb_root['text']._p_oid not in changed[1] + changed[2]
+    data, tid = ZODB.utils.load_current(
+        zodb_storage, zodb_root['obj']._p_oid)
+    assert 'new_module.NewExample' == get_record_classname(data)
+    # Nothing left to rename:
+    last_transaction = zodb_storage.lastTransaction()
+    assert {} == rename_storage(zodb_storage, renames, oids)
+    assert last_transaction == zodb_storage.lastTransaction()
+
+
+def test_convert__convert__12(zodb_storage, zodb_root, tmpdir, capsys):
+    """It renames classes after converting."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+
+[rename]
+zodb.py3migrate.testing.Example = new_module.NewExample
+""")
+    convert(zodb_storage, str(file))
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+Renamed 1 classes: (number of references)
+zodb.py3migrate.testing.Example -> new_module.NewExample (2)
+""")
+    data, tid = ZODB.utils.load_current(
+        zodb_storage, zodb_root['obj']._p_oid)
+    assert 'new_module.NewExample' == get_record_classname(data)
+    assert u'tëxt'.encode('utf-8') in data
+
+
+def test_convert__convert__13(zodb_storage, zodb_root, tmpdir, capsys):
+    """It does not repickle the records it renames classes in."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    zodb_root['other'] = Example(text=b'text')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+zodb.py3migrate.testing.Example.text
+
+[rename]
+zodb.py3migrate.testing.Example = new_module.NewExample
+""")
+    with mock.patch('zodb.py3migrate.storage.time_load') as time_load:
+        time_load.return_value = 0.001
+        convert(zodb_storage, str(file), repickle='changed')
+    out, err = capsys.readouterr()
+    # Only the converted record is counted as repickled:
+    assert """\
+Repickled records of 1 classes: (number of records, old bytes, new bytes, \
+old load ms, new load ms)
+zodb.py3migrate.testing.Example (1, 62, 57, 1.0, 1.0)
+""" in out
+    assert """\
+Renamed 1 classes: (number of references)
+zodb.py3migrate.testing.Example -> new_module.NewExample (3)
+""" in out
+    data, tid = ZODB.utils.load_current(
+        zodb_storage, zodb_root['other']._p_oid)
+    assert 'new_module.NewExample' == get_record_classname(data)
+
+
+def test_convert__convert__14(zodb_storage, zodb_root, tmpdir):
+    """It converts values inserted into the buckets of a `BTree`."""
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'key{:03}'.format(i): b'value' for i in range(200)})
+    transaction.commit()
+    target_path = str(tmpdir.join('Target.fs'))
+    shutil.copy(zodb_storage.getName(), target_path)
+    zodb_root['tree']['key050'] = b'nëw'
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+BTrees.OOBTree.OOBTree['key050']
+""")
+    target = ZODB.FileStorage.FileStorage(target_path)
+    convert(target, str(file), follow_path=zodb_storage.getName(), once=True)
+    db = DB(target)
+    tree = db.open().root()['tree']
+    assert tree._firstbucket._next is not None
+    assert u'nëw' == tree['key050']
+    transaction.abort()
+    db.close()
+
+
+def test_convert__convert__15(zodb_storage, zodb_root, tmpdir):
+    """It refuses to follow if converting keys gives buckets new OIDs.
+
+    The snapshot is not converted and not marked as converted.
+    """
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {b'këy{:03}'.format(i): 1 for i in range(200)})
+    transaction.commit()
+    target_path = str(tmpdir.join('Target.fs'))
+    shutil.copy(zodb_storage.getName(), target_path)
+    file = tmpdir.join('config.ini')
+    file.write("""
+[utf-8]
+BTrees.OOBTree.OOBTree[*]
+""")
+    target = ZODB.FileStorage.FileStorage(target_path)
+    last_transaction = target.lastTransaction()
+    with pytest.raises(ValueError) as err:
+        convert(target, str(file), follow_path=zodb_storage.getName(),
+                once=True)
+    assert 'while following' in str(err.value)
+    assert last_transaction == target.lastTransaction()
+    assert read_state(get_state_path(target_path)) is None
+    target.close()
+
+
+def test_convert__convert__16(zodb_storage, zodb_root, tmpdir):
+    """It aborts on values which cannot be decoded without quarantine."""
+    zodb_root['obj'] = Example(text=b'\xff')
+    transaction.commit()
+    file = tmpdir.join('config.ini')
+    file.write('[utf-8]\nzodb.py3migrate.testing.Example.text\n')
+    last_transaction = zodb_storage.lastTransaction()
+    with pytest.raises(UnicodeDecodeError):
+        convert(zodb_storage, str(file))
+    transaction.abort()
+    overlay_path = str(tmpdir.join('overlay.fs'))
+    for path in (None, overlay_path):
+        with pytest.raises(UnicodeDecodeError):
+            convert(zodb_storage, str(file), dry_run=True, overlay_path=path)
+        transaction.abort()
+    assert last_transaction == zodb_storage.lastTransaction()
+
+
+def test_convert__catch_up__6(zodb_storage, zodb_root, tmpdir):
+    """It refuses to convert copied keys if buckets would get new OIDs."""
+    target = ZODB.FileStorage.FileStorage(str(tmpdir.join('Target.fs')))
+    write_state(get_state_path(target.getName()), ZODB.utils.z64)
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {b'këy{:03}'.format(i): 1 for i in range(200)})
+    transaction.commit()
+    with pytest.raises(ValueError):
+        catch_up(target, zodb_storage.getName(),
+                 {'BTrees.OOBTree.OOBTree[*]': 'utf-8'})
+    transaction.abort()
+    assert ZODB.utils.z64 == read_state(get_state_path(target.getName()))
+    target.close()
+
+
+def test_convert__catch_up__4(zodb_storage, tmpdir):
+    """It renames the classes of the copied records."""
+    renames = {'foo.bar.Old': 'foo.bar.New'}
+    with mock.patch('zodb.py3migrate.convert.copy_transactions',
+                    return_value=([ZODB.utils.z64], None)), \
+            mock.patch('zodb.py3migrate.convert.convert_storage',
+                       return_value=({}, {})), \
+            mock.patch('zodb.py3migrate.convert.rename_storage') as rename:
+        catch_up(zodb_storage, 'Source.fs', {}, renames=renames)
+    rename.assert_called_with(zodb_storage, renames, [ZODB.utils.z64], 100)
+
+
+def test_convert__catch_up__5(zodb_storage, zodb_root, tmpdir):
+    """It closes the DB it reads the copied objects with after each pass."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    target = ZODB.FileStorage.FileStorage(str(tmpdir.join('Target.fs')))
+    write_state(get_state_path(target.getName()), ZODB.utils.z64)
+    dbs = []
+
+    def open_db(storage):
+        dbs.append(DB(storage))
+        return dbs[-1]
+
+    with mock.patch('zodb.py3migrate.convert.DB', side_effect=open_db):
+        assert 2 == catch_up(target, zodb_storage.getName(), {
+            'zodb.py3migrate.testing.Example.text': 'utf-8'})
+    assert 1 == len(dbs)
+    assert not hasattr(dbs[0], '_mvcc_storage')
+    # The storage is still open:
+    db = DB(target)
+    assert u'tëxt' == db.open().root()['obj'].text
+    transaction.abort()
+    db.close()
+
+
+def test_convert__follow__2(zodb_storage):
+    """It passes the blob directory of the source to `catch_up`."""
+    with mock.patch('zodb.py3migrate.convert.catch_up') as catch_up:
+        follow(zodb_storage, 'Source.fs', {}, once=True,
+               source_blob_dir='blobs')
+    catch_up.assert_called_with(
+        zodb_storage, 'Source.fs', {}, renames=None, source_blob_dir='blobs')
+
+
+def test_convert__main__3(zodb_storage, zodb_root, tmpdir, capsys):
+    """It converts the records in the order they are stored if requested."""
+    zodb_root['0'] = Example(text=b'\xff')
+    transaction.commit()
+    zodb_storage.close()
+    file = tmpdir.join('config.ini')
+    file.write('[latin-1]\nzodb.py3migrate.testing.Example.text\n')
+    zodb.py3migrate.convert.main([
+        zodb_storage.getName(), '--config={}'.format(file),
+        '--order=offset'])
+    out, err = capsys.readouterr()
+    assert '''\
+Converted 1 binary fields: (number of occurrences)
+zodb.py3migrate.testing.Example.text (1)
+''' == out
@@ -0,0 +1,74 @@
+from ..errors import ErrorSummary
+import ZODB.utils
+import json
+
+
+def raise_error(error_summary, exception, name, oid, value=b'value'):
+    """Let `error_summary` record `exception` raised for `value`."""
+    try:
+        raise exception
+    except Exception:
+        error_summary.add(name, ZODB.utils.p64(oid), value)
+
+
+def test_errors__ErrorSummary__1(capsys, caplog):
+    """It counts the errors per field and exception type."""
+    error_summary = ErrorSummary(sample_size=2)
+    for oid in [1, 2, 2, 3]:
+        raise_error(error_summary, ValueError('bad'), 'foo.Bar.baz', oid)
+    raise_error(error_summary, KeyError('key'), 'foo.Bar.baz', 4)
+    raise_error(error_summary, ValueError('bad'), 'foo.Bar[*]', 5)
+    assert not caplog.records
+    error_summary.print_summary()
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert [
+        'Could not scan the values of 3 fields: (exception, number of '
+        'occurrences, sample OIDs)',
+        'foo.Bar.baz KeyError (1, 0x04)',
+        '  Traceback (most recent call last):',
+    ] == lines[:3]
+    assert 'foo.Bar.baz ValueError (4, 0x01 0x02)' in lines
+    assert 'foo.Bar[*] ValueError (1, 0x05)' in lines
+    # One traceback per field and exception type:
+    assert 3 == out.count('Traceback')
+    assert '  ValueError: bad' == lines[-1]
+
+
+def test_errors__ErrorSummary__2(capsys, caplog):
+    """It logs each error if tracing and prints nothing without errors."""
+    error_summary = ErrorSummary(trace=True)
+    error_summary.print_summary()
+    assert ('', '') == capsys.readouterr()
+    raise_error(error_summary, ValueError('bad'), 'foo.Bar.baz', 1)
+    raise_error(error_summary, ValueError('bad'), 'foo.Bar.baz', 1)
+    assert ["Could not execute 'value'"] * 2 == [
+        x.getMessage() for x in caplog.records]
+
+
+def test_errors__ErrorSummary__3(capsys):
+    """It can be stored as JSON and merged with other summaries."""
+    first = ErrorSummary(sample_size=2)
+    raise_error(first, ValueError('first'), 'foo.Bar.baz', 1)
+    raise_error(first, ValueError('first'), 'foo.Bar.baz', 2)
+    second = ErrorSummary()
+    raise_error(second, ValueError('second'), 'foo.Bar.baz', 3)
+    raise_error(second, KeyError('key'), 'foo.Bar.baz', 3)
+    data = json.loads(json.dumps(second.as_json()))
+    assert ['KeyError', 'ValueError'] == [x['exception'] for x in data]
+    assert [['0x03'], ['0x03']] == [x['oids'] for x in data]
+    first.update(ErrorSummary.from_json(data))
+    assert {('foo.Bar.baz', 'ValueError'): 3,
+            ('foo.Bar.baz', 'KeyError'): 1} == first.counts
+    # The sample size and the first traceback are kept:
+    assert [ZODB.utils.p64(1), ZODB.utils.p64(2)] == first.oids[
+        ('foo.Bar.baz', 'ValueError')]
+    assert 'ValueError: first' in first.tracebacks[
+        ('foo.Bar.baz', 'ValueError')]
+    assert 'KeyError' in first.tracebacks[('foo.Bar.baz', 'KeyError')]
+    # Without sample OIDs only the counts are printed:
+    merged = ErrorSummary(sample_size=0)
+    merged.update(first)
+    merged.print_summary()
+    out, err = capsys.readouterr()
+    assert 'foo.Bar.baz ValueError (3)' in out.splitlines()
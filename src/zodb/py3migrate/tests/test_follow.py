@@ -0,0 +1,120 @@
+# encoding: utf-8
+from ..follow import copy_transactions, get_state_path, read_state
+from ..follow import write_state
+from ..testing import Example
+from ZODB.DB import DB
+import ZODB.FileStorage
+import ZODB.blob
+import ZODB.utils
+import pytest
+import transaction
+
+
+@pytest.yield_fixture('function')
+def target_storage(tmpdir):
+    """Create an empty FileStorage to copy transactions to."""
+    storage = ZODB.FileStorage.FileStorage(str(tmpdir.join('Target.fs')))
+    yield storage
+    storage.close()
+
+
+def test_follow__read_state__1(tmpdir):
+    """It returns `None` if there is no state file."""
+    assert read_state(str(tmpdir.join('missing'))) is None
+
+
+def test_follow__write_state__1(tmpdir):
+    """It stores a TID which `read_state` returns."""
+    path = get_state_path(str(tmpdir.join('Data.fs')))
+    assert path.endswith('Data.fs.py3follow')
+    write_state(path, ZODB.utils.p64(0x03d5))
+    assert '0x03d5\n' == tmpdir.join('Data.fs.py3follow').read()
+    assert ZODB.utils.p64(0x03d5) == read_state(path)
+
+
+def test_follow__copy_transactions__1(
+        zodb_storage, zodb_root, target_storage):
+    """It copies the transactions after the given one to another storage."""
+    zodb_root['first'] = Example(text=b'first')
+    transaction.commit()
+    first = zodb_storage.lastTransaction()
+    zodb_root['second'] = Example(text=b'sëcond')
+    transaction.get().setUser('user')
+    transaction.get().note(u'second')
+    transaction.commit()
+    oids, last = copy_transactions(
+        zodb_storage.getName(), target_storage, ZODB.utils.z64)
+    assert [ZODB.utils.p64(x) for x in range(3)] == oids
+    assert zodb_storage.lastTransaction() == last
+    db = DB(target_storage)
+    root = db.open().root()
+    assert b'sëcond' == root['second'].text
+    # Only the transactions after `after` are copied:
+    oids, last = copy_transactions(
+        zodb_storage.getName(), target_storage, first)
+    assert [ZODB.utils.z64, ZODB.utils.p64(2)] == oids
+    info = list(target_storage.iterator())[-1]
+    assert '/ user' == info.user
+    assert 'second' == info.description
+    # There is nothing left to copy:
+    assert ([], None) == copy_transactions(
+        zodb_storage.getName(), target_storage, last)
+    db.close()
+
+
+def test_follow__copy_transactions__2(
+        zodb_storage, zodb_root, target_storage):
+    """It skips records of undone object creations."""
+    zodb_root['obj'] = Example()
+    transaction.commit()
+    db = zodb_root._p_jar.db()
+    db.undo(db.undoLog(0, 1)[0]['id'])
+    transaction.commit()
+    oids, last = copy_transactions(
+        zodb_storage.getName(), target_storage, ZODB.utils.z64)
+    assert [ZODB.utils.z64, ZODB.utils.p64(1)] == oids
+    assert zodb_storage.lastTransaction() == last
+
+
+def test_follow__copy_transactions__3(tmpdir):
+    """It copies the blob files of blob records."""
+    source = ZODB.FileStorage.FileStorage(
+        str(tmpdir.join('Source.fs')), blob_dir=str(tmpdir.join('blobs')))
+    db = DB(source)
+    connection = db.open()
+    connection.root()['blob'] = ZODB.blob.Blob(b'blöb')
+    transaction.commit()
+    connection.close()
+    target = ZODB.FileStorage.FileStorage(
+        str(tmpdir.join('Target.fs')),
+        blob_dir=str(tmpdir.join('target-blobs')))
+    oids, last = copy_transactions(
+        source.getName(), target, ZODB.utils.z64, str(tmpdir.join('blobs')))
+    assert [ZODB.utils.z64, ZODB.utils.p64(1)] == oids
+    target_db = DB(target)
+    with target_db.open().root()['blob'].open() as file:
+        assert b'blöb' == file.read()
+    transaction.abort()
+    target_db.close()
+    # The blob file of the source is kept:
+    with source.openCommittedBlobFile(ZODB.utils.p64(1), last) as file:
+        assert b'blöb' == file.read()
+    db.close()
+
+
+def test_follow__copy_transactions__4(tmpdir, target_storage):
+    """It refuses to copy blob records without the blob directories."""
+    source = ZODB.FileStorage.FileStorage(
+        str(tmpdir.join('Source.fs')), blob_dir=str(tmpdir.join('blobs')))
+    db = DB(source)
+    connection = db.open()
+    connection.root()['blob'] = ZODB.blob.Blob(b'blöb')
+    transaction.commit()
+    connection.close()
+    with pytest.raises(ValueError) as err:
+        copy_transactions(source.getName(), target_storage, ZODB.utils.z64,
+                          str(tmpdir.join('blobs')))
+    assert 'Cannot copy the blob of 0x01' in str(err.value)
+    # Only the transaction creating the root object is committed:
+    assert 1 == len(list(target_storage.iterator()))
+    db.close()
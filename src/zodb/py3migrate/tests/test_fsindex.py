@@ -0,0 +1,161 @@
+from ..fsindex import split_transactions, build_index, prepare_index
+from ..fsindex import get_indexed_pos
+from ..migrate import get_argparse_parser, run
+from ZODB.FileStorage.format import TRANS_HDR, TRANS_HDR_LEN
+import ZODB.FileStorage
+import mock
+import os
+import persistent.mapping
+import struct
+import transaction
+
+
+def create_file(storage, root):
+    """Commit some transactions, return the file path without an index."""
+    for i in range(5):
+        root[i] = persistent.mapping.PersistentMapping(a=i)
+        transaction.commit()
+    root[0]['a'] = 5
+    transaction.commit()
+    storage.close()
+    path = storage.getName()
+    os.remove(path + '.index')
+    return path
+
+
+def get_index(path):
+    """Return the index FileStorage builds for the file at `path`."""
+    storage = ZODB.FileStorage.FileStorage(path, read_only=True)
+    try:
+        return dict(storage._index.items()), storage.getSize()
+    finally:
+        storage.close()
+
+
+def test_fsindex__split_transactions__1(zodb_storage, zodb_root):
+    """It splits the file into ranges of transactions of about equal size."""
+    path = create_file(zodb_storage, zodb_root)
+    ranges = split_transactions(path, 3)
+    assert 3 == len(ranges)
+    assert 4 == ranges[0][0]
+    assert os.path.getsize(path) == ranges[-1][1]
+    assert all(x[1] == y[0] for x, y in zip(ranges, ranges[1:]))
+    assert [(4, os.path.getsize(path))] == split_transactions(path, 1)
+
+
+def test_fsindex__split_transactions__2(zodb_storage, zodb_root):
+    """It ignores an unfinished transaction at the end of the file."""
+    path = create_file(zodb_storage, zodb_root)
+    size = os.path.getsize(path)
+    with open(path, 'ab') as file:
+        file.write(struct.pack(TRANS_HDR, b'\1' * 8, 100, 'c', 0, 0, 0))
+    assert size == split_transactions(path, 100)[-1][1]
+    with open(path, 'r+b') as file:
+        file.seek(size + 16)
+        file.write(b' ')
+    assert size == split_transactions(path, 100)[-1][1]
+
+
+def test_fsindex__build_index__1(zodb_storage, zodb_root):
+    """It builds the same index as FileStorage in parallel."""
+    path = create_file(zodb_storage, zodb_root)
+    # Mark the transaction creating `root[1]` as undone:
+    transaction_pos = split_transactions(path, 100)[2][0]
+    with open(path, 'r+b') as file:
+        file.seek(transaction_pos + 16)
+        file.write(b'u')
+    index, pos = build_index(path, jobs=2)
+    assert get_index(path) == (dict(index.items()), pos)
+
+
+def test_fsindex__build_index__2(tmpdir):
+    """It returns an empty index for an empty file."""
+    path = str(tmpdir.join('Data.fs'))
+    ZODB.FileStorage.FileStorage(path).close()
+    index, pos = build_index(path, jobs=2)
+    assert ([], 4) == (list(index.items()), pos)
+
+
+def test_fsindex__prepare_index__1(zodb_storage, zodb_root, caplog):
+    """It builds and saves the index if FileStorage would read the file."""
+    path = create_file(zodb_storage, zodb_root)
+    prepare_index(path, jobs=2)
+    assert 'Building the index of {} using 2 processes.'.format(
+        path) == caplog.records[-1].getMessage()
+    assert os.path.getsize(path) == get_indexed_pos(path)
+    storage = ZODB.FileStorage.FileStorage(path, read_only=True)
+    assert storage._used_index
+    storage.close()
+
+
+def test_fsindex__prepare_index__2(zodb_storage, zodb_root):
+    """It reuses an index covering most of the file."""
+    path = create_file(zodb_storage, zodb_root)
+    ZODB.FileStorage.FileStorage(path).close()
+    with mock.patch('zodb.py3migrate.fsindex.build_index') as build_index:
+        prepare_index(path, jobs=2)
+        prepare_index(path + '.missing', jobs=2)
+        prepare_index(path, jobs=1)
+        os.remove(path + '.index')
+        prepare_index(path, jobs=1)
+    assert not build_index.called
+
+
+def test_fsindex__prepare_index__3(zodb_storage, zodb_root, caplog):
+    """It warns if the index cannot be saved."""
+    path = create_file(zodb_storage, zodb_root)
+    with mock.patch('os.rename', side_effect=OSError('Permission denied')):
+        prepare_index(path, jobs=2)
+    assert 'Could not save the index of {}: Permission denied'.format(
+        path) == caplog.records[-1].getMessage()
+    assert 4 == get_indexed_pos(path)
+    assert not os.path.exists(path + '.index.py3migrate_tmp')
+    with mock.patch('ZODB.fsIndex.fsIndex.save',
+                    side_effect=IOError('No space left on device')):
+        prepare_index(path, jobs=2)
+    assert 'Could not save the index of {}: No space left on device'.format(
+        path) == caplog.records[-1].getMessage()
+
+
+def test_fsindex__get_indexed_pos__1(zodb_storage, zodb_root, tmpdir):
+    """It does not trust index files which do not match the file."""
+    path = create_file(zodb_storage, zodb_root)
+    ZODB.FileStorage.FileStorage(path).close()
+    size = os.path.getsize(path)
+    assert size == get_indexed_pos(path)
+    with open(path, 'ab') as file:
+        file.write(b'\0' * 8)
+    # The position is not at the end of a transaction:
+    index, pos = build_index(path, jobs=1)
+    index.save(pos + 8, path + '.index')
+    assert 4 == get_indexed_pos(path)
+    # The position is after the end of the file:
+    index.save(pos + 16, path + '.index')
+    assert 4 == get_indexed_pos(path)
+    # An index of the old format:
+    index.save({'pos': pos}, path + '.index')
+    assert 4 == get_indexed_pos(path)
+    with open(path + '.index', 'wb') as file:
+        file.write(b'broken')
+    assert 4 == get_indexed_pos(path)
+
+
+def test_fsindex__get_indexed_pos__2(zodb_storage, zodb_root):
+    """It does not trust a position pointing to a bogus length."""
+    path = create_file(zodb_storage, zodb_root)
+    ZODB.FileStorage.FileStorage(path).close()
+    index, pos = build_index(path, jobs=1)
+    # The 8 bytes before this position are within the header of the first
+    # transaction:
+    index.save(4 + TRANS_HDR_LEN + 8, path + '.index')
+    assert 4 == get_indexed_pos(path)
+
+
+def test_fsindex__run__1(zodb_storage, zodb_root):
+    """It prepares the index before opening the storage."""
+    path = create_file(zodb_storage, zodb_root)
+    parser = get_argparse_parser('desc')
+    with mock.patch('zodb.py3migrate.migrate.prepare_index') as prepare:
+        run(parser, lambda storage: storage.close(),
+            args=[path, '--index-jobs', '4'])
+    prepare.assert_called_once_with(path, 4)
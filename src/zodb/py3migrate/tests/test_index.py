@@ -0,0 +1,164 @@
+# encoding: utf-8
+from ..index import RecordIndex, build_index, get_index_path
+from ..index import get_indexed_oids, select_oids
+from ..testing import Example
+import BTrees.OOBTree
+import mock
+import pytest
+import transaction
+import zodb.py3migrate.index
+
+
+@pytest.fixture('function')
+def indexed_storage(zodb_storage, zodb_root):
+    """Storage containing some objects and its record index."""
+    # Commit separately to get predictable OIDs:
+    zodb_root['ascii'] = Example(text=b'text')
+    transaction.commit()
+    zodb_root['binary'] = Example(text=b'tëxt')
+    transaction.commit()
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree()
+    transaction.commit()
+    return zodb_storage
+
+
+def test_index__main__1(indexed_storage, capsys):
+    """It builds the index and answers queries from it."""
+    indexed_storage.close()
+    path = indexed_storage.getName()
+    zodb.py3migrate.index.main([path, '--class=BTrees.OOBTree.OOBTree'])
+    out, err = capsys.readouterr()
+    assert '0x03\n' == out
+    with mock.patch('zodb.py3migrate.index.run') as run:
+        zodb.py3migrate.index.main([path, '--sizes'])
+        run.assert_not_called()
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    assert '3 classes: (number of records, bytes)' == lines[0]
+    assert lines[1].startswith('persistent.mapping.PersistentMapping (1, ')
+    assert lines[2].startswith('zodb.py3migrate.testing.Example (2, ')
+    assert lines[3].startswith('BTrees.OOBTree.OOBTree (1, ')
+
+
+def test_index__main__2(indexed_storage):
+    """It rebuilds an existing index if requested."""
+    indexed_storage.close()
+    path = indexed_storage.getName()
+    zodb.py3migrate.index.main([path])
+    with mock.patch('zodb.py3migrate.index.run') as run:
+        zodb.py3migrate.index.main([path, '--rebuild'])
+        run.assert_called_once()
+
+
+def test_index__build_index__1(indexed_storage, caplog):
+    """It indexes all current records of the storage."""
+    index = build_index(indexed_storage, watermark=2)
+    assert 4 == len(index)
+    assert '2 of about 4 records indexed.' in [
+        x.getMessage() for x in caplog.records]
+    assert [0, 1, 2, 3] == list(index.oids)
+    assert [0, 1, 1, 2] == list(index.classes)
+    assert [0, 0, 1, 0] == list(index.binary)
+    assert indexed_storage._lookup_pos(b'\0' * 7 + b'\2') == index.offsets[2]
+
+
+def test_index__RecordIndex__select__1(indexed_storage):
+    """It selects OIDs by class and binary flag."""
+    index = build_index(indexed_storage)
+    example = 'zodb.py3migrate.testing.Example'
+    assert [b'\0' * 7 + b'\2'] == index.select(binary=True)
+    assert 3 == len(index.select(binary=False))
+    assert 2 == len(index.select(classname=example))
+    assert [b'\0' * 7 + b'\1'] == index.select(
+        classname=example, binary=False)
+    assert [] == index.select(classname='foo.Bar')
+
+
+def test_index__RecordIndex__select__2():
+    """It returns the OIDs in file order."""
+    index = RecordIndex()
+    index.append(b'\0' * 8, b'\0' * 8, 100, b'cfoo\nBar\n.N.')
+    index.append(b'\0' * 7 + b'\1', b'\0' * 8, 50, b'cfoo\nBar\n.N.')
+    assert [b'\0' * 7 + b'\1', b'\0' * 8] == index.select()
+
+
+def test_index__RecordIndex__load__1(indexed_storage, tmpdir):
+    """It reads an index written by `save`."""
+    index = build_index(indexed_storage)
+    path = str(tmpdir.join('index'))
+    index.save(path)
+    loaded = RecordIndex.load(path)
+    assert index.classnames == loaded.classnames
+    assert index.sizes() == loaded.sizes()
+    assert index.select(binary=True) == loaded.select(binary=True)
+    assert indexed_storage.lastTransaction() == loaded.last_transaction
+    assert index.size == loaded.size
+    assert loaded.is_current(indexed_storage)
+
+
+def test_index__RecordIndex__load__2(tmpdir):
+    """It refuses to read a file of an unknown format."""
+    file = tmpdir.join('index')
+    file.write('{"format": "foo"}\n')
+    with pytest.raises(ValueError):
+        RecordIndex.load(str(file))
+
+
+def test_index__RecordIndex__load__3(tmpdir):
+    """It reads an index of an older version as not being current."""
+    path = str(tmpdir.join('index'))
+    RecordIndex().save(path)
+    loaded = RecordIndex.load(path)
+    assert loaded.last_transaction is None
+    assert loaded.size is None
+
+
+def test_index__get_indexed_oids__1(indexed_storage):
+    """It returns the OIDs flagged as binary in the index of a storage."""
+    build_index(indexed_storage).save(
+        get_index_path(indexed_storage.getName()))
+    assert [b'\0' * 7 + b'\2'] == get_indexed_oids(indexed_storage)
+
+
+def test_index__get_indexed_oids__2(indexed_storage, zodb_root, caplog):
+    """It rebuilds the index if the storage changed after building it."""
+    path = get_index_path(indexed_storage.getName())
+    build_index(indexed_storage).save(path)
+    zodb_root['binary2'] = Example(text=b'tëxt')
+    transaction.commit()
+    assert [b'\0' * 7 + b'\2', b'\0' * 7 + b'\4'] == get_indexed_oids(
+        indexed_storage)
+    assert 'is outdated, rebuilding it.' in caplog.text
+    assert RecordIndex.load(path).is_current(indexed_storage)
+
+
+def test_index__select_oids__1(indexed_storage, zodb_root):
+    """It restricts the OIDs to the ones flagged in the index and reachable."""
+    build_index(indexed_storage).save(
+        get_index_path(indexed_storage.getName()))
+    del zodb_root['binary']
+    transaction.commit()
+    assert None is select_oids(indexed_storage)
+    assert [b'\0' * 7 + b'\2'] == list(
+        select_oids(indexed_storage, use_index=True))
+    assert [b'\0' * 7 + b'\0', b'\0' * 7 + b'\1', b'\0' * 7 + b'\3'] == list(
+        select_oids(indexed_storage, reachable_only=True))
+    assert [] == list(
+        select_oids(indexed_storage, use_index=True, reachable_only=True))
+
+
+def test_index__select_oids__2(indexed_storage, zodb_root):
+    """It orders the OIDs by the file offset of their records if requested."""
+    zodb_root['ascii'].text = b'changed'
+    transaction.commit()
+    del zodb_root['binary']
+    transaction.commit()
+    oids = [b'\0' * 7 + x for x in b'\3\1\0']
+    assert [b'\0' * 7 + b'\2'] + oids == list(select_oids(
+        indexed_storage, order='offset'))
+    assert oids == select_oids(
+        indexed_storage, reachable_only=True, order='offset')
+    build_index(indexed_storage).save(
+        get_index_path(indexed_storage.getName()))
+    assert [b'\0' * 7 + b'\2'] == list(select_oids(
+        indexed_storage, use_index=True, order='offset'))
@@ -1,7 +1,13 @@
-from ..magic import set_magic
+from ..magic import set_magic, verify
+from ZODB.FileStorage.format import TRANS_HDR, TRANS_HDR_LEN, DATA_HDR_LEN
+import ZODB.FileStorage
+import ZODB.utils
 import mock
 import os.path
+import persistent.mapping
 import pkg_resources
+import pytest
+import struct
 import transaction
 import zodb.py3migrate.magic
 
@@ -36,3 +42,164 @@ def test_magic__set_magic__2(zodb_storage):
     set_magic(path, 'Python2')
     with open(path) as zodb:
         assert 'FS21' == zodb.read(4)
+
+
+def create_file(storage, root):
+    """Commit some transactions including an undo, return the file path."""
+    root['obj'] = persistent.mapping.PersistentMapping(a=1)
+    transaction.commit()
+    root['obj']['a'] = 2
+    transaction.get().note(u'change')
+    transaction.commit()
+    db = root._p_jar.db()
+    db.undo(db.undoLog(0, 1)[0]['id'])
+    transaction.commit()
+    storage.close()
+    return storage.getName()
+
+
+def patch_file(path, pos, data):
+    """Overwrite the file at `path` with `data` at `pos`."""
+    with open(path, 'r+b') as file:
+        file.seek(pos)
+        file.write(data)
+
+
+def get_first_data_record_pos(path):
+    """Return the position of the first data record in the file."""
+    with open(path, 'rb') as file:
+        file.seek(4)
+        header = struct.unpack(TRANS_HDR, file.read(TRANS_HDR_LEN))
+    return 4 + TRANS_HDR_LEN + sum(header[3:])
+
+
+def test_magic__verify__1(zodb_storage, zodb_root):
+    """It returns the numbers of transactions and data records."""
+    path = create_file(zodb_storage, zodb_root)
+    # The undo writes records pointing back to the previous data:
+    assert (4, 5) == verify(path)
+
+
+def test_magic__verify__2(zodb_storage, tmpdir):
+    """It accepts an empty storage but no files of other formats."""
+    zodb_storage.close()
+    assert (0, 0) == verify(zodb_storage.getName())
+    path = str(tmpdir.join('Data.fs'))
+    with open(path, 'wb') as file:
+        file.write('FS2')
+    with pytest.raises(ValueError) as err:
+        verify(path)
+    assert 'Data.fs is not a FileStorage file.' in str(err.value)
+
+
+def test_magic__verify__3(zodb_storage, zodb_root):
+    """It detects a truncated file."""
+    path = create_file(zodb_storage, zodb_root)
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as file:
+        last_byte = file.read()[-1]
+        file.truncate(size - 1)
+    with pytest.raises(ValueError) as err:
+        verify(path)
+    assert 'out of bounds at' in str(err.value)
+    with open(path, 'ab') as file:
+        file.write(last_byte + 10 * '\0')
+    with pytest.raises(ValueError) as err:
+        verify(path)
+    assert 'Truncated transaction header at {}.'.format(size) in str(
+        err.value)
+
+
+def test_magic__verify__4(zodb_storage, zodb_root):
+    """It detects broken transaction headers."""
+    path = create_file(zodb_storage, zodb_root)
+    with open(path, 'rb') as file:
+        original = file.read()
+
+    def assert_error(pos, data, message):
+        patch_file(path, pos, data)
+        with pytest.raises(ValueError) as err:
+            verify(path)
+        assert '{} at 4.'.format(message) in str(err.value)
+        patch_file(path, 0, original)
+
+    assert_error(4, ZODB.utils.z64, 'Transaction id 0x00 not increasing')
+    assert_error(12, ZODB.utils.p64(1), 'Transaction length 1 out of bounds')
+    assert_error(12, ZODB.utils.p64(42),
+                 'Redundant transaction length does not match')
+    assert_error(20, 'c', "Transaction status 'c' of an unfinished or "
+                 "unknown transaction")
+    assert_error(21, '\xff\xff',
+                 'Transaction meta data longer than the transaction')
+
+
+def test_magic__verify__5(zodb_storage, zodb_root):
+    """It detects broken data record headers."""
+    path = create_file(zodb_storage, zodb_root)
+    pos = get_first_data_record_pos(path)
+    with open(path, 'rb') as file:
+        original = file.read()
+
+    def assert_error(offset, data, message):
+        patch_file(path, pos + offset, data)
+        with pytest.raises(ValueError) as err:
+            verify(path)
+        assert '{} at {}.'.format(message, pos) in str(err.value)
+        patch_file(path, 0, original)
+
+    assert_error(8, ZODB.utils.z64, 'Data record of another transaction')
+    assert_error(24, ZODB.utils.p64(5), 'Data record of another transaction')
+    assert_error(16, ZODB.utils.p64(4),
+                 'Previous record pointer 4 out of bounds')
+    assert_error(32, '\x00\x01', 'Data record with a version')
+    assert_error(34, ZODB.utils.p64(10 ** 6),
+                 'Data length 1000000 out of bounds')
+
+
+def test_magic__verify__6(zodb_storage, zodb_root):
+    """It detects broken back pointers and truncated data record headers."""
+    path = create_file(zodb_storage, zodb_root)
+    iterator = ZODB.FileStorage.FileIterator(path)
+    # The undo record of `obj` points back to the data of the first change:
+    pos = [record.pos for transaction_ in iterator for record in transaction_
+           if record.data_txn][0]
+    iterator.close()
+    patch_file(path, pos + DATA_HDR_LEN, ZODB.utils.p64(10 ** 6))
+    with pytest.raises(ValueError) as err:
+        verify(path)
+    assert 'Back pointer 1000000 out of bounds at {}.'.format(pos) in str(
+        err.value)
+    with open(path, 'rb') as file:
+        file.seek(4)
+        header = struct.unpack(TRANS_HDR, file.read(TRANS_HDR_LEN))
+    # Let the meta data end one byte before the end of the transaction:
+    length, user_length, description_length = header[1], header[3], header[4]
+    patch_file(path, 25, struct.pack(
+        '>H', length - 1 - TRANS_HDR_LEN - user_length - description_length))
+    with pytest.raises(ValueError) as err:
+        verify(path)
+    assert 'Truncated data record header at {}.'.format(3 + length) in str(
+        err.value)
+
+
+def test_magic__main__2(zodb_storage, zodb_root, capsys):
+    """It verifies the file before setting the magic bytes if requested."""
+    path = create_file(zodb_storage, zodb_root)
+    zodb.py3migrate.magic.main([path, 'Python3', '--verify'])
+    out, err = capsys.readouterr()
+    assert 'Verified 4 transactions with 5 data records.\n' == out
+    with open(path) as file:
+        assert 'FS30' == file.read(4)
+
+
+def test_magic__main__3(zodb_storage, zodb_root, capsys):
+    """It does not set the magic bytes if the verification fails."""
+    path = create_file(zodb_storage, zodb_root)
+    patch_file(path, 20, 'c')
+    with pytest.raises(SystemExit) as err:
+        zodb.py3migrate.magic.main([path, 'Python3', '--verify'])
+    assert 1 == err.value.code
+    out, err = capsys.readouterr()
+    assert 'unfinished or unknown transaction at 4.\n' in err
+    with open(path) as file:
+        assert 'FS21' == file.read(4)
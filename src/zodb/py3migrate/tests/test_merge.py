@@ -0,0 +1,175 @@
+from ..merge import merge_results, check_shards
+import json
+import pytest
+import zodb.py3migrate.merge
+
+
+def write_result(tmpdir, name, shard, result, errors=None, samples=None,
+                 error_summary=None, last_transaction='0x03'):
+    """Write a result file as written by `analyze --output`."""
+    path = str(tmpdir.join(name))
+    data = {
+        'format': 'zodb.py3migrate.analyze 1',
+        'storage': name + '.fs',
+        'last_transaction': last_transaction,
+        'max_oid': '0x05',
+        'shard': shard,
+        'result': result,
+        'errors': errors or {},
+        'samples': samples or {},
+    }
+    if error_summary is not None:
+        # Files written by older versions do not contain it.
+        data['error_summary'] = error_summary
+    with open(path, 'w') as file:
+        json.dump(data, file)
+    return path
+
+
+def error_entry(oids, count=None, exception='ValueError'):
+    """Return an entry of the error summary of a result file."""
+    return {'name': 'Foo.a', 'exception': exception,
+            'count': count or len(oids), 'oids': oids,
+            'traceback': 'Traceback: {}'.format(oids[0])}
+
+
+def test_merge__merge_results__1(tmpdir):
+    """It adds the counts and keeps a random sample of the values."""
+    paths = [
+        write_result(tmpdir, 'a.json', [1, 2], {'Foo.a is string': 2},
+                     {'Bar': 1}, {'Foo.a is string': ['1', '2', '3']}),
+        write_result(tmpdir, 'b.json', [2, 2],
+                     {'Foo.a is string': 1, 'Foo.b is string': 1},
+                     {'Bar': 2}, {'Foo.a is string': ['4', '5']}),
+    ]
+    result, errors, samples, error_summary = merge_results(
+        paths, sample_size=4)
+    assert {'Foo.a is string': 3, 'Foo.b is string': 1} == result
+    assert {'Bar': 3} == errors
+    assert 4 == len(samples['Foo.a is string'])
+    assert set(samples['Foo.a is string']) <= set('12345')
+    assert {} == error_summary.counts
+
+
+def test_merge__merge_results__3(tmpdir):
+    """It merges the summaries of the values which cannot be scanned."""
+    paths = [
+        write_result(tmpdir, 'a.json', [1, 2], {}, error_summary=[
+            error_entry(['0x01', '0x02'], count=3)]),
+        write_result(tmpdir, 'b.json', [2, 2], {}, error_summary=[
+            error_entry(['0x03', '0x04']),
+            error_entry(['0x05'], exception='KeyError')]),
+    ]
+    error_summary = merge_results(paths, sample_size=3)[3]
+    assert {('Foo.a', 'ValueError'): 5,
+            ('Foo.a', 'KeyError'): 1} == error_summary.counts
+    assert [b'\0' * 7 + x for x in b'\1\2\3'] == error_summary.oids[
+        ('Foo.a', 'ValueError')]
+    assert 'Traceback: 0x01' == error_summary.tracebacks[
+        ('Foo.a', 'ValueError')]
+
+
+def test_merge__merge_results__2(tmpdir):
+    """It refuses files of other formats."""
+    path = str(tmpdir.join('a.json'))
+    with open(path, 'w') as file:
+        json.dump({}, file)
+    with pytest.raises(ValueError) as err:
+        merge_results([path])
+    assert 'a.json is not an analysis result of a known format.' in str(
+        err.value)
+
+
+def test_merge__check_shards__1(caplog):
+    """It checks that the shards belong to one analysis."""
+    check_shards([None, None], [('0x03', '0x05')] * 2)
+    check_shards([[2, 3], [1, 3], [3, 3]], [('0x03', '0x05')] * 3)
+    assert [] == caplog.records
+    with pytest.raises(ValueError) as err:
+        check_shards([[1, 2], [2, 3]], [('0x03', '0x05')] * 2)
+    assert 'The results are of different shardings.' == str(err.value)
+    with pytest.raises(ValueError) as err:
+        check_shards([[1, 2], None], [('0x03', '0x05')] * 2)
+    assert 'The results are of different shardings.' == str(err.value)
+    with pytest.raises(ValueError) as err:
+        check_shards([[1, 2], [1, 2]], [('0x03', '0x05')] * 2)
+    assert 'A shard is given more than once.' == str(err.value)
+    check_shards([[2, 4]], [('0x03', '0x05')])
+    assert ['The results of the shards 1, 3, 4 of 4 are missing.'] == [
+        x.getMessage() for x in caplog.records]
+
+
+def test_merge__check_shards__2():
+    """It refuses results of different storages.
+
+    They are told apart by their last transaction and their largest OID.
+    """
+    with pytest.raises(ValueError) as err:
+        check_shards([[1, 2], [2, 2]], [('0x03', '0x05'), ('0x03', '0x04')])
+    assert ('The results are of different storages: 0x03 0x04, 0x03 0x05 '
+            '(last transaction, max OID)' == str(err.value))
+    check_shards([[1, 2], [2, 2]], [('0x03', '0x05'), ('0x03', '0x05')])
+
+
+def test_merge__main__1(tmpdir, capsys):
+    """It prints the report of the merged results."""
+    paths = [
+        write_result(tmpdir, 'a.json', [1, 2], {'Foo.a is string': 2},
+                     samples={'Foo.a is string': ['1']}),
+        write_result(tmpdir, 'b.json', [2, 2], {'Foo.a is string': 1},
+                     {'Bar': 2}),
+    ]
+    zodb.py3migrate.merge.main(paths + ['-v'])
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+Found 1 binary fields: (number of occurrences)
+Foo.a is string (3)
+
+Sample values:
+Foo.a is string: 1
+""")
+    assert 'Bar (2)' in out
+
+
+def test_merge__main__4(tmpdir, capsys):
+    """It prints the merged summary of the values which cannot be scanned."""
+    path = write_result(tmpdir, 'a.json', None, {}, error_summary=[
+        error_entry(['0x01'])])
+    zodb.py3migrate.merge.main([path])
+    out, err = capsys.readouterr()
+    assert out.endswith("""\
+Could not scan the values of 1 fields: (exception, number of occurrences, \
+sample OIDs)
+Foo.a ValueError (1, 0x01)
+  Traceback: 0x01
+""")
+
+
+def test_merge__main__2(tmpdir, capsys):
+    """It exits with an error message if the results cannot be merged."""
+    paths = [write_result(tmpdir, 'a.json', [1, 2], {}),
+             write_result(tmpdir, 'b.json', [1, 2], {})]
+    with pytest.raises(SystemExit) as err:
+        zodb.py3migrate.merge.main(paths)
+    assert 1 == err.value.code
+    out, err = capsys.readouterr()
+    assert 'A shard is given more than once.\n' == err
+    paths = [write_result(tmpdir, 'a.json', [1, 2], {}),
+             write_result(tmpdir, 'b.json', [2, 2], {},
+                          last_transaction='0x04')]
+    with pytest.raises(SystemExit):
+        zodb.py3migrate.merge.main(paths)
+    out, err = capsys.readouterr()
+    assert err.startswith('The results are of different storages: 0x03 ')
+
+
+def test_merge__main__3(tmpdir, capsys):
+    """It prints only the occurrences if not verbose."""
+    path = write_result(tmpdir, 'a.json', None, {'Foo.a is string': 2},
+                        {'Bar': 2}, {'Foo.a is string': ['1']})
+    zodb.py3migrate.merge.main([path])
+    out, err = capsys.readouterr()
+    assert """\
+Found 1 binary fields: (number of occurrences)
+Foo.a is string (2)
+""" == out
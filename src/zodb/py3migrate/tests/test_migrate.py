@@ -1,8 +1,11 @@
 # encoding: utf-8
 from ..testing import Example
 from ..migrate import print_results, find_obj_with_binary_content, run
-from ..migrate import get_argparse_parser
+from ..migrate import get_argparse_parser, iter_prefetched
+from ..migrate import iter_storage_oids
+from ..storage import ZlibStorage
 import ZODB.POSException
+import ZODB.utils
 import mock
 import pytest
 import transaction
@@ -141,3 +144,82 @@ asdf.Qwe (2)
 Converted 1 binary fields: (number of occurrences)
 foo.Bar.baz (3)
 ''' == out
+
+
+def test_migrate__find_obj_with_binary_content__4(zodb_storage, zodb_root):
+    """It looks only at the given OIDs."""
+    zodb_root['obj'] = Example(
+        binary=b'bär1',
+        reference=Example(binary=b'bär2'))
+    transaction.commit()
+    result = list(find_obj_with_binary_content(
+        zodb_storage, {}, oids=[zodb_root['obj'].reference._p_oid]))
+    assert 1 == len(result)
+    assert b'bär2' == result[0][3]
+
+
+def test_migrate__run__4(parser):
+    """It closes the storage after calling the callable."""
+    with mock.patch('ZODB.FileStorage.FileStorage') as filestorage:
+        run(parser, echo, args=['path/to/Data.fs'])
+        filestorage().close.assert_called_once_with()
+
+
+def test_migrate__run__5(zodb_storage, zodb_root, caplog):
+    """It opens the storage read-only without locking it if requested."""
+    zodb_root['obj'] = Example()
+    transaction.commit()
+    last_transaction = zodb_storage.lastTransaction()
+    parser = get_argparse_parser('desc')
+    # The storage is still opened by the `zodb_storage` fixture:
+    storage, = run(parser, echo, args=[zodb_storage.getName(), '--read-only'])
+    assert storage.isReadOnly()
+    assert last_transaction == storage.lastTransaction()
+    assert caplog.records[-1].getMessage().startswith('Reading ')
+
+
+def test_migrate__run__7(parser):
+    """It prepares the index unless reading read-only."""
+    with mock.patch('ZODB.FileStorage.FileStorage'), \
+            mock.patch('zodb.py3migrate.migrate.prepare_index') as prepare:
+        run(parser, echo, args=['path/to/Data.fs', '--read-only'])
+        assert not prepare.called
+        run(parser, echo, args=['path/to/Data.fs'])
+        prepare.assert_called_once_with('path/to/Data.fs', None)
+
+
+def test_migrate__run__6(zodb_storage, parser):
+    """It wraps the storage if it is compressed."""
+    storage, = run(parser, echo,
+                   args=[zodb_storage.getName(), '--zlib', '--read-only'])
+    assert isinstance(storage, ZlibStorage)
+
+
+def test_migrate__iter_prefetched__1():
+    """It prefetches the next batch while iterating the current one."""
+    connection = mock.Mock()
+    oids = iter_prefetched(connection, range(5), size=2)
+    assert 0 == next(oids)
+    assert [mock.call([0, 1]), mock.call([2, 3])] == \
+        connection.prefetch.call_args_list
+    assert [1, 2, 3, 4] == list(oids)
+    assert mock.call([4]) == connection.prefetch.call_args
+
+
+def test_migrate__iter_storage_oids__1(zodb_storage, zodb_root):
+    """It iterates the OIDs without reading the records.
+
+    It starts at `start_at` if given.
+    """
+    zodb_root['obj'] = Example()
+    zodb_root['obj2'] = Example()
+    transaction.commit()
+    storage = ZlibStorage(zodb_storage)
+    with mock.patch.object(zodb_storage, 'load') as load, \
+            mock.patch('zodb.py3migrate.storage.decompress') as decompress:
+        assert [0, 1, 2] == [ZODB.utils.u64(x)
+                             for x in iter_storage_oids(storage)]
+        assert [ZODB.utils.p64(2)] == list(
+            iter_storage_oids(storage, start_at='0x02'))
+    assert not load.called
+    assert not decompress.called
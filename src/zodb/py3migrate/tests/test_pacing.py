@@ -0,0 +1,56 @@
+from ..pacing import Pacer, get_pacer
+import mock
+import multiprocessing
+
+
+def test_pacing__Pacer__1():
+    """It sleeps if there are not enough objects left in the bucket."""
+    with mock.patch('zodb.py3migrate.pacing.time') as time:
+        time.time.return_value = 100.0
+        pacer = Pacer(objects_per_sec=2)
+        pacer.pace()
+        pacer.pace()
+        assert not time.sleep.called
+        pacer.pace()
+        time.sleep.assert_called_with(0.5)
+        # The bucket gets refilled over time:
+        time.sleep.reset_mock()
+        time.time.return_value = 102.0
+        pacer.pace()
+        assert not time.sleep.called
+
+
+def test_pacing__Pacer__2():
+    """It waits for the bucket with the highest debt."""
+    with mock.patch('zodb.py3migrate.pacing.time') as time:
+        time.time.return_value = 100.0
+        pacer = Pacer(objects_per_sec=10, bytes_per_sec=100)
+        pacer.pace(size=300)
+        time.sleep.assert_called_with(2.0)
+
+
+def test_pacing__Pacer__3():
+    """It shares the buckets with forked processes."""
+    pacer = Pacer(objects_per_sec=1)
+    pacer._state[0] = 0.0
+    process = multiprocessing.Process(
+        target=pacer.pace, kwargs=dict(objects=0, size=10))
+    process.start()
+    process.join()
+    # The time of the last update was changed by the other process:
+    assert pacer._state[0] > 0
+    with mock.patch('zodb.py3migrate.pacing.time.sleep'):
+        process = multiprocessing.Process(
+            target=pacer.pace, kwargs=dict(objects=3))
+        process.start()
+        process.join()
+    assert pacer._state[1] < -1
+
+
+def test_pacing__get_pacer__1():
+    """It returns a pacer only if there is a limit."""
+    assert get_pacer() is None
+    pacer = get_pacer(max_read_rate=2)
+    assert (None, 2 * 1024 * 1024) == pacer.rates
+    pacer = get_pacer(max_objects_per_sec=5)
+    assert (5, None) == pacer.rates
@@ -0,0 +1,55 @@
+# encoding: utf-8
+from ..migrate import find_obj_with_binary_content
+from ..profiling import MemoryProfile
+from ..testing import Example
+import mock
+import transaction
+
+
+def test_profiling__MemoryProfile__1(zodb_storage, zodb_root, tmpdir):
+    """It records the memory use at the start, the watermarks and the end."""
+    for i in range(3):
+        zodb_root[i] = Example(text=b'tëxt')
+    transaction.commit()
+    profile = MemoryProfile(top=3)
+    errors = {}
+    profile.watch(errors=errors)
+    list(find_obj_with_binary_content(
+        zodb_storage, errors, watermark=3, profile=profile))
+    assert [0, 3, 4] == [x.count for x in profile.watermarks]
+    assert (0, 0) == (profile.watermarks[0].cached,
+                      profile.watermarks[0].non_ghosts)
+    assert {'errors': 0} == profile.watermarks[-1].lengths
+    assert profile.last.types['Example'] >= 3
+    assert profile.first is not profile.last
+    path = str(tmpdir.join('profile.txt'))
+    profile.write_report(path)
+    with open(path) as file:
+        report = file.read()
+    assert report.startswith(
+        'Memory at 3 watermarks: (objects analyzed, max RSS in KB, objects '
+        'in the pickle cache, non-ghosts, lengths)\n0 (')
+    assert ('\nGrowth of the number of objects per type: (first, last '
+            'watermark)\n' in report)
+    assert report.endswith(
+        'Top allocation sites since the first watermark:\n'
+        'tracemalloc is not available.\n')
+
+
+def test_profiling__MemoryProfile__2(zodb_storage, tmpdir):
+    """It reports the top allocation sites if `tracemalloc` is available."""
+    with mock.patch('zodb.py3migrate.profiling.tracemalloc') as tracemalloc:
+        tracemalloc.is_tracing.return_value = False
+        tracemalloc.take_snapshot().compare_to.return_value = [
+            'migrate.py:1: size=2 KiB (+2 KiB)',
+            'analyze.py:2: size=1 KiB (+1 KiB)']
+        profile = MemoryProfile(top=1)
+        list(find_obj_with_binary_content(zodb_storage, {}, limit=0,
+                                          profile=profile))
+    tracemalloc.start.assert_called_with()
+    path = str(tmpdir.join('profile.txt'))
+    profile.write_report(path)
+    with open(path) as file:
+        assert file.read().endswith(
+            'Top allocation sites since the first watermark:\n'
+            'migrate.py:1: size=2 KiB (+2 KiB)\n')
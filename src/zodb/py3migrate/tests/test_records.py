@@ -0,0 +1,159 @@
+# encoding: utf-8
+from ..records import get_record_classname, has_binary_strings
+from ..records import OIDBitmap, iter_reachable_oids
+from ..records import optimize_record, time_load, rename_classes
+from ..testing import Example
+import ZODB._compat
+import ZODB.utils
+import cStringIO
+import collections
+import datetime
+import mock
+import persistent.mapping
+import transaction
+
+
+def test_records__get_record_classname__1(zodb_storage, zodb_root):
+    """It returns the dotted name of the class of a record."""
+    zodb_root['obj'] = Example()
+    transaction.commit()
+    data, tid = ZODB.utils.load_current(zodb_storage, zodb_root['obj']._p_oid)
+    assert 'zodb.py3migrate.testing.Example' == get_record_classname(data)
+
+
+def test_records__has_binary_strings__1(zodb_storage, zodb_root):
+    """It tells whether a record contains non-ASCII `str` objects."""
+    zodb_root['ascii'] = Example(text=b'text')
+    zodb_root['binary'] = Example(text=b'tëxt')
+    transaction.commit()
+    ascii, tid = ZODB.utils.load_current(
+        zodb_storage, zodb_root['ascii']._p_oid)
+    binary, tid = ZODB.utils.load_current(
+        zodb_storage, zodb_root['binary']._p_oid)
+    assert not has_binary_strings(ascii)
+    assert has_binary_strings(binary)
+
+
+def test_records__OIDBitmap__1():
+    """It is a set of OIDs."""
+    bitmap = OIDBitmap()
+    assert ZODB.utils.p64(1000) not in bitmap
+    assert bitmap.add(ZODB.utils.p64(1000))
+    assert not bitmap.add(ZODB.utils.p64(1000))
+    assert bitmap.add(ZODB.utils.p64(3))
+    assert ZODB.utils.p64(1000) in bitmap
+    assert ZODB.utils.p64(3) in bitmap
+    assert ZODB.utils.p64(4) not in bitmap
+
+
+def test_records__OIDBitmap__2():
+    """It keeps the OIDs beyond `max_bytes` in a set."""
+    bitmap = OIDBitmap(max_bytes=2)
+    assert bitmap.add(ZODB.utils.p64(2 ** 62))
+    assert not bitmap.add(ZODB.utils.p64(2 ** 62))
+    assert bitmap.add(ZODB.utils.p64(15))
+    assert bitmap.add(ZODB.utils.p64(16))
+    assert 2 == len(bitmap._bits)
+    assert ZODB.utils.p64(2 ** 62) in bitmap
+    assert ZODB.utils.p64(15) in bitmap
+    assert ZODB.utils.p64(16) in bitmap
+    assert ZODB.utils.p64(17) not in bitmap
+
+
+def test_records__iter_reachable_oids__1(zodb_storage, zodb_root):
+    """It yields only the OIDs reachable from the root object."""
+    zodb_root['obj'] = Example(reference=Example(), cycle=zodb_root)
+    zodb_root['garbage'] = Example()
+    transaction.commit()
+    garbage = zodb_root.pop('garbage')._p_oid
+    transaction.commit()
+    oids = list(iter_reachable_oids(zodb_storage))
+    assert [ZODB.utils.z64, zodb_root['obj']._p_oid,
+            zodb_root['obj'].reference._p_oid] == oids
+    assert garbage not in oids
+
+
+def test_records__iter_reachable_oids__2(zodb_storage, caplog):
+    """It logs dangling references."""
+    assert [] == list(iter_reachable_oids(
+        zodb_storage, root=ZODB.utils.p64(42)))
+    assert 'Dangling reference to 0x2a.' == caplog.records[-1].getMessage()
+
+
+def load_record(data):
+    """Unpickle both pickles of a record, keep persistent references."""
+    unpickler = ZODB._compat.Unpickler(cStringIO.StringIO(data))
+    unpickler.persistent_load = lambda reference: reference
+    return unpickler.load(), unpickler.load()
+
+
+def test_records__optimize_record__1(zodb_storage, zodb_root):
+    """It removes the unused memo entries from both pickles of a record."""
+    zodb_root['obj'] = persistent.mapping.PersistentMapping(
+        a=[1, 2], b=u'bär', c=persistent.mapping.PersistentMapping())
+    transaction.commit()
+    data, tid = ZODB.utils.load_current(zodb_storage, zodb_root['obj']._p_oid)
+    optimized = optimize_record(data)
+    assert len(optimized) < len(data)
+    assert optimized == optimize_record(optimized)
+    # The reference to `c` refers to the memo entry of the class pickle:
+    assert 'PersistentMapping\nq\x01.' in optimized
+    assert load_record(data) == load_record(optimized)
+
+
+def test_records__time_load__1(zodb_storage, zodb_root):
+    """It returns the seconds unpickling a record takes."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    # The root object refers to another persistent object:
+    data, tid = ZODB.utils.load_current(zodb_storage, ZODB.utils.z64)
+    with mock.patch('zodb.py3migrate.records.time') as time:
+        time.time.side_effect = [10.0, 10.5]
+        assert 0.5 == time_load(data)
+
+
+class Plain(object):
+    """Class whose instances are pickled into the state of their owner."""
+
+    def __init__(self):
+        self.text = b'tëxt'
+
+
+class Items(list):
+    """List whose items are appended when unpickling."""
+
+    def __reduce__(self):
+        return (Items, (), None, iter(self))
+
+
+def test_records__time_load__2(zodb_storage, zodb_root):
+    """It does not import the classes a record refers to."""
+    zodb_root['obj'] = Example(
+        text=b'tëxt', date=datetime.date(2020, 1, 1), plain=Plain(),
+        ordered=collections.OrderedDict(a=1), items=Items([1]))
+    transaction.commit()
+    data, tid = ZODB.utils.load_current(zodb_storage, zodb_root['obj']._p_oid)
+    data = rename_classes(
+        data, {'zodb.py3migrate.testing.Example': 'gonemod.Gone'}, {})
+    with mock.patch('zodb.py3migrate.records.time') as time:
+        time.time.side_effect = [10.0, 10.5]
+        assert 0.5 == time_load(data)
+
+
+def test_records__rename_classes__1(zodb_storage, zodb_root):
+    """It rewrites the class references of both pickles of a record."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    renames = {'zodb.py3migrate.testing.Example': 'new_module.NewExample'}
+    counts = {}
+    data, tid = ZODB.utils.load_current(zodb_storage, zodb_root['obj']._p_oid)
+    data = rename_classes(data, renames, counts)
+    assert 'new_module.NewExample' == get_record_classname(data)
+    # The persistent reference of the root object contains the class, too:
+    data, tid = ZODB.utils.load_current(zodb_storage, ZODB.utils.z64)
+    data = rename_classes(data, renames, counts)
+    assert 'persistent.mapping.PersistentMapping' == get_record_classname(
+        data)
+    assert 'cnew_module\nNewExample\n' in data
+    assert {('zodb.py3migrate.testing.Example',
+             'new_module.NewExample'): 2} == counts
@@ -0,0 +1,165 @@
+# encoding: utf-8
+from ..scanners import AttributeProxy, StateProxy, get_scanner
+from ..scanners import get_slot_names, register_scanner, scan_dict
+from ..scanners import scan_bucket, scan_nothing, scan_state
+from ..scanners import get_tree_classname, iter_bucket_oids
+from ..testing import Example, SlotsExample
+import BTrees.IIBTree
+import BTrees.OOBTree
+import mock
+import pytest
+import zodb.py3migrate.scanners
+
+
+@pytest.yield_fixture('function')
+def scanners():
+    """Restore the registered scanners after the test."""
+    registered = zodb.py3migrate.scanners.SCANNERS.copy()
+    yield zodb.py3migrate.scanners.SCANNERS
+    zodb.py3migrate.scanners.SCANNERS.clear()
+    zodb.py3migrate.scanners.SCANNERS.update(registered)
+    zodb.py3migrate.scanners._cache.clear()
+
+
+class State(object):
+    """Object having only a state."""
+
+    __slots__ = ()
+
+    def __init__(self, state):
+        self.__setstate__(state)
+
+    def __getstate__(self):
+        return self._state
+
+    def __setstate__(self, state):
+        State._states[id(self)] = state
+
+    @property
+    def _state(self):
+        return State._states.get(id(self))
+
+
+State._states = {}
+
+
+class Classic:
+    """Old style class."""
+
+
+def test_scanners__get_scanner__1():
+    """It chooses the scanner according to the class of the object."""
+    assert scan_dict is get_scanner(Example())
+    assert scan_dict is get_scanner(Classic())
+    assert isinstance(get_scanner(SlotsExample())(SlotsExample()),
+                      AttributeProxy)
+    assert scan_state is get_scanner(BTrees.IIBTree.IIBTree())
+    assert scan_bucket is get_scanner(BTrees.OOBTree.OOBucket())
+    assert scan_bucket is get_scanner(BTrees.OOBTree.OOSet())
+    bucket = BTrees.OOBTree.OOBucket({'a': b'b'})
+    assert bucket is scan_bucket(bucket)
+    assert {'a': None} == scan_bucket(BTrees.OOBTree.OOSet(['a']))
+    assert scan_nothing is get_scanner(object())
+    assert scan_nothing(object()) is None
+
+
+def test_scanners__get_scanner__2():
+    """It caches the choice per class."""
+    get_scanner(Example())
+    with mock.patch('zodb.py3migrate.scanners.choose_scanner') as choose:
+        assert scan_dict is get_scanner(Example())
+    assert not choose.called
+
+
+def test_scanners__register_scanner__1(scanners):
+    """It uses registered scanners for the class and its subclasses."""
+    class SubExample(Example):
+        pass
+
+    def scanner(obj):
+        return {'foo': 'bar'}
+
+    get_scanner(SubExample())
+    register_scanner('zodb.py3migrate.testing.Example', scanner)
+    assert scanner is get_scanner(SubExample())
+    assert scanner is get_scanner(Example())
+
+
+def test_scanners__load_entry_points__1(scanners):
+    """It registers the scanners of the entry points."""
+    entry_point = mock.Mock()
+    entry_point.name = 'zodb.py3migrate.testing.Example'
+    entry_point.load.return_value = scan_nothing
+    zodb.py3migrate.scanners._cache.clear()
+    with mock.patch('pkg_resources.iter_entry_points',
+                    return_value=[entry_point]) as iter_entry_points:
+        assert scan_nothing is get_scanner(Example())
+    iter_entry_points.assert_called_with('zodb.py3migrate.scanners')
+
+
+def test_scanners__get_slot_names__1():
+    """It returns the slots of the class and its bases once."""
+    class Base(object):
+        __slots__ = 'text'
+
+    class Sub(Base):
+        __slots__ = ('title', 'text', '__weakref__')
+
+    assert ['title', 'text'] == get_slot_names(Sub)
+    assert ['text', 'title'] == get_slot_names(SlotsExample)
+
+
+def test_scanners__AttributeProxy__1():
+    """It reads and writes the given attributes."""
+    obj = SlotsExample(text=b't\xc3\xabxt')
+    proxy = AttributeProxy(obj, ['text', 'title'])
+    assert [('text', b't\xc3\xabxt')] == proxy.items()
+    proxy['title'] = u'title'
+    assert u'title' == obj.title
+
+
+def test_scanners__StateProxy__1():
+    """It writes changes of a dict state back to the object."""
+    obj = State({'text': b't\xc3\xabxt'})
+    proxy = scan_state(obj)
+    assert [('text', b't\xc3\xabxt')] == proxy.items()
+    proxy['text'] = u'tëxt'
+    assert {'text': u'tëxt'} == obj.__getstate__()
+
+
+def test_scanners__StateProxy__2():
+    """It writes changes of a tuple state back to the object."""
+    obj = State((1, b't\xc3\xabxt'))
+    proxy = StateProxy(obj, obj.__getstate__())
+    assert [(0, 1), (1, b't\xc3\xabxt')] == proxy.items()
+    proxy[1] = u'tëxt'
+    assert (1, u'tëxt') == obj.__getstate__()
+
+
+def test_scanners__scan_state__1():
+    """It returns `None` for an empty state."""
+    assert scan_state(BTrees.IIBTree.IIBTree()) is None
+
+
+def test_scanners__get_tree_classname__1():
+    """It returns the dotted name of the tree class of a bucket."""
+    class Bucket(BTrees.OOBTree.OOBucket):
+        pass
+
+    assert 'BTrees.OOBTree.OOBTree' == get_tree_classname(Bucket())
+    assert 'BTrees.OOBTree.OOTreeSet' == get_tree_classname(
+        BTrees.OOBTree.OOSet())
+
+
+def test_scanners__iter_bucket_oids__1(zodb_storage, zodb_root):
+    """It iterates the OIDs of the buckets of a tree."""
+    import transaction
+    zodb_root['tree'] = BTrees.OOBTree.OOBTree(
+        {'key{:03}'.format(i): i for i in range(200)})
+    zodb_root['small'] = BTrees.OOBTree.OOBTree({'key': 1})
+    transaction.commit()
+    oids = list(iter_bucket_oids(zodb_root['tree']))
+    assert 1 < len(oids)
+    assert None not in oids
+    assert [] == list(iter_bucket_oids(zodb_root['small']))
+    assert [] == list(iter_bucket_oids(Example()))
@@ -0,0 +1,132 @@
+# encoding: utf-8
+from ..analyze import analyze_storage
+from ..convert import convert_storage
+from ..records import optimize_record
+from ..storage import ZlibStorage, RepicklingStorage, compress, decompress
+from ..testing import Example
+from ZODB.Connection import TransactionMetaData
+from ZODB.DB import DB
+import ZODB.FileStorage
+import ZODB.utils
+import mock
+import pytest
+import transaction
+
+
+@pytest.yield_fixture('function')
+def zlib_storage(tmpdir):
+    """Create an empty compressed FileStorage."""
+    storage = ZlibStorage(
+        ZODB.FileStorage.FileStorage(str(tmpdir.join('Data.fs'))))
+    yield storage
+    storage.close()
+
+
+@pytest.yield_fixture('function')
+def zlib_root(zlib_storage):
+    """Return the root object of the compressed storage."""
+    transaction.abort()
+    db = DB(zlib_storage)
+    connection = db.open()
+    yield connection.root()
+    connection.close()
+
+
+def test_storage__compress__1():
+    """It compresses data if that makes it smaller."""
+    data = b'x' * 100
+    assert compress(data).startswith(b'.z')
+    assert data == decompress(compress(data))
+    assert b'xy' == compress(b'xy')
+    assert b'' == compress(b'')
+    assert compress(data) == compress(compress(data))
+    assert b'xy' == decompress(b'xy')
+
+
+def test_storage__ZlibStorage__1(zlib_storage, zlib_root):
+    """It compresses stored and decompresses loaded records."""
+    zlib_root['obj'] = Example(text=b'tëxt' * 100)
+    transaction.commit()
+    oid = zlib_root['obj']._p_oid
+    raw, tid = ZODB.utils.load_current(zlib_storage.base, oid)
+    assert raw.startswith(b'.z')
+    data, tid = zlib_storage.load(oid)
+    assert data == decompress(raw)
+    assert data == zlib_storage.loadSerial(oid, tid)
+    assert data == zlib_storage.record_iternext(oid)[2]
+    assert zlib_storage.loadBefore(oid, tid) is None
+    assert 2 == len(zlib_storage)
+    assert zlib_storage.getName().endswith('Data.fs')
+
+
+def test_storage__ZlibStorage__2(zlib_storage, zlib_root):
+    """It can be analyzed."""
+    zlib_root['obj'] = Example(text=b'tëxt' * 100)
+    transaction.commit()
+    result, errors = analyze_storage(zlib_storage)
+    assert {'zodb.py3migrate.testing.Example.text is string': 1} == result
+
+
+def test_storage__ZlibStorage__3(zlib_storage, zlib_root):
+    """It decompresses prefetched records in the background."""
+    zlib_root['obj'] = Example(text=b'tëxt' * 100)
+    transaction.commit()
+    oid = zlib_root['obj']._p_oid
+    tid = ZODB.utils.p64(ZODB.utils.u64(zlib_storage.lastTransaction()) + 1)
+    zlib_storage.prefetch([oid], tid)
+    zlib_storage.prefetch([ZODB.utils.z64], tid)
+    with mock.patch.object(zlib_storage, '_loadBefore') as load_before:
+        data, start, end = zlib_storage.loadBefore(oid, tid)
+    assert not load_before.called
+    assert data.startswith(b'\x80\x03czodb.py3migrate.testing\nExample')
+    assert {} == zlib_storage._prefetched_before
+
+
+def test_storage__ZlibStorage__4(zlib_storage):
+    """It compresses restored records."""
+    data = b'cpersistent.mapping\nPersistentMapping\nq\x01.}q\x02.' * 10
+    tid = ZODB.utils.p64(1)
+    meta_data = TransactionMetaData()
+    zlib_storage.tpc_begin(meta_data, tid)
+    zlib_storage.restore(ZODB.utils.z64, tid, data, '', None, meta_data)
+    zlib_storage.tpc_vote(meta_data)
+    zlib_storage.tpc_finish(meta_data)
+    raw, tid = ZODB.utils.load_current(zlib_storage.base, ZODB.utils.z64)
+    assert raw.startswith(b'.z')
+    assert data == zlib_storage.load(ZODB.utils.z64)[0]
+
+
+def test_storage__ZlibStorage__5(zlib_storage, zlib_root):
+    """It writes converted records compressed."""
+    zlib_root['obj'] = Example(text=b'tëxt' * 100)
+    transaction.commit()
+    convert_storage(
+        zlib_storage, {'zodb.py3migrate.testing.Example.text': 'utf-8'})
+    oid = zlib_root['obj']._p_oid
+    raw, tid = ZODB.utils.load_current(zlib_storage.base, oid)
+    assert raw.startswith(b'.z')
+    assert b'X' in decompress(raw)  # BINUNICODE opcode
+
+
+def test_storage__RepicklingStorage__1(zodb_storage, zodb_root):
+    """It optimizes the stored records and compares them to the old ones."""
+    zodb_root['obj'] = Example(text=b'tëxt')
+    transaction.commit()
+    oid = zodb_root['obj']._p_oid
+    old_data, tid = ZODB.utils.load_current(zodb_storage, oid)
+    storage = RepicklingStorage(zodb_storage)
+    db = DB(storage)
+    connection = db.open()
+    connection.get(oid).text = u'tëxt'
+    connection.root()['new'] = Example()
+    with mock.patch('zodb.py3migrate.storage.time_load') as time_load:
+        time_load.side_effect = [0.5, 0.25] * 2
+        transaction.commit()
+    data, tid = ZODB.utils.load_current(zodb_storage, oid)
+    assert data == optimize_record(data)
+    # New objects are not counted, the changed root object is:
+    assert ['persistent.mapping.PersistentMapping',
+            'zodb.py3migrate.testing.Example'] == sorted(storage.stats)
+    assert (1, len(old_data), len(data), 0.5, 0.25) == storage.stats[
+        'zodb.py3migrate.testing.Example']
+    connection.close()